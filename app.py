@@ -6,9 +6,9 @@ load_dotenv(".env")
 
 def main() -> None:
     "Entry fuction for the script"
-    from src.sgb_advisor import runner as runner
+    from src.sgb_advisor.__main__ import main as sgb_advisor_main
 
-    runner()
+    sgb_advisor_main()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,445 @@
+"""
+Times the hot paths of a run (the coupon schedule, the XIRR of one SGB at a time and of a whole snapshot, looking up scrips, parsing the NSE table, rendering and sending on Telegram) on the real scrips and on synthetic universes of bonds, and compares them against baseline.json.
+
+Run it from the root of the repo. Exits with 1 if any benchmark is slower than its baseline by more than the tolerance
+
+    python benchmarks/hot_paths.py
+    python benchmarks/hot_paths.py --sizes 10000 100000 1000000  # takes a few minutes
+    python benchmarks/hot_paths.py --update-baseline  # after an intended change, or on a new machine
+
+Telegram is sent to a fake Bot API server on localhost, so nothing leaves the machine. The real scrips are quoted and parsed from the NSE page in fixtures/nse_sgb_table.html, or from a page saved from the browser with --nse-html. Refresh the fixture from the live page with
+
+    python benchmarks/hot_paths.py --record-nse-html
+"""
+
+from argparse import ArgumentParser
+from datetime import date, datetime, timedelta, timezone
+from html.parser import HTMLParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from json import dumps as json_dumps
+from json import loads as json_loads
+from os import environ
+from pathlib import Path
+from random import Random
+from sys import path as sys_path
+from tempfile import mkdtemp
+from threading import Thread
+from time import perf_counter
+from typing import TYPE_CHECKING, Callable, NamedTuple, Optional
+
+if TYPE_CHECKING:
+    from sgb_advisor.data import NseRow
+    from sgb_advisor.models import SGB, Results
+
+SRC_DIR: Path = Path(__file__).resolve().parent.parent / "src"
+
+BASELINE_PATH: Path = Path(__file__).resolve().parent / "baseline.json"
+
+NSE_HTML_FIXTURE: Path = (
+    Path(__file__).resolve().parent / "fixtures" / "nse_sgb_table.html"
+)
+"""The #sgbTable of the NSE SGB page, in the markup the page renders. The real scrips are quoted from it"""
+
+NSE_LTP_SELECTOR: str = "#sgbTable > tbody > tr > td:nth-child(7)"
+
+AS_OF: date = date(2024, 11, 20)
+"""Day every universe is priced on, so the coupon schedules and XIRRs are the same on every run"""
+
+GOLD_PRICE: float = 7956.0
+
+DEFAULT_SIZES: list[int] = [10_000, 100_000]
+"""Bonds in the synthetic universes. 1,000,000 is left out by default since it takes minutes"""
+
+MAX_RENDER_SIZE: int = 100_000
+"""Universes larger than this aren't rendered, since the HTML alone would run into hundreds of megabytes"""
+
+TELEGRAM_CHATS: int = 10
+"""Chats the results are sent to on the fake server"""
+
+NOISE_MS: float = 2
+"""Milliseconds a benchmark may go over its allowance by, so that the tiny ones don't fail on jitter"""
+
+
+class Universe(NamedTuple):
+    """A set of bonds, with everything the benchmarks need built ahead of time"""
+
+    name: str
+    """"real", or the number of bonds"""
+
+    results: "Results"
+    """The bonds, priced as of AS_OF"""
+
+    scrips: dict[str, list[str]]
+    """Rows in the format of scrips.csv, keyed by NSE symbol"""
+
+    nse_html: str
+    """The NSE SGB table with every bond in it"""
+
+
+class NseTableParser(HTMLParser):
+    """Collects the name, last traded price and volume cells of every row of the #sgbTable table, like the selectors in `get_sgbs_from_nse_site()`"""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.rows: list["NseRow"] = list()
+        self._in_table = self._in_body = self._in_cell = False
+        self._cells: list[str] = list()
+
+    def handle_starttag(self, tag: str, attrs: list[tuple[str, Optional[str]]]) -> None:
+        if tag == "table" and ("id", "sgbTable") in attrs:
+            self._in_table = True
+        elif self._in_table and tag == "tbody":
+            self._in_body = True
+        elif self._in_body and tag == "tr":
+            self._cells = list()
+        elif self._in_body and tag == "td":
+            self._in_cell = True
+            self._cells.append("")
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag == "td":
+            self._in_cell = False
+        elif self._in_body and tag == "tr" and len(self._cells) >= 11:
+            self.rows.append((self._cells[0], self._cells[6], self._cells[10]))
+        elif tag == "tbody":
+            self._in_body = False
+        elif tag == "table":
+            self._in_table = False
+
+    def handle_data(self, data: str) -> None:
+        if self._in_cell:
+            self._cells[-1] += data.strip()
+
+
+def parse_nse_html(html: str) -> list["NseRow"]:
+    parser = NseTableParser()
+    parser.feed(html)
+    parser.close()
+    return parser.rows
+
+
+def build_nse_html(sgbs: "list[SGB]") -> str:
+    """The NSE SGB table, in the same markup as NSE_HTML_FIXTURE. The columns the scraper doesn't read repeat the last traded price"""
+    rows = "".join(
+        f'<tr><td><a href="/get-quote/equity?symbol={sgb.nse_symbol}" target="_blank">{sgb.nse_symbol}</a></td><td>GB</td>'
+        + f'<td class="text-right">{sgb.ltp:,.2f}</td>' * 5
+        + '<td class="text-right">0.00</td>' * 2
+        + f'<td class="text-right">{sgb.ltp * sgb.volume / 100_000:,.2f}</td><td class="text-right">{sgb.volume:,}</td></tr>\n'
+        for sgb in sgbs
+    )
+    return f'<!DOCTYPE html>\n<html>\n<body>\n<table id="sgbTable"><thead><tr><th><span>SYMBOL</span></th></tr></thead><tbody>\n{rows}</tbody></table>\n</body>\n</html>\n'
+
+
+def build_universe(
+    name: str, scrips: dict[str, list[str]], nse_html: Optional[str] = None
+) -> Universe:
+    """Quotes every bond in the NSE table, or prices every bond in the scrips that hasn't matured by AS_OF around the price of gold if there is no table"""
+    from sgb_advisor.data import parse_nse_table
+    from sgb_advisor.models import SGB, Results
+    from sgb_advisor.snapshot import compute_results
+
+    if nse_html is None:
+        random = Random(len(scrips))
+        symbols = [
+            symbol
+            for symbol, row in scrips.items()
+            if symbol.startswith("SGB")
+            and datetime.strptime(row[4], "%d/%m/%Y").date() > AS_OF
+        ]
+        quotes: list[SGB] = [
+            SGB(
+                symbol,
+                round(GOLD_PRICE * random.uniform(0.9, 1.1), 2),
+                0,
+                0,
+                AS_OF,
+                random.randint(1, 10_000),
+            )
+            for symbol in symbols
+        ]
+        nse_html = build_nse_html(quotes)
+    sgbs = parse_nse_table(parse_nse_html(nse_html), scrips)
+    generated_at = datetime.combine(
+        AS_OF, datetime.min.time(), timezone(timedelta(hours=5, minutes=30))
+    )
+    results = compute_results(Results(tuple(sgbs), GOLD_PRICE, generated_at), AS_OF)
+    return Universe(name, results, scrips, nse_html)
+
+
+def synthetic_scrips(size: int) -> dict[str, list[str]]:
+    """Bonds maturing over the 8 years after AS_OF, like the real ones, in the format of scrips.csv"""
+    random = Random(size)
+    scrips: dict[str, list[str]] = dict()
+    for i in range(size):
+        symbol = f"SGBX{i:07d}"
+        maturity = AS_OF + timedelta(days=random.randint(1, 8 * 365))
+        scrips[symbol] = [
+            symbol,
+            symbol,
+            random.choice(["2.50%", "2.75%"]),
+            "",
+            maturity.strftime("%d/%m/%Y"),
+            str(random.randint(2_600, 6_300)),
+        ]
+    return scrips
+
+
+class FakeTelegramHandler(BaseHTTPRequestHandler):
+    """Answers every Bot API call like Telegram would, without waiting"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format: str, *args: object) -> None:
+        pass
+
+    def do_POST(self) -> None:
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        message = {"message_id": 1, "chat": {"id": 1}, "document": {"file_id": "F"}}
+        result = (
+            [message, message] if self.path.endswith("/sendMediaGroup") else message
+        )
+        body = json_dumps({"ok": True, "result": result}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_fake_telegram() -> str:
+    """Starts the fake Bot API server on a free port, and returns its URL"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeTelegramHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def get_benchmarks(universe: Universe) -> dict[str, Callable[[], object]]:
+    """The benchmarks that run on a universe, each a function that runs it once"""
+    from sgb_advisor.data import get_scrips_by_symbol, parse_nse_table
+    from sgb_advisor.notify.render import render_artifacts
+    from sgb_advisor.quick_mafs import calculate_sgb_xirr, get_interest_payment_dates
+    from sgb_advisor.snapshot import compute_results
+
+    results = universe.results
+    benchmarks: dict[str, Callable[[], object]] = {
+        "coupons": lambda: [
+            get_interest_payment_dates(sgb.maturity_date, AS_OF) for sgb in results.sgbs
+        ],
+        "xirr.scalar": lambda: [
+            calculate_sgb_xirr(sgb, results.gold_price, AS_OF) for sgb in results.sgbs
+        ],
+        "xirr.batch": lambda: compute_results(results, AS_OF),
+        "scrips.lookup": lambda: [
+            universe.scrips[sgb.nse_symbol] for sgb in results.sgbs
+        ],
+        "nse.parse": lambda: parse_nse_table(
+            parse_nse_html(universe.nse_html), universe.scrips
+        ),
+    }
+    if universe.name == "real":
+        # Reads and indexes scrips.csv, which is cached for the rest of the process
+        benchmarks["scrips.load"] = get_scrips_by_symbol.__wrapped__
+    if len(results.sgbs) <= MAX_RENDER_SIZE:
+        benchmarks["render"] = lambda: render_artifacts(results, frozenset())
+    return benchmarks
+
+
+def get_telegram_benchmarks(universe: Universe) -> dict[str, Callable[[], object]]:
+    """Drawing the table image and sending it with the JSON to TELEGRAM_CHATS chats on the fake server"""
+    from sgb_advisor.config import Config
+    from sgb_advisor.notify.render import render_artifacts
+    from sgb_advisor.notify.teleg import (
+        MIME_TYPES,
+        TelegramDocument,
+        deliver_documents,
+        escape_reserved_characters,
+        render_native_table_image,
+    )
+
+    config = Config(
+        telegram_bot_token="1:benchmark",
+        telegram_chat_ids=tuple(str(i) for i in range(1, TELEGRAM_CHATS + 1)),
+        telegram_api_base_url=start_fake_telegram(),
+    )
+    artifacts = render_artifacts(universe.results, frozenset())
+    png = render_native_table_image(universe.results, frozenset())
+    documents = [
+        TelegramDocument(
+            "output.png",
+            png,
+            MIME_TYPES[".png"],
+            escape_reserved_characters(artifacts.caption),
+        ),
+        TelegramDocument("output.json", artifacts.json.encode(), MIME_TYPES[".json"]),
+    ]
+
+    def send() -> None:
+        failed, _ = deliver_documents(
+            documents, list(config.telegram_chat_ids), config=config
+        )
+        if failed:
+            raise RuntimeError(
+                f"could not send to {len(failed)} chat(s) on the fake server"
+            )
+
+    return {
+        "telegram.table_image": lambda: render_native_table_image(
+            universe.results, frozenset()
+        ),
+        "telegram.send": send,
+    }
+
+
+def record_nse_html(path: Path) -> None:
+    """Saves the #sgbTable of the live NSE page to the path, loading it like `get_sgbs_from_nse_site()`"""
+    from playwright.sync_api import sync_playwright
+
+    from sgb_advisor.data import NSE_SGB_URL
+
+    with sync_playwright() as p:
+        browser = p.firefox.launch()
+        user_agent = browser.new_page().evaluate("navigator.userAgent")
+        page = browser.new_page(user_agent=user_agent.replace("Headless", ""))
+        page.goto(NSE_SGB_URL, timeout=30000)
+        page.wait_for_selector(NSE_LTP_SELECTOR, timeout=30000)
+        table = page.locator("#sgbTable").evaluate("table => table.outerHTML")
+        browser.close()
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(
+        f"<!DOCTYPE html>\n<html>\n<body>\n{table}\n</body>\n</html>\n",
+        encoding="utf-8",
+    )
+
+
+def measure(benchmark: Callable[[], object], runs: int) -> float:
+    """Runs the benchmark, and returns the milliseconds the fastest run took"""
+    timings = list()
+    for _ in range(runs):
+        start = perf_counter()
+        benchmark()
+        timings.append(perf_counter() - start)
+    return min(timings) * 1000
+
+
+def main() -> int:
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="*",
+        default=DEFAULT_SIZES,
+        help=f"bonds in each synthetic universe (default: {' '.join(map(str, DEFAULT_SIZES))})",
+    )
+    parser.add_argument(
+        "--runs",
+        type=int,
+        default=3,
+        help="runs per benchmark. The fastest is compared against the baseline (default: 3)",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=1.5,
+        help="how many times slower than the baseline a benchmark may be (default: 1.5)",
+    )
+    parser.add_argument(
+        "--scale",
+        type=float,
+        default=1,
+        help="multiply every baseline by this, for slower machines (default: 1)",
+    )
+    parser.add_argument(
+        "--nse-html",
+        type=Path,
+        help=f"an NSE SGB page saved from the browser, parsed in place of {NSE_HTML_FIXTURE.name} for the real scrips",
+    )
+    parser.add_argument(
+        "--record-nse-html",
+        action="store_true",
+        help=f"save the table of the live NSE page to {NSE_HTML_FIXTURE.name} and exit",
+    )
+    parser.add_argument(
+        "--update-baseline",
+        action="store_true",
+        help=f"write the timings to {BASELINE_PATH.name} instead of comparing against it",
+    )
+    args = parser.parse_args()
+
+    # Read when sgb_advisor is imported, so set first. Nothing is logged, and every artifact goes to a throwaway folder
+    environ.update(
+        SGB_LOG_LEVEL="WARNING",
+        SGB_ARTIFACT_DIR=mkdtemp(prefix="sgb_advisor_benchmark_"),
+        SGB_HISTORY_DB_PATH="",
+        SGB_TELEGRAM_VALIDATION_TTL="0",
+    )
+    sys_path.insert(0, str(SRC_DIR))
+    from sgb_advisor.data import get_scrips_by_symbol
+
+    if args.record_nse_html:
+        record_nse_html(NSE_HTML_FIXTURE)
+        print(f"saved the NSE table to {NSE_HTML_FIXTURE}")
+        return 0
+
+    real = build_universe(
+        "real",
+        get_scrips_by_symbol(),
+        (args.nse_html or NSE_HTML_FIXTURE).read_text(encoding="utf-8"),
+    )
+    universes = [real] + [
+        build_universe(str(size), synthetic_scrips(size)) for size in args.sizes
+    ]
+
+    baseline: dict[str, float] = (
+        json_loads(BASELINE_PATH.read_text())["timings_ms"]
+        if BASELINE_PATH.exists() and not args.update_baseline
+        else dict()
+    )
+    timings: dict[str, float] = dict()
+
+    failed = False
+    print(
+        f"{'benchmark':<32} {'bonds':>8} {'ms':>10} {'us/bond':>8} {'baseline ms':>12}  result"
+    )
+    for universe in universes:
+        benchmarks = get_benchmarks(universe)
+        if universe.name == "real":
+            benchmarks.update(get_telegram_benchmarks(universe))
+
+        bonds = len(universe.results.sgbs)
+        for name, benchmark in benchmarks.items():
+            key = f"{name}/{universe.name}"
+            ms = timings[key] = measure(benchmark, args.runs)
+
+            expected = baseline.get(key)
+            if expected is None:
+                result = "new" if not args.update_baseline else "saved"
+                expected_text = "-"
+            else:
+                allowed = expected * args.scale * args.tolerance + NOISE_MS
+                result = "SLOWER" if ms > allowed else "ok"
+                failed = failed or ms > allowed
+                expected_text = f"{expected:.2f}"
+
+            print(
+                f"{key:<32} {bonds:>8} {ms:>10.2f} {ms * 1000 / max(bonds, 1):>8.2f} {expected_text:>12}  {result}"
+            )
+
+    if args.update_baseline:
+        BASELINE_PATH.write_text(
+            json_dumps(
+                {
+                    "note": "Fastest of --runs on the machine that wrote it. Run with --update-baseline to record new ones",
+                    "timings_ms": {key: round(ms, 3) for key, ms in timings.items()},
+                },
+                indent=4,
+            )
+            + "\n"
+        )
+        print(f"wrote {len(timings)} timings to {BASELINE_PATH}")
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
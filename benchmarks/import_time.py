@@ -0,0 +1,131 @@
+"""
+Checks how long the modules used by each notification mode take to import, using `python -X importtime`, against a budget per mode. Also checks that no mode imports the heavy libraries of another mode.
+
+Run it from the root of the repo. Exits with 1 if any mode is over its budget
+
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --scale 2  # on a slow machine
+"""
+
+from argparse import ArgumentParser
+from os import environ, pathsep
+from pathlib import Path
+from subprocess import run
+from sys import executable
+
+SRC_DIR: Path = Path(__file__).resolve().parent.parent / "src"
+
+START_MARKER: str = "--- sgb-advisor imports start ---"
+
+MODES: dict[str, list[str]] = {
+    "none": ["sgb_advisor.notify"],
+    "telegram": ["sgb_advisor.notify", "sgb_advisor.notify.teleg"],
+    "email": ["sgb_advisor.notify", "sgb_advisor.notify.email_sender"],
+    "both": [
+        "sgb_advisor.notify",
+        "sgb_advisor.notify.teleg",
+        "sgb_advisor.notify.email_sender",
+    ],
+    "serve": ["sgb_advisor.server"],
+}
+"""The modules each mode imports before it sends anything"""
+
+BUDGETS_MS: dict[str, float] = {
+    "none": 200,
+    "telegram": 400,
+    "email": 450,
+    "both": 600,
+    "serve": 250,
+}
+"""Milliseconds each mode may spend importing. Roughly twice what they take on a laptop"""
+
+FORBIDDEN: dict[str, set[str]] = {
+    "none": {"playwright", "boto3", "botocore", "requests", "PIL"},
+    "telegram": {"playwright", "boto3", "botocore"},
+    "email": {"playwright", "requests", "PIL"},
+    "both": {"playwright"},
+    "serve": {"playwright", "boto3", "botocore", "requests", "PIL"},
+}
+"""Top level packages each mode must not import. Playwright is only needed to scrape, or to render with the playwright renderer"""
+
+
+def measure(modules: list[str]) -> tuple[float, set[str]]:
+    """Imports the modules in a fresh interpreter, and returns the milliseconds taken and every top level package imported"""
+    code = (
+        f"import sys; sys.stderr.write({START_MARKER!r} + '\\n'); sys.stderr.flush()\n"
+        + "\n".join(f"import {module}" for module in modules)
+    )
+    env = {
+        **environ,
+        "PYTHONPATH": pathsep.join(
+            filter(None, [str(SRC_DIR), environ.get("PYTHONPATH")])
+        ),
+        # Nothing is logged on import at this level, so measuring leaves no log file behind
+        "SGB_LOG_LEVEL": "WARNING",
+    }
+    result = run(
+        [executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        env=env,
+        cwd=SRC_DIR.parent,
+        check=True,
+    )
+
+    lines = result.stderr.split(START_MARKER, 1)[-1].splitlines()
+    total_us = 0
+    packages: set[str] = set()
+    for line in lines:
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit():
+            # The header line
+            continue
+        packages.add(name.strip().split(".")[0])
+        # Only modules imported directly add to the total, since their cumulative time includes everything they import
+        if not name[1:].startswith(" "):
+            total_us += int(cumulative)
+    return total_us / 1000, packages
+
+
+def main() -> int:
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--scale",
+        type=float,
+        default=1,
+        help="multiply every budget by this, for slower machines (default: 1)",
+    )
+    parser.add_argument(
+        "--runs",
+        type=int,
+        default=5,
+        help="runs per mode. The fastest is compared against the budget (default: 5)",
+    )
+    args = parser.parse_args()
+
+    failed = False
+    print(f"{'mode':<10} {'import ms':>10} {'budget ms':>10}  result")
+    for mode, modules in MODES.items():
+        timings, packages = zip(*(measure(modules) for _ in range(args.runs)))
+        best = min(timings)
+        budget = BUDGETS_MS[mode] * args.scale
+        leaked = FORBIDDEN[mode] & set().union(*packages)
+
+        problems = list()
+        if best > budget:
+            problems.append("over budget")
+        if leaked:
+            problems.append(f"imports {', '.join(sorted(leaked))}")
+        failed = failed or bool(problems)
+
+        print(
+            f"{mode:<10} {best:>10.1f} {budget:>10.0f}  {'; '.join(problems) or 'ok'}"
+        )
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
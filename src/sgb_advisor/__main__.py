@@ -1,27 +1,373 @@
+from argparse import ArgumentParser, Namespace
 from os import getenv
 from pathlib import Path
+from typing import Optional
 
 from dotenv import load_dotenv
 
 
-def runner() -> None:
+def load_env() -> Path:
+    "Loads the .env file at SGB_ENV_FILE_PATH, and returns its path"
     # Need to load dotenv before importing/running any module file, since they use API keys from env modules
     SGB_ENV_FILE_PATH: Path = Path(
         getenv("SGB_ENV_FILE_PATH", str(Path.cwd() / ".env"))
     )
     load_dotenv(SGB_ENV_FILE_PATH)
+    return SGB_ENV_FILE_PATH
 
+
+def runner(save_snapshot: Optional[Path] = None) -> int:
+    SGB_ENV_FILE_PATH = load_env()
+
+    from .config import get_config as get_config
+    from .data import get_price_of_gold as get_price_of_gold
     from .data import get_sgbs as get_sgbs
+    from .history import get_history_db_path as get_history_db_path
+    from .history import record_run as record_run
+    from .history import record_tick as record_tick
     from .logg import logger as logger
+    from .metrics import span as span
+    from .models import Results as Results
     from .notify import notify as notify
+    from .notify.common import get_ist_time as get_ist_time
+    from .notify.dispatch import get_exit_status as get_exit_status
+    from .profiling import profile_stage as profile_stage
+    from .snapshot import write_snapshot as write_snapshot
 
     if SGB_ENV_FILE_PATH.exists():
-        logger.debug(f"Loaded environment variables from {SGB_ENV_FILE_PATH}")
+        logger.debug("Loaded environment variables from {}", SGB_ENV_FILE_PATH)
     "Entry fuction for the script"
 
-    sgbs = get_sgbs()
-    notify(sgbs)
+    with span("run"):
+        config = get_config()
+        with profile_stage("fetch"):
+            sgbs = get_sgbs(config)
+
+        if save_snapshot is not None:
+            with profile_stage("snapshot"):
+                write_snapshot(
+                    save_snapshot,
+                    Results(tuple(sgbs), get_price_of_gold(config), get_ist_time()),
+                )
+
+        if get_history_db_path():
+            with profile_stage("history"):
+                gold_price, run_at = get_price_of_gold(config), get_ist_time()
+                # Losing one snapshot of history shouldn't stop the results from being sent
+                # The run's quotes are what the API and the bot read, the ticks are a compact intraday store for rebuilding any point in time
+                try:
+                    record_run(sgbs, gold_price, run_at)
+                except Exception as e:
+                    logger.error(f"could not record run to history - {e}")
+                try:
+                    record_tick(sgbs, gold_price, run_at)
+                except Exception as e:
+                    logger.error(f"could not record tick to history - {e}")
+
+        with profile_stage("notify"):
+            channel_results = notify(sgbs, config)
+        return get_exit_status(channel_results)
+
+
+def compute(snapshot: Path, output: Optional[Path] = None) -> int:
+    "Calculates the XIRRs of the SGBs in a snapshot again, and prints the results or saves them as a snapshot"
+    load_env()
+
+    from json import dumps as json_dumps
+
+    from .snapshot import load_snapshot as load_snapshot
+    from .snapshot import write_snapshot as write_snapshot
+
+    results = load_snapshot(snapshot, recompute=True)
+    if output is None:
+        print(json_dumps(results.to_dict(), indent=4))
+    else:
+        write_snapshot(output, results)
+    return 0
+
+
+def render(snapshot: Path, image: bool = False) -> int:
+    "Renders the outputs of a snapshot into the artifact folder, without sending them"
+    load_env()
+
+    from .logg import logger as logger
+    from .notify.artifact_store import store_artifact as store_artifact
+    from .notify.render import render_artifacts as render_artifacts
+    from .snapshot import load_snapshot as load_snapshot
+
+    artifacts = render_artifacts(load_snapshot(snapshot))
+    paths = [
+        store_artifact(artifacts.html.encode(), "html"),
+        store_artifact(artifacts.json.encode(), "json"),
+    ]
+    if image:
+        from .notify.table_image import render_table_png as render_table_png
+
+        results = artifacts.results
+        paths.append(
+            store_artifact(
+                render_table_png(
+                    list(results.sgbs),
+                    results.gold_price,
+                    results.generated_at,
+                    artifacts.held_sgbs,
+                ),
+                "png",
+            )
+        )
+
+    logger.info(f"rendered {', '.join(str(path) for path in paths)}")
+    return 0
+
+
+def notify_snapshot(snapshot: Path) -> int:
+    "Sends the results in a snapshot through every mode that is set, without fetching anything"
+    load_env()
+
+    from .notify import notify_results as notify_results
+    from .notify.dispatch import get_exit_status as get_exit_status
+    from .snapshot import load_snapshot as load_snapshot
+
+    return get_exit_status(notify_results(load_snapshot(snapshot)))
+
+
+def batch(
+    source: Path, output: Path, workers: Optional[int] = None, chunk_size: int = 32
+) -> int:
+    "Ranks the SGBs in every snapshot of a folder or archive, into one JSON Lines file. Exits with 1 if any snapshot failed"
+    load_env()
+
+    from .batch import run_batch as run_batch
+
+    return 1 if run_batch(source, output, workers, chunk_size).failed else 0
+
+
+def worker(once: bool = False, interval: float = 5) -> int:
+    "Sends the deliveries queued in the outbox"
+    load_env()
+
+    from .notify import run_outbox_worker as run_outbox_worker
+
+    return run_outbox_worker(once, interval)
+
+
+def serve(
+    host: Optional[str] = None,
+    port: Optional[int] = None,
+    refresh_interval: Optional[float] = None,
+) -> int:
+    "Serves the history store over HTTP. Options that aren't given are read from the environment"
+    load_env()
+
+    from .server import SERVE_HOST as SERVE_HOST
+    from .server import SERVE_PORT as SERVE_PORT
+    from .server import SERVE_REFRESH_INTERVAL as SERVE_REFRESH_INTERVAL
+    from .server import serve as serve_api
+
+    return serve_api(
+        host or SERVE_HOST,
+        SERVE_PORT if port is None else port,
+        SERVE_REFRESH_INTERVAL if refresh_interval is None else refresh_interval,
+    )
+
+
+def bot() -> int:
+    "Answers commands sent to the Telegram bot"
+    load_env()
+
+    from .notify.bot import run_bot as run_bot
+
+    return run_bot()
+
+
+def scrape_stats(source: Optional[str] = None, days: Optional[int] = None) -> int:
+    "Prints how loading each site has gone, from the attempts recorded in the history database"
+    load_env()
+
+    from datetime import datetime, timedelta, timezone
+    from json import dumps as json_dumps
+
+    from .history import get_history_db_path, get_scrape_stats
+    from .logg import logger
+
+    if not get_history_db_path():
+        logger.error(
+            "scrape attempts are recorded in the history store, which is disabled since SGB_HISTORY_DB_PATH is set to an empty string"
+        )
+        return 1
+
+    since = datetime.now(timezone.utc).date() - timedelta(days=days) if days else None
+    print(json_dumps(get_scrape_stats(source, since), indent=2))
+    return 0
+
+
+SNAPSHOT_HELP: str = "JSON saved by run --save-snapshot or compute --output, or the JSON file sent on Telegram. XIRRs are calculated if it doesn't have them"
+
+
+def parse_args(argv: Optional[list[str]] = None) -> Namespace:
+    parser = ArgumentParser(
+        prog="sgb-advisor",
+        description="A tool to analyse Sovereign Gold Bonds and compare their yields.",
+    )
+    commands = parser.add_subparsers(dest="command")
+
+    run_parser = commands.add_parser(
+        "run", help="fetch the SGBs and notify (the default)"
+    )
+    run_parser.add_argument(
+        "--save-snapshot",
+        type=Path,
+        metavar="FILE",
+        help="also save what was fetched, to run compute, render or notify on later",
+    )
+
+    compute_parser = commands.add_parser(
+        "compute", help="calculate the XIRRs of a snapshot again, without fetching"
+    )
+    compute_parser.add_argument(
+        "--snapshot", type=Path, required=True, metavar="FILE", help=SNAPSHOT_HELP
+    )
+    compute_parser.add_argument(
+        "--output",
+        type=Path,
+        metavar="FILE",
+        help="save the results as a snapshot instead of printing them",
+    )
+
+    render_parser = commands.add_parser(
+        "render", help="render the outputs of a snapshot, without fetching or sending"
+    )
+    render_parser.add_argument(
+        "--snapshot", type=Path, required=True, metavar="FILE", help=SNAPSHOT_HELP
+    )
+    render_parser.add_argument(
+        "--image",
+        action="store_true",
+        help="also draw the table image with the native renderer",
+    )
+
+    notify_parser = commands.add_parser(
+        "notify", help="send the results in a snapshot, without fetching"
+    )
+    notify_parser.add_argument(
+        "--snapshot", type=Path, required=True, metavar="FILE", help=SNAPSHOT_HELP
+    )
+
+    batch_parser = commands.add_parser(
+        "batch",
+        help="rank the SGBs in every snapshot of a folder or archive, on many processes",
+    )
+    batch_parser.add_argument(
+        "source",
+        type=Path,
+        help="folder of snapshots (searched recursively for .json files), or a .zip, .tar, .tar.gz or .tgz of them",
+    )
+    batch_parser.add_argument(
+        "--output",
+        type=Path,
+        required=True,
+        metavar="FILE",
+        help="JSON Lines file with one line of ranked SGBs per snapshot, written as they finish",
+    )
+    batch_parser.add_argument(
+        "--workers", type=int, help="processes to use (default: number of CPUs)"
+    )
+    batch_parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=32,
+        help="snapshots sent to a process at once (default: 32)",
+    )
+
+    worker_parser = commands.add_parser(
+        "worker", help="send the deliveries queued in the outbox"
+    )
+    worker_parser.add_argument(
+        "--once",
+        action="store_true",
+        help="send what is due and exit, instead of polling forever",
+    )
+    worker_parser.add_argument(
+        "--interval",
+        type=float,
+        default=5,
+        help="seconds between polls of the outbox (default: 5)",
+    )
+
+    serve_parser = commands.add_parser(
+        "serve", help="serve the latest results and history over HTTP"
+    )
+    serve_parser.add_argument(
+        "--host", help="address to listen on (default: SGB_SERVE_HOST or 127.0.0.1)"
+    )
+    serve_parser.add_argument(
+        "--port", type=int, help="port to listen on (default: SGB_SERVE_PORT or 8080)"
+    )
+    serve_parser.add_argument(
+        "--refresh-interval",
+        type=float,
+        help="seconds between checks for a new run (default: SGB_SERVE_REFRESH_INTERVAL or 30)",
+    )
+
+    commands.add_parser(
+        "bot", help="answer /top, /sgb and /held sent to the Telegram bot"
+    )
+
+    scrape_stats_parser = commands.add_parser(
+        "scrape-stats",
+        help="print the timings and failure rates of loading each site, to tune timeouts and retries",
+    )
+    scrape_stats_parser.add_argument(
+        "--source", help='only this site, like "nse", "ibja" or "ibja_backup"'
+    )
+    scrape_stats_parser.add_argument(
+        "--days", type=int, help="only the attempts of the last DAYS days"
+    )
+
+    return parser.parse_args(argv)
+
+
+def dispatch(args: Namespace) -> None:
+    "Runs the command given on the command line"
+    if args.command == "compute":
+        raise SystemExit(compute(args.snapshot, args.output))
+
+    if args.command == "render":
+        raise SystemExit(render(args.snapshot, args.image))
+
+    if args.command == "notify":
+        raise SystemExit(notify_snapshot(args.snapshot))
+
+    if args.command == "batch":
+        raise SystemExit(batch(args.source, args.output, args.workers, args.chunk_size))
+
+    if args.command == "worker":
+        raise SystemExit(worker(args.once, args.interval))
+
+    if args.command == "bot":
+        raise SystemExit(bot())
+
+    if args.command == "serve":
+        raise SystemExit(serve(args.host, args.port, args.refresh_interval))
+
+    if args.command == "scrape-stats":
+        raise SystemExit(scrape_stats(args.source, args.days))
+
+    raise SystemExit(runner(getattr(args, "save_snapshot", None)))
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    "Entry point of the sgb-advisor script. Exits with 1 if anything failed to send"
+    args = parse_args(argv)
+
+    try:
+        dispatch(args)
+    finally:
+        # Imported here, after the command has loaded the .env, so that the paths set in it are used
+        from .metrics import export_metrics as export_metrics
+
+        export_metrics()
 
 
 if __name__ == "__main__":
-    runner()
+    main()
@@ -0,0 +1,224 @@
+"""
+Runs many snapshots through parsing, the XIRR calculation and ranking on a pool of processes, and writes them to one JSON Lines file as they finish. Snapshots are read one chunk at a time and only a few chunks are ever in flight, so memory stays the same however many snapshots there are.
+
+The source is a folder of snapshots (searched recursively for .json files), or a .zip, .tar, .tar.gz or .tgz archive of them. Look at `sgb_advisor.snapshot` for what a snapshot is.
+"""
+
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from json import dumps as json_dumps
+from os import cpu_count
+from pathlib import Path
+from tarfile import is_tarfile
+from tarfile import open as tar_open
+from time import perf_counter
+from typing import Iterator, NamedTuple, Optional
+from zipfile import ZipFile, is_zipfile
+
+from .logg import logger
+from .snapshot import SNAPSHOT_ERRORS, compute_results, parse_snapshot
+
+BATCH_CHUNK_SIZE: int = 32
+"""Snapshots sent to a worker at once. Larger chunks spend less time passing data between processes"""
+
+BATCH_PENDING_CHUNKS_PER_WORKER: int = 2
+"""Chunks queued per worker, so that workers never wait for the next chunk to be read, without reading the whole source ahead"""
+
+BATCH_PROGRESS_INTERVAL: float = 5
+"""Seconds between progress logs"""
+
+SnapshotSource = tuple[str, bytes]
+"""Name of a snapshot, and its JSON"""
+
+
+class BatchSummary(NamedTuple):
+    """What a batch did"""
+
+    processed: int
+    """Snapshots written to the output, including the ones that failed"""
+
+    failed: int
+    """Snapshots that could not be parsed or computed. Written to the output with an "error" """
+
+    seconds: float
+    """Time taken, from reading the first snapshot to writing the last"""
+
+    @property
+    def per_second(self) -> float:
+        """Throughput, in snapshots per second"""
+        return self.processed / self.seconds if self.seconds else 0
+
+
+def iter_snapshot_sources(source: Path) -> Iterator[SnapshotSource]:
+    """
+    Reads the snapshots in a folder or archive one at a time, in order of their names
+
+    Parameters
+    ----------
+    source : Path
+        A folder, or a zip or tar archive
+
+    Returns
+    -------
+    Iterator[SnapshotSource]
+        The name of every .json file, relative to the source, and its contents
+
+    Examples
+    --------
+    >>> next(iter_snapshot_sources(Path("snapshots.zip")))
+    ("2024-11-20.json", b'{"sgbs": [...], ...}')
+    """
+    if source.is_dir():
+        for path in sorted(source.rglob("*.json")):
+            yield str(path.relative_to(source)), path.read_bytes()
+
+    elif is_zipfile(source):
+        with ZipFile(source) as archive:
+            for name in sorted(archive.namelist()):
+                if name.endswith(".json"):
+                    yield name, archive.read(name)
+
+    elif is_tarfile(source):
+        # Members are read in the order they were added, since sorting a compressed tar would need it to be read twice
+        with tar_open(source, "r:*") as archive:
+            for member in archive:
+                f = archive.extractfile(member) if member.isfile() else None
+                if f is not None and member.name.endswith(".json"):
+                    yield member.name, f.read()
+
+    else:
+        msg = f"{source} is not a folder, zip or tar archive"
+        logger.error(msg)
+        raise RuntimeError(msg)
+
+
+def process_snapshot(name: str, content: bytes) -> tuple[str, bool]:
+    """
+    Parses a snapshot, calculates its XIRRs as of the day it was taken and ranks its SGBs
+
+    Parameters
+    ----------
+    name : str
+        Name of the snapshot, written along with its results
+    content : bytes
+        The JSON of the snapshot
+
+    Returns
+    -------
+    tuple[str, bool]
+        A line of JSON with the ranked SGBs, or with an "error" if the snapshot couldn't be processed, and whether it was processed
+
+    Examples
+    --------
+    >>> process_snapshot("2024-11-20.json", b'{"sgbs": [...], ...}')
+    ('{"snapshot": "2024-11-20.json", "generated_at": "2024-11-20T10:00:00+05:30", "gold_price": 7956.0, "sgbs": [{"rank": 1, "nse_symbol": "SGBJUN31I", ...}]}', True)
+    """
+    try:
+        results, _ = parse_snapshot(content)
+        results = compute_results(results, results.generated_at.date())
+    except SNAPSHOT_ERRORS as e:
+        return json_dumps({"snapshot": name, "error": repr(e)}), False
+
+    line = json_dumps(
+        {
+            "snapshot": name,
+            "generated_at": results.generated_at.isoformat(),
+            "gold_price": results.gold_price,
+            "sgbs": [
+                {"rank": rank, **sgb.to_dict()}
+                for rank, sgb in enumerate(results.sgbs, start=1)
+            ],
+        }
+    )
+    return line, True
+
+
+def process_chunk(chunk: list[SnapshotSource]) -> list[tuple[str, bool]]:
+    """Runs `process_snapshot()` on every snapshot in the chunk. Runs in the worker processes"""
+    return [process_snapshot(name, content) for name, content in chunk]
+
+
+def iter_chunks(
+    sources: Iterator[SnapshotSource], chunk_size: int
+) -> Iterator[list[SnapshotSource]]:
+    """Groups the sources into lists of at most chunk_size"""
+    chunk: list[SnapshotSource] = list()
+    for source in sources:
+        chunk.append(source)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = list()
+    if chunk:
+        yield chunk
+
+
+def run_batch(
+    source: Path,
+    output: Path,
+    workers: Optional[int] = None,
+    chunk_size: int = BATCH_CHUNK_SIZE,
+) -> BatchSummary:
+    """
+    Processes every snapshot in a folder or archive with `process_snapshot()`, and writes the results to a JSON Lines file in the order of the snapshots
+
+    Parameters
+    ----------
+    source : Path
+        A folder, or a zip or tar archive of snapshots
+    output : Path
+        The JSON Lines file to write. Replaced if it exists
+    workers : Optional[int]
+        Processes to use. Defaults to the number of CPUs
+    chunk_size : int
+        Snapshots sent to a worker at once. Defaults to BATCH_CHUNK_SIZE
+
+    Returns
+    -------
+    BatchSummary
+        How many snapshots were processed, how many failed and how long it took
+
+    Examples
+    --------
+    >>> run_batch(Path("snapshots.zip"), Path("ranked.jsonl"))
+    BatchSummary(processed=4380, failed=2, seconds=3.41)
+    """
+    workers = workers or cpu_count() or 1
+    max_pending = workers * BATCH_PENDING_CHUNKS_PER_WORKER
+
+    processed = failed = 0
+    start = last_progress = perf_counter()
+    pending: deque[Future[list[tuple[str, bool]]]] = deque()
+
+    def write_oldest() -> None:
+        nonlocal processed, failed, last_progress
+        lines = pending.popleft().result()
+        for line, ok in lines:
+            f.write(line + "\n")
+            failed += not ok
+        processed += len(lines)
+
+        if perf_counter() - last_progress >= BATCH_PROGRESS_INTERVAL:
+            last_progress = perf_counter()
+            logger.info(
+                f"processed {processed} snapshots, {processed / (last_progress - start):.0f} snapshots/s"
+            )
+
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with (
+        output.open("w") as f,
+        ProcessPoolExecutor(max_workers=workers) as executor,
+    ):
+        for chunk in iter_chunks(iter_snapshot_sources(source), chunk_size):
+            # Written in order, so a slow chunk holds back the ones after it instead of letting them pile up
+            if len(pending) >= max_pending:
+                write_oldest()
+            pending.append(executor.submit(process_chunk, chunk))
+
+        while pending:
+            write_oldest()
+
+    summary = BatchSummary(processed, failed, perf_counter() - start)
+    logger.info(
+        f"processed {summary.processed} snapshots ({summary.failed} failed) from {source} in {summary.seconds:.2f}s, {summary.per_second:.0f} snapshots/s, written to {output}"
+    )
+    return summary
@@ -0,0 +1,208 @@
+"""
+Caches the results of functions that fetch live data for a limited time, unlike `lru_cache` which keeps them for the life of the process. Callers that ask for a key while it is being fetched wait for that fetch instead of starting their own.
+"""
+
+from concurrent.futures import Future
+from functools import update_wrapper
+from os import getenv
+from threading import Lock
+from time import monotonic
+from typing import Callable, Generic, Hashable, NamedTuple, ParamSpec, TypeVar
+
+from .logg import logger
+
+P = ParamSpec("P")
+T = TypeVar("T")
+
+DATA_CACHE_TTL_ENV: str = "SGB_DATA_CACHE_TTL"
+DATA_CACHE_TTL: float = float(getenv(DATA_CACHE_TTL_ENV, "300") or 0)
+"""Seconds for which fetched prices (and the time they were fetched at) are reused. Set it to 0 to fetch every time"""
+
+DEFAULT_MAX_ENTRIES: int = 32
+"""Entries a cache keeps before the oldest ones are dropped"""
+
+
+class CacheStats(NamedTuple):
+    """Counters of a cache since it was created"""
+
+    name: str
+    """Name of the cached function"""
+
+    hits: int
+    """Calls answered from the cache"""
+
+    misses: int
+    """Calls that ran the function"""
+
+    coalesced: int
+    """Calls that waited for a call already running the function with the same arguments"""
+
+    size: int
+    """Entries currently cached, including expired ones that haven't been dropped yet"""
+
+
+class TTLCache(Generic[P, T]):
+    """
+    A function whose results are cached per arguments for `ttl` seconds. Every entry expires on its own, `ttl` seconds after it was fetched. Exceptions are never cached, and are raised to every caller waiting on that call.
+    """
+
+    def __init__(
+        self,
+        func: Callable[P, T],
+        ttl: float,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+    ) -> None:
+        update_wrapper(self, func)
+
+        self.func = func
+        """The function that is cached"""
+
+        self.ttl = ttl
+        """Seconds each entry is reused for"""
+
+        self.max_entries = max_entries
+        """Entries kept before the oldest ones are dropped"""
+
+        self._entries: dict[Hashable, tuple[float, T]] = dict()
+        self._in_flight: dict[Hashable, Future[T]] = dict()
+        self._lock = Lock()
+        self._hits = 0
+        self._misses = 0
+        self._coalesced = 0
+
+        _caches.append(self)
+
+    @staticmethod
+    def make_key(*args: Hashable, **kwargs: Hashable) -> Hashable:
+        """Key of the entry for these arguments. The arguments must be hashable, like with `lru_cache`"""
+        return (args, tuple(sorted(kwargs.items()))) if kwargs else args
+
+    def __call__(self, *args: P.args, **kwargs: P.kwargs) -> T:
+        key = self.make_key(*args, **kwargs)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > monotonic():
+                self._hits += 1
+                return entry[1]
+
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                self._misses += 1
+                future = self._in_flight[key] = Future()
+            else:
+                self._coalesced += 1
+
+        if not owner:
+            logger.debug("waiting for {} already being fetched", self.__name__)
+            return future.result()
+
+        try:
+            value = self.func(*args, **kwargs)
+        except BaseException as e:
+            with self._lock:
+                del self._in_flight[key]
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            del self._in_flight[key]
+            if self.ttl > 0:
+                self._entries.pop(key, None)
+                self._entries[key] = (monotonic() + self.ttl, value)
+                self._drop_old_entries()
+        future.set_result(value)
+        return value
+
+    def _drop_old_entries(self) -> None:
+        now = monotonic()
+        for key in [
+            key for key, (expires_at, _) in self._entries.items() if expires_at <= now
+        ]:
+            del self._entries[key]
+        while len(self._entries) > self.max_entries:
+            del self._entries[next(iter(self._entries))]
+
+    def invalidate(self, *args: P.args, **kwargs: P.kwargs) -> bool:
+        """Drops the entry for these arguments, so the next call fetches again. Returns whether there was one"""
+        with self._lock:
+            return self._entries.pop(self.make_key(*args, **kwargs), None) is not None
+
+    def cache_clear(self) -> None:
+        """Drops every entry. Calls already running aren't affected"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> CacheStats:
+        """Returns the counters of the cache"""
+        with self._lock:
+            return CacheStats(
+                self.__name__,
+                self._hits,
+                self._misses,
+                self._coalesced,
+                len(self._entries),
+            )
+
+
+_caches: list[TTLCache] = list()
+
+
+def ttl_cache(
+    ttl: float = DATA_CACHE_TTL, max_entries: int = DEFAULT_MAX_ENTRIES
+) -> Callable[[Callable[P, T]], TTLCache[P, T]]:
+    """
+    Decorator that caches a function's results for a limited time. Look at `TTLCache`
+
+    Parameters
+    ----------
+    ttl : float
+        Seconds each result is reused for. Defaults to SGB_DATA_CACHE_TTL. With 0, nothing is cached but concurrent calls with the same arguments still share one call
+    max_entries : int
+        Entries kept before the oldest ones are dropped. Defaults to DEFAULT_MAX_ENTRIES
+
+    Returns
+    -------
+    Callable[[Callable[P, T]], TTLCache[P, T]]
+        The decorator
+
+    Examples
+    --------
+    >>> @ttl_cache(60)
+    ... def get_price_of_gold() -> float: ...
+    >>> get_price_of_gold.stats()
+    CacheStats(name='get_price_of_gold', hits=0, misses=0, coalesced=0, size=0)
+    """
+
+    def decorator(func: Callable[P, T]) -> TTLCache[P, T]:
+        return TTLCache(func, ttl, max_entries)
+
+    return decorator
+
+
+def get_cache_stats() -> list[CacheStats]:
+    """
+    Returns the counters of every TTL cache created in this process
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    list[CacheStats]
+        The counters of each cache
+
+    Examples
+    --------
+    >>> get_cache_stats()
+    [CacheStats(name='_get_sgbs', hits=3, misses=1, coalesced=2, size=1), ...]
+    """
+    return [cache.stats() for cache in _caches]
+
+
+def clear_caches() -> None:
+    """Drops every entry of every TTL cache, so the next calls fetch live data again"""
+    for cache in _caches:
+        cache.cache_clear()
@@ -0,0 +1,168 @@
+"""
+Settings that decide what a run fetches, renders and sends, and to whom. Loaded once into an immutable `Config` that is passed through `get_sgbs()`, `notify()` and the renderers, so one process can run many configurations without importing anything again.
+
+Settings of the process itself, like folders, timeouts and caches, are still read from the environment by the modules that use them. The one exception is SGB_ARTIFACT_DIR, the folder every kind of on-disk state defaults to, which is read here so the history store, the outputs and the profiles can share it without depending on each other.
+"""
+
+from functools import lru_cache
+from os import environ, getenv
+from pathlib import Path
+from tempfile import gettempdir
+from typing import Mapping, NamedTuple, Optional
+
+DEFAULT_TELEGRAM_API_BASE_URL: str = "https://api.telegram.org"
+
+ARTIFACT_DIR: Path = Path(getenv("SGB_ARTIFACT_DIR", f"{gettempdir()}/sgb_advisor"))
+"""Folder the outputs, outbox, delivery state, profiles and history database are kept in by default"""
+
+
+def _split(value: str) -> tuple[str, ...]:
+    """Splits a comma separated setting, dropping empty items"""
+    return tuple(item.strip() for item in value.split(",") if item.strip())
+
+
+class Config(NamedTuple):
+    """Everything a run needs to know about who it notifies and how. Read it with `Config.from_env()` or `get_config()`"""
+
+    mode: str = ""
+    """Raw value of SGB_MODE, like "telegram,email". Empty to guess it from whether the Telegram bot token or the AWS access key is set"""
+
+    delivery_mode: str = "inline"
+    """SGB_DELIVERY_MODE. "inline" sends at the end of the run, "outbox" only queues for the worker"""
+
+    held_sgbs: frozenset[str] = frozenset()
+    """SGB_ALREADY_HELD_SGBS. NSE symbols of the SGBs to highlight"""
+
+    headed_mode: bool = False
+    """SGB_HEADED_MODE. Shows the browser while scraping"""
+
+    subscribers_path: str = ""
+    """SGB_SUBSCRIBERS_PATH. JSON file with per subscriber profiles"""
+
+    telegram_bot_token: str = ""
+    """SGB_TELEGRAM_BOT_TOKEN"""
+
+    telegram_chat_ids: tuple[str, ...] = ()
+    """SGB_TELEGRAM_CHAT_IDS"""
+
+    telegram_api_base_url: str = DEFAULT_TELEGRAM_API_BASE_URL
+    """SGB_TELEGRAM_API_BASE_URL"""
+
+    aws_access_key: str = ""
+    """SGB_AWS_ACCESS_KEY"""
+
+    aws_secret_access_key: str = ""
+    """SGB_AWS_SECRET_ACCESS_KEY"""
+
+    aws_region: str = ""
+    """SGB_AWS_REGION"""
+
+    aws_ses_sender_email: str = ""
+    """SGB_AWS_SES_SENDER_EMAIL. Must be verified in SES"""
+
+    aws_ses_recipients: tuple[str, ...] = ()
+    """SGB_AWS_SES_RECIPIENTS, falling back to SGB_AWS_SES_RECIPIENT"""
+
+    aws_ses_endpoint_url: Optional[str] = None
+    """SGB_AWS_SES_ENDPOINT_URL. A local SES stand-in, like moto or LocalStack"""
+
+    aws_ses_template_name: str = "sgb-advisor-results"
+    """SGB_AWS_SES_TEMPLATE_NAME. SES template used for bulk sending"""
+
+    @classmethod
+    def from_env(cls, env: Optional[Mapping[str, str]] = None) -> "Config":
+        """
+        Reads the config from environment variables
+
+        Parameters
+        ----------
+        env : Optional[Mapping[str, str]]
+            The variables to read. Defaults to the environment of the process
+
+        Returns
+        -------
+        Config
+            The config
+
+        Examples
+        --------
+        >>> Config.from_env({"SGB_MODE": "telegram", "SGB_TELEGRAM_CHAT_IDS": "123,@sgb_advisor"})
+        Config(mode="telegram", ..., telegram_chat_ids=("123", "@sgb_advisor"), ...)
+        """
+        env = environ if env is None else env
+        return cls(
+            mode=env.get("SGB_MODE", ""),
+            delivery_mode=env.get("SGB_DELIVERY_MODE", "").casefold() or "inline",
+            held_sgbs=frozenset(_split(env.get("SGB_ALREADY_HELD_SGBS", ""))),
+            headed_mode=env.get("SGB_HEADED_MODE", "false").casefold() == "true",
+            subscribers_path=env.get("SGB_SUBSCRIBERS_PATH", ""),
+            telegram_bot_token=env.get("SGB_TELEGRAM_BOT_TOKEN", ""),
+            telegram_chat_ids=_split(env.get("SGB_TELEGRAM_CHAT_IDS", "")),
+            telegram_api_base_url=env.get("SGB_TELEGRAM_API_BASE_URL", "").rstrip("/")
+            or DEFAULT_TELEGRAM_API_BASE_URL,
+            aws_access_key=env.get("SGB_AWS_ACCESS_KEY", ""),
+            aws_secret_access_key=env.get("SGB_AWS_SECRET_ACCESS_KEY", ""),
+            aws_region=env.get("SGB_AWS_REGION", ""),
+            aws_ses_sender_email=env.get("SGB_AWS_SES_SENDER_EMAIL", ""),
+            aws_ses_recipients=_split(
+                env.get("SGB_AWS_SES_RECIPIENTS", env.get("SGB_AWS_SES_RECIPIENT", ""))
+            ),
+            aws_ses_endpoint_url=env.get("SGB_AWS_SES_ENDPOINT_URL") or None,
+            aws_ses_template_name=env.get("SGB_AWS_SES_TEMPLATE_NAME", "")
+            or "sgb-advisor-results",
+        )
+
+    @classmethod
+    def from_env_file(
+        cls, path: Path, env: Optional[Mapping[str, str]] = None
+    ) -> "Config":
+        """
+        Reads the config from a .env file, without changing the environment of the process. Variables already in the environment take precedence, like with `load_dotenv()`
+
+        Parameters
+        ----------
+        path : Path
+            Path of the .env file
+        env : Optional[Mapping[str, str]]
+            The variables that take precedence. Defaults to the environment of the process
+
+        Returns
+        -------
+        Config
+            The config
+
+        Examples
+        --------
+        >>> Config.from_env_file(Path("family.env"))
+        Config(mode="email", ...)
+        """
+        from dotenv import dotenv_values
+
+        values = {
+            key: value
+            for key, value in dotenv_values(path).items()
+            if value is not None
+        }
+        return cls.from_env({**values, **(environ if env is None else env)})
+
+
+@lru_cache(maxsize=None)
+def get_config() -> Config:
+    """
+    Returns the config read from the environment the first time this is called. Used wherever a config isn't passed in
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    Config
+        The config of the process
+
+    Examples
+    --------
+    >>> get_config()
+    Config(mode="telegram", ...)
+    """
+    return Config.from_env()
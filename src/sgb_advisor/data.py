@@ -1,28 +1,46 @@
+from contextlib import contextmanager
 from csv import reader as csv_reader
-from datetime import datetime
+from datetime import datetime, timezone
 from functools import lru_cache
-from os import getenv
 from os.path import dirname
-from typing import Optional
-
-from playwright.sync_api import ElementHandle
-from playwright.sync_api import TimeoutError as PlaywrightTimeoutError
-from playwright.sync_api import sync_playwright
+from time import perf_counter
+from typing import TYPE_CHECKING, Any, Iterable, Iterator, Mapping, Optional
 
+from .cache import ttl_cache
+from .config import Config, get_config
 from .logg import logger
+from .metrics import span
 from .models import SGB
 from .quick_mafs import calculate_sgb_xirr
 
+if TYPE_CHECKING:
+    from playwright.sync_api import Page
+
+    from .history.scrapes import ScrapeAttempt
+
 NSE_SGB_URL = "https://www.nseindia.com/market-data/sovereign-gold-bond"
 
 # RBI uses IBJA
 IBJA_URL = "https://www.ibja.co/"
 IBJA_BACKUP_URL = "https://ibjarates.com/"
 
+NseRow = tuple[Optional[str], Optional[str], Optional[str]]
+"""Text of the name, last traded price and volume cells of a row of the NSE SGB table"""
+
+NAVIGATION_TIMING_SCRIPT: str = """() => ({
+    navigation: performance.getEntriesByType("navigation").map((entry) => entry.toJSON())[0] || null,
+    resources: performance.getEntriesByType("resource").map((entry) => ({
+        name: entry.name,
+        duration: entry.duration,
+        transferSize: entry.transferSize,
+    })),
+})"""
+"""Reads the Navigation Timing and Resource Timing entries of the page"""
 
-class SiteNotLoadedError(PlaywrightTimeoutError):
+
+class SiteNotLoadedError(TimeoutError):
     """
-    Separate error class to use when site doesn't load, to avoid catching other types of errors. The NSE site fails to load a lot of times
+    Separate error class to use when site doesn't load, to avoid catching other types of errors. The NSE site fails to load a lot of times. Raised in place of Playwright's timeout, so that Playwright is only imported when a site is fetched
     """
 
     def __init__(self, message: str) -> None:
@@ -62,14 +80,95 @@ def read_scrips_file() -> list[list[str]]:
 
 
 @lru_cache(maxsize=None)
-def run_in_headless_mode() -> bool:
+def get_scrips_by_symbol() -> dict[str, list[str]]:
     """
-    Returns whether the script should run in headless mode or not. Uses the SGB_HEADED_MODE environment variable to determine this.
+    Returns the rows of scrips.csv from `read_scrips_file()`, keyed by their NSE symbol, so that every SGB is looked up without going through the whole file
 
     Parameters
     ----------
     None
 
+    Returns
+    -------
+    dict[str, list[str]]
+        Rows of the CSV keyed by NSE symbol. The first row is kept if a symbol is repeated
+
+    Examples
+    --------
+    >>> get_scrips_by_symbol()["SGBMAR24"]
+    ["SGBMAR24", "SGB2016II", "2.75%", "29th March and September", "29/03/2024", "2916"]
+    """
+    scrips: dict[str, list[str]] = dict()
+    for row in read_scrips_file():
+        scrips.setdefault(row[0].strip(), row)
+    return scrips
+
+
+def parse_nse_table(
+    rows: Iterable[NseRow], scrips: Optional[Mapping[str, list[str]]] = None
+) -> list[SGB]:
+    """
+    Builds the SGBs traded today from the rows of the NSE SGB table. Rows that aren't SGBs, weren't traded, or aren't in scrips.csv are skipped
+
+    Parameters
+    ----------
+    rows : Iterable[NseRow]
+        Text of the name, last traded price and volume cells of every row
+    scrips : Optional[Mapping[str, list[str]]]
+        Rows of scrips.csv keyed by NSE symbol. Defaults to `get_scrips_by_symbol()`
+
+    Returns
+    -------
+    list[SGB]
+        The SGBs, in the order of the table
+
+    Examples
+    --------
+    >>> parse_nse_table([("SGBAUG28V", "7,900.02", "1,024")])
+    [SGB1]
+    """
+    scrips = get_scrips_by_symbol() if scrips is None else scrips
+    sgbs_trading: list[SGB] = list()
+
+    for name, price_str, volume_str in rows:
+        try:
+            if not (
+                (name and name.startswith("SGB"))
+                and (price_str)
+                and (volume_str and volume_str != "-")
+            ):
+                continue
+
+            row = scrips[name]
+            _issue_date = list(map(int, row[4].split("/")))
+            volume = int(volume_str.replace(",", ""))
+            if volume > 0:
+                sgbs_trading.append(
+                    SGB(
+                        row[0],
+                        float(price_str.replace(",", "")),
+                        float(row[5]),
+                        float(row[2].replace("%", "").strip()),
+                        datetime(_issue_date[2], _issue_date[1], _issue_date[0]).date(),
+                        volume,
+                    )
+                )
+
+        except Exception as e:
+            print(f'Couldn\'t add "{name}" to sgb_values - {e}')
+
+    return sgbs_trading
+
+
+def run_in_headless_mode(config: Optional[Config] = None) -> bool:
+    """
+    Returns whether the script should run in headless mode or not. Uses the headed mode of the config (SGB_HEADED_MODE) to determine this.
+
+    Parameters
+    ----------
+    config : Optional[Config]
+        The config to read. Defaults to `get_config()`
+
     Returns
     -------
     bool
@@ -80,17 +179,139 @@ def run_in_headless_mode() -> bool:
     >>> run_in_headless_mode()
     True
     """
-    headed_mode = getenv("SGB_HEADED_MODE", "false").casefold() == "true"
+    headed_mode = (config or get_config()).headed_mode
     logger.debug(
         "Running playwright in headed mode"
-        if {headed_mode}
+        if headed_mode
         else "Running playwright in headless mode"
     )
     # opposite to return headless mode state
     return not headed_mode
 
 
-def get_sgbs_from_nse_site(n_th: Optional[int] = 1) -> list[SGB]:
+class NavigationTimer:
+    """Loads a page and waits for what is scraped from it, timing both from outside the browser. Look at `record_navigation()`"""
+
+    __slots__ = {"page", "goto_ms", "wait_ms", "selector_ms"}
+
+    def __init__(self, page: "Page") -> None:
+        self.page = page
+
+        self.goto_ms: Optional[float] = None
+        """Time `goto()` took, even if it failed"""
+
+        self.wait_ms: Optional[float] = None
+        """Time `wait_for_selector()` took, even if it failed"""
+
+        self.selector_ms: Optional[float] = None
+        """Time from the start of the navigation until the selector appeared, as seen by the browser"""
+
+    def goto(self, url: str, timeout: float) -> None:
+        start = perf_counter()
+        try:
+            self.page.goto(url, timeout=timeout)
+        finally:
+            self.goto_ms = (perf_counter() - start) * 1000
+
+    def wait_for_selector(self, selector: str, timeout: float) -> None:
+        start = perf_counter()
+        try:
+            self.page.wait_for_selector(selector, timeout=timeout)
+        finally:
+            self.wait_ms = (perf_counter() - start) * 1000
+        try:
+            self.selector_ms = float(self.page.evaluate("performance.now()"))
+        except Exception as e:
+            logger.debug("could not read performance.now() - {}", e)
+
+    def read_entries(self) -> dict[str, Any]:
+        """The performance entries of the page from NAVIGATION_TIMING_SCRIPT, or nothing if the page can't run it (like when JavaScript is disabled, or it has crashed)"""
+        try:
+            entries: dict[str, Any] = self.page.evaluate(NAVIGATION_TIMING_SCRIPT)
+        except Exception as e:
+            logger.debug("could not read navigation timing - {}", e)
+            return dict()
+        return {**entries, "selector": self.selector_ms}
+
+
+def save_scrape_attempt(scrape_attempt: "ScrapeAttempt") -> None:
+    """Records the attempt in the history database, if it is enabled. Failing to record it is logged, and never fails the scrape"""
+    from .history import get_history_db_path
+    from .history.scrapes import record_scrape_attempt
+
+    if not get_history_db_path():
+        return
+    try:
+        record_scrape_attempt(scrape_attempt)
+    except Exception as e:
+        logger.error(f"could not record {scrape_attempt.source} attempt - {e}")
+
+
+@contextmanager
+def record_navigation(
+    source: str, attempt: int, url: str, page: "Page"
+) -> Iterator[NavigationTimer]:
+    """
+    Times an attempt at loading a site, and when it ends, successfully or not, reads the browser's Navigation Timing and Resource Timing entries and records them in the history database
+
+    Parameters
+    ----------
+    source : str
+        The site, like "nse"
+    attempt : int
+        Which try of the run this is
+    url : str
+        The URL being scraped
+    page : Page
+        The Playwright page it is loaded in
+
+    Returns
+    -------
+    Iterator[NavigationTimer]
+        Loads the page and waits for the selector, timing them
+
+    Examples
+    --------
+    >>> with record_navigation("nse", 1, NSE_SGB_URL, page) as navigation:
+    ...     navigation.goto(NSE_SGB_URL, timeout=10000)
+    ...     navigation.wait_for_selector("#sgbTable", timeout=10000)
+    """
+    from .history.scrapes import build_scrape_attempt
+
+    timer = NavigationTimer(page)
+    attempted_at = datetime.now(timezone.utc)
+    error: Optional[str] = None
+    try:
+        yield timer
+    except BaseException as e:
+        error = f"{type(e).__name__}: {next(iter(str(e).splitlines()), '')}"
+        raise
+    finally:
+        scrape_attempt = build_scrape_attempt(
+            source,
+            attempt,
+            url,
+            error is None,
+            error,
+            attempted_at,
+            timer.goto_ms,
+            timer.wait_ms,
+            timer.read_entries(),
+        )
+        logger.info(
+            "{source} attempt {attempt} took {goto_ms} ms to load",
+            **{
+                key: value
+                for key, value in scrape_attempt._asdict().items()
+                if key != "slowest_resources"
+            },
+        )
+        save_scrape_attempt(scrape_attempt)
+
+
+def get_sgbs_from_nse_site(
+    n_th: Optional[int] = 1, config: Optional[Config] = None
+) -> list[SGB]:
     """
     Fetch info for SGBs located at NSE_SGB_URL. Uses the [playwright](https://playwright.dev/python/) library.
 
@@ -98,6 +319,8 @@ def get_sgbs_from_nse_site(n_th: Optional[int] = 1) -> list[SGB]:
     ----------
     n_th : Optional[int]
         The nth try going on. Used to print along with the logs. Defaults to 1
+    config : Optional[Config]
+        The config that decides whether the browser is shown. Defaults to `get_config()`
 
     Returns
     -------
@@ -109,97 +332,78 @@ def get_sgbs_from_nse_site(n_th: Optional[int] = 1) -> list[SGB]:
     >>> get_sgbs_from_nse_site(1)
     [SGB1, SGB2]
     """
+    from playwright.sync_api import TimeoutError as PlaywrightTimeoutError
+    from playwright.sync_api import sync_playwright
+
     with sync_playwright() as p:
-        browser = p.firefox.launch(headless=run_in_headless_mode())
-        page = browser.new_page()
+        with span("nse.browser_launch", attempt=n_th or 1):
+            browser = p.firefox.launch(headless=run_in_headless_mode(config))
+            page = browser.new_page()
         current_user_agent: str = page.evaluate("navigator.userAgent")
         new_user_agent = current_user_agent.replace("Headless", "")
         if new_user_agent != current_user_agent:
             page.close()
             logger.info(f"Setting new user agent to {new_user_agent}")
             page = browser.new_page(user_agent=new_user_agent)
-        logger.info(f"fetching NSE SGB page at {NSE_SGB_URL} - {n_th} time(s)")
+        logger.info(
+            "fetching NSE SGB page at {url} - {attempt} time(s)",
+            url=NSE_SGB_URL,
+            source="nse",
+            attempt=n_th,
+        )
 
         # For some weird ass reason, NSE website fails to load half the times if playwright opens it immediately after the browser has opened. Loading a URL first and after that switching to NSE site since it improves loading?
         # This could also be a firefox issue
-        page.goto("https://www.vishalnandagopal.com")
-        page.goto(NSE_SGB_URL, timeout=10000)
-
         SGBNAME_QUERY_SEL = "#sgbTable > tbody > tr > td:nth-child(1)"
         SGBLTP_QUERY_SEL = "#sgbTable > tbody > tr > td:nth-child(7)"
         SGBVOL_QUERY_SEL = "#sgbTable > tbody > tr > td:nth-child(11)"
 
-        # NSE website loads info after page load. So wait for this to appear
-        try:
-            page.wait_for_selector(SGBLTP_QUERY_SEL, timeout=10000)
-        except PlaywrightTimeoutError:
-            msg: str = (
-                f"could not fetch SGBs info from NSE site - tried {n_th} times(s)"
-            )
-            logger.warning(msg)
-            raise SiteNotLoadedError(msg)
-
-        sgb_ltp_results = page.query_selector_all(selector=SGBLTP_QUERY_SEL)
-        sgb_name_results = page.query_selector_all(selector=SGBNAME_QUERY_SEL)
-        sgb_volume_results = page.query_selector_all(selector=SGBVOL_QUERY_SEL)
-
-        sgbs_trading: list[SGB] = list()
-
-        csv_contents = read_scrips_file()
+        with record_navigation("nse", n_th or 1, NSE_SGB_URL, page) as navigation:
+            with span("nse.goto", attempt=n_th or 1):
+                page.goto("https://www.vishalnandagopal.com")
+                navigation.goto(NSE_SGB_URL, timeout=10000)
 
-        name_element: ElementHandle
-        price_element: ElementHandle
-        volume_element: ElementHandle
-
-        for name_element, price_element, volume_element in zip(
-            sgb_name_results, sgb_ltp_results, sgb_volume_results
-        ):
+            # NSE website loads info after page load. So wait for this to appear
             try:
-                name = name_element.text_content()
-                price_str = price_element.text_content()
-                volume_str = volume_element.text_content()
-                if not (
-                    (name and name.startswith("SGB"))
-                    and (price_str)
-                    and (volume_str and volume_str != "-")
-                ):
-                    continue
-
-                row = list(filter(lambda x: x[0].strip() == name, csv_contents))[0]
-                _issue_date = list(map(int, row[4].split("/")))
-                if int(volume_str.replace(",", "")) > 0:
-                    sgbs_trading.append(
-                        SGB(
-                            row[0],
-                            float(price_str.replace(",", "")),
-                            float(row[5]),
-                            float(row[2].replace("%", "").strip()),
-                            datetime(
-                                _issue_date[2], _issue_date[1], _issue_date[0]
-                            ).date(),
-                        )
-                    )
-
-            except Exception as e:
-                print(
-                    f'Couldn\'t add "{name_element.text_content()}" to sgb_values - {e}'
+                with span("nse.wait_for_selector", attempt=n_th or 1):
+                    navigation.wait_for_selector(SGBLTP_QUERY_SEL, timeout=10000)
+            except PlaywrightTimeoutError:
+                msg: str = (
+                    f"could not fetch SGBs info from NSE site - tried {n_th} times(s)"
+                )
+                logger.bind(source="nse", attempt=n_th).warning(msg)
+                raise SiteNotLoadedError(msg)
+
+        with span("nse.extract", attempt=n_th or 1):
+            sgb_ltp_results = page.query_selector_all(selector=SGBLTP_QUERY_SEL)
+            sgb_name_results = page.query_selector_all(selector=SGBNAME_QUERY_SEL)
+            sgb_volume_results = page.query_selector_all(selector=SGBVOL_QUERY_SEL)
+
+            sgbs_trading = parse_nse_table(
+                (name.text_content(), price.text_content(), volume.text_content())
+                for name, price, volume in zip(
+                    sgb_name_results, sgb_ltp_results, sgb_volume_results
                 )
+            )
 
         browser.close()
 
     logger.info("fetched all SGB data from NSE website")
-    logger.debug('sample SGB data from NSE- "{sgbs_trading[0]}"')
+    logger.opt(lazy=True).debug(
+        'sample SGB data from NSE - "{}"',
+        lambda: sgbs_trading[0] if sgbs_trading else None,
+    )
     return sgbs_trading
 
 
-@lru_cache(maxsize=None)
-def get_sgbs() -> list[SGB]:
+def get_sgbs(config: Optional[Config] = None) -> list[SGB]:
     """
-    Fetches the list of SGBs from the NSE site. Parent function to try until it succeeds, since the site is very unreliable. Tries a maximum of 10 times.
+    Fetches the list of SGBs from the NSE site. Parent function to try until it succeeds, since the site is very unreliable. Tries a maximum of 10 times. Cached per headed mode for SGB_DATA_CACHE_TTL seconds, since that is all of the config a fetch reads.
 
     Parameters
     ----------
-    None
+    config : Optional[Config]
+        The config to fetch with. Defaults to `get_config()`
 
     Returns
     -------
@@ -211,13 +415,21 @@ def get_sgbs() -> list[SGB]:
     >>> get_sgbs()
     [SGB1, SGB2, SGB3]
     """
+    return _get_sgbs((config or get_config()).headed_mode)
+
+
+@ttl_cache()
+def _get_sgbs(headed_mode: bool) -> list[SGB]:
+    # Keyed on the headed mode only, so configs that differ in who they notify share one fetch
+    config = Config(headed_mode=headed_mode)
     sgbs_trading: list[SGB] = list()
     i = 0
     # try till it succeeds?
     while not sgbs_trading and i < 10:
         i += 1
         try:
-            sgbs_trading = get_sgbs_from_nse_site(i)
+            with span("nse.attempt", attempt=i):
+                sgbs_trading = get_sgbs_from_nse_site(i, config)
         except SiteNotLoadedError:
             pass
 
@@ -226,18 +438,21 @@ def get_sgbs() -> list[SGB]:
         logger.error(msg)
         raise RuntimeError(msg)
 
-    current_gold_price: float = get_price_of_gold()
+    current_gold_price: float = _get_price_of_gold(headed_mode)
 
-    for sgb in sgbs_trading:
-        sgb.xirr = calculate_sgb_xirr(sgb, current_gold_price)
+    with span("compute", sgbs=len(sgbs_trading)):
+        for sgb in sgbs_trading:
+            sgb.xirr = calculate_sgb_xirr(sgb, current_gold_price)
 
-    # Sorts in descending order of XIRR
-    sgbs_trading.sort(key=lambda x: x.xirr, reverse=True)
+        # Sorts in descending order of XIRR
+        sgbs_trading.sort(key=lambda x: x.xirr, reverse=True)
 
     return sgbs_trading
 
 
-def fetch_price_of_gold_from_ibja(n_th: Optional[int] = 1) -> float:
+def fetch_price_of_gold_from_ibja(
+    n_th: Optional[int] = 1, config: Optional[Config] = None
+) -> float:
     """
     Fetches the price of gold using the playwright library, from the site at IBJA_URL
 
@@ -245,6 +460,8 @@ def fetch_price_of_gold_from_ibja(n_th: Optional[int] = 1) -> float:
     ----------
     n_th : Optional[int]
         The nth try going on. Used to print along with the logs. Defaults to 1
+    config : Optional[Config]
+        The config that decides whether the browser is shown. Defaults to `get_config()`
 
     Returns
     -------
@@ -256,28 +473,42 @@ def fetch_price_of_gold_from_ibja(n_th: Optional[int] = 1) -> float:
     >>> fetch_price_of_gold_from_ibja()
     7956.00
     """
-    with sync_playwright() as p:
-        browser = p.firefox.launch(headless=run_in_headless_mode())
-        page = browser.new_page(java_script_enabled=False)
-
-        logger.info(f"fetching IBJA page at {IBJA_URL} - {n_th} time")
-        page.goto(IBJA_URL, timeout=100000)
+    from playwright.sync_api import TimeoutError as PlaywrightTimeoutError
+    from playwright.sync_api import sync_playwright
 
+    with sync_playwright() as p:
+        with span("ibja.browser_launch", attempt=n_th or 1):
+            browser = p.firefox.launch(headless=run_in_headless_mode(config))
+            page = browser.new_page(java_script_enabled=False)
+
+        logger.info(
+            "fetching IBJA page at {url} - {attempt} time",
+            url=IBJA_URL,
+            source="ibja",
+            attempt=n_th,
+        )
         FINE_GOLD_PRICE_QUERY_SEL = "#lblFineGold999"
-        try:
-            page.wait_for_selector(FINE_GOLD_PRICE_QUERY_SEL, timeout=50000)
-        except PlaywrightTimeoutError:
-            msg: str = (
-                f"could not fetch price of gold from {IBJA_URL} - tried {n_th} times(s)"
-            )
-            logger.warning(msg)
-            raise SiteNotLoadedError(msg)
+        with record_navigation("ibja", n_th or 1, IBJA_URL, page) as navigation:
+            with span("ibja.goto", attempt=n_th or 1):
+                navigation.goto(IBJA_URL, timeout=100000)
 
-        _gold_price_element = page.query_selector(selector=FINE_GOLD_PRICE_QUERY_SEL)
-
-        _gold_price_str = (
-            _gold_price_element.text_content() if _gold_price_element else ""
-        )
+            try:
+                with span("ibja.wait_for_selector", attempt=n_th or 1):
+                    navigation.wait_for_selector(
+                        FINE_GOLD_PRICE_QUERY_SEL, timeout=50000
+                    )
+            except PlaywrightTimeoutError:
+                msg: str = f"could not fetch price of gold from {IBJA_URL} - tried {n_th} times(s)"
+                logger.bind(source="ibja", attempt=n_th).warning(msg)
+                raise SiteNotLoadedError(msg)
+
+        with span("ibja.extract", attempt=n_th or 1):
+            _gold_price_element = page.query_selector(
+                selector=FINE_GOLD_PRICE_QUERY_SEL
+            )
+            _gold_price_str = (
+                _gold_price_element.text_content() if _gold_price_element else ""
+            )
 
         browser.close()
 
@@ -287,7 +518,9 @@ def fetch_price_of_gold_from_ibja(n_th: Optional[int] = 1) -> float:
     return gold_price
 
 
-def fetch_price_of_gold_from_ibja_backup(n_th: Optional[int] = 1) -> float:
+def fetch_price_of_gold_from_ibja_backup(
+    n_th: Optional[int] = 1, config: Optional[Config] = None
+) -> float:
     """
     Fetches the price of gold using the playwright library, from the site at IBJA_BACKUP_URL
 
@@ -295,6 +528,8 @@ def fetch_price_of_gold_from_ibja_backup(n_th: Optional[int] = 1) -> float:
     ----------
     n_th : Optional[int]
         The nth try going on. Used to print along with the logs. Defaults to 1
+    config : Optional[Config]
+        The config that decides whether the browser is shown. Defaults to `get_config()`
 
     Returns
     -------
@@ -306,12 +541,26 @@ def fetch_price_of_gold_from_ibja_backup(n_th: Optional[int] = 1) -> float:
     >>> fetch_price_of_gold_from_ibja_backup()
     7956.00
     """
-    with sync_playwright() as p:
-        browser = p.firefox.launch(headless=run_in_headless_mode())
-        page = browser.new_page(java_script_enabled=False)
+    from playwright.sync_api import sync_playwright
 
-        logger.info(f"fetching IBJA page at {IBJA_BACKUP_URL} - {n_th} time")
-        page.goto(IBJA_BACKUP_URL, timeout=100000)
+    with sync_playwright() as p:
+        with span("ibja_backup.browser_launch", attempt=n_th or 1):
+            browser = p.firefox.launch(headless=run_in_headless_mode(config))
+            page = browser.new_page(java_script_enabled=False)
+
+        logger.info(
+            "fetching IBJA page at {url} - {attempt} time",
+            url=IBJA_BACKUP_URL,
+            source="ibja_backup",
+            attempt=n_th,
+        )
+        with (
+            record_navigation(
+                "ibja_backup", n_th or 1, IBJA_BACKUP_URL, page
+            ) as navigation,
+            span("ibja_backup.goto", attempt=n_th or 1),
+        ):
+            navigation.goto(IBJA_BACKUP_URL, timeout=100000)
 
         GOLD_PRICE_QUERY_SEL = "#GoldRatesCompare999"
         # No need to wait for selector since IBJA_BACKUP_URL returns the price in the inital HTML load itself
@@ -324,11 +573,11 @@ def fetch_price_of_gold_from_ibja_backup(n_th: Optional[int] = 1) -> float:
         #     logger.warning(msg)
         #     raise SiteNotLoadedError(msg)
 
-        _gold_price_element = page.query_selector(selector=GOLD_PRICE_QUERY_SEL)
-
-        _gold_price_str = (
-            _gold_price_element.text_content() if _gold_price_element else ""
-        )
+        with span("ibja_backup.extract", attempt=n_th or 1):
+            _gold_price_element = page.query_selector(selector=GOLD_PRICE_QUERY_SEL)
+            _gold_price_str = (
+                _gold_price_element.text_content() if _gold_price_element else ""
+            )
 
         browser.close()
 
@@ -338,14 +587,14 @@ def fetch_price_of_gold_from_ibja_backup(n_th: Optional[int] = 1) -> float:
     return gold_price
 
 
-@lru_cache(maxsize=None)
-def get_price_of_gold() -> float:
+def get_price_of_gold(config: Optional[Config] = None) -> float:
     """
-    Fetches the price of gold from the IBJA site. Parent function to try until it succeeds. Tries a maximum of 10 times.
+    Fetches the price of gold from the IBJA site. Parent function to try until it succeeds. Tries a maximum of 10 times. Cached per headed mode for SGB_DATA_CACHE_TTL seconds, like `get_sgbs()`.
 
     Parameters
     ----------
-    None
+    config : Optional[Config]
+        The config to fetch with. Defaults to `get_config()`
 
     Returns
     -------
@@ -357,7 +606,12 @@ def get_price_of_gold() -> float:
     >>> get_price_of_gold()
     7956.00
     """
+    return _get_price_of_gold((config or get_config()).headed_mode)
+
 
+@ttl_cache()
+def _get_price_of_gold(headed_mode: bool) -> float:
+    config = Config(headed_mode=headed_mode)
     gold_price: float = 0
 
     i = 0
@@ -365,10 +619,12 @@ def get_price_of_gold() -> float:
     while not gold_price and i < 10:
         i += 1
         try:
-            gold_price = fetch_price_of_gold_from_ibja(i)
+            with span("ibja.attempt", attempt=i):
+                gold_price = fetch_price_of_gold_from_ibja(i, config)
         except SiteNotLoadedError:
             try:
-                gold_price = fetch_price_of_gold_from_ibja_backup(i)
+                with span("ibja_backup.attempt", attempt=i):
+                    gold_price = fetch_price_of_gold_from_ibja_backup(i, config)
             except SiteNotLoadedError:
                 pass
 
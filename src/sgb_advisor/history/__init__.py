@@ -0,0 +1,21 @@
+"""
+Local history of every run's snapshot, stored in an embedded SQLite database
+"""
+
+from .store import HISTORY_DB_PATH_ENV as HISTORY_DB_PATH_ENV
+from .store import connect_history_db as connect_history_db
+from .store import get_history_db_path as get_history_db_path
+from .store import get_latest_run as get_latest_run
+from .store import get_latest_run_id as get_latest_run_id
+from .store import get_quotes as get_quotes
+from .store import get_runs as get_runs
+from .store import get_symbol_history as get_symbol_history
+from .store import record_run as record_run
+from .store import sgb_from_quote as sgb_from_quote
+from .scrapes import build_scrape_attempt as build_scrape_attempt
+from .scrapes import get_scrape_stats as get_scrape_stats
+from .scrapes import record_scrape_attempt as record_scrape_attempt
+from .ticks import TICK_KEYFRAME_INTERVAL_ENV as TICK_KEYFRAME_INTERVAL_ENV
+from .ticks import get_snapshot_at as get_snapshot_at
+from .ticks import get_tick_compression_ratio as get_tick_compression_ratio
+from .ticks import record_tick as record_tick
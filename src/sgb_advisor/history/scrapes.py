@@ -0,0 +1,347 @@
+"""
+Timings of every attempt to scrape a site, from the browser's Navigation Timing and Resource Timing entries, so that timeouts and retries can be tuned from how the sites actually behave instead of guesses
+"""
+
+from collections import Counter
+from datetime import date, datetime, timezone
+from json import dumps as json_dumps
+from pathlib import Path
+from sqlite3 import Connection
+from typing import Any, NamedTuple, Optional
+
+from ..logg import logger
+from .store import connect_history_db
+
+SCRAPES_SCHEMA: str = """
+CREATE TABLE IF NOT EXISTS scrape_attempts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    attempted_at TEXT NOT NULL,
+    source TEXT NOT NULL,
+    attempt INTEGER NOT NULL,
+    ok INTEGER NOT NULL,
+    error TEXT,
+    url TEXT NOT NULL,
+    goto_ms REAL,
+    wait_ms REAL,
+    selector_ms REAL,
+    dns_ms REAL,
+    connect_ms REAL,
+    tls_ms REAL,
+    ttfb_ms REAL,
+    download_ms REAL,
+    dom_content_loaded_ms REAL,
+    load_ms REAL,
+    transfer_bytes INTEGER,
+    resource_count INTEGER,
+    slowest_resources TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_scrape_attempts_source ON scrape_attempts (source, attempted_at);
+"""
+
+SLOWEST_RESOURCES: int = 5
+"""Resources (scripts, XHRs, images...) kept per attempt, slowest first"""
+
+TIMING_FIELDS: tuple[str, ...] = (
+    "goto_ms",
+    "wait_ms",
+    "selector_ms",
+    "dns_ms",
+    "connect_ms",
+    "tls_ms",
+    "ttfb_ms",
+    "download_ms",
+    "dom_content_loaded_ms",
+    "load_ms",
+    "transfer_bytes",
+)
+"""Fields of ScrapeAttempt that `get_scrape_stats()` reports percentiles of"""
+
+QUANTILES: tuple[float, ...] = (0.5, 0.9, 0.99)
+
+
+class ScrapeAttempt(NamedTuple):
+    """One attempt at loading a site. Timings are in milliseconds, and None if the page never got that far or the browser didn't report them"""
+
+    source: str
+    """The site, like "nse", "ibja" or "ibja_backup" """
+
+    attempt: int
+    """Which try of the run this was, starting at 1"""
+
+    url: str
+
+    ok: bool
+    """Whether the page loaded and what was waited for appeared"""
+
+    error: Optional[str] = None
+    """Type and first line of the error the attempt failed with"""
+
+    attempted_at: str = ""
+    """UTC time the attempt started at, in ISO format"""
+
+    goto_ms: Optional[float] = None
+    """Time `page.goto()` took, measured outside the browser"""
+
+    wait_ms: Optional[float] = None
+    """Time spent waiting for the selector (like #sgbTable) after `page.goto()`, measured outside the browser"""
+
+    selector_ms: Optional[float] = None
+    """Time from the start of the navigation until the selector appeared"""
+
+    dns_ms: Optional[float] = None
+    connect_ms: Optional[float] = None
+    """TCP and TLS connection, including tls_ms"""
+
+    tls_ms: Optional[float] = None
+
+    ttfb_ms: Optional[float] = None
+    """Time from the start of the navigation to the first byte of the response"""
+
+    download_ms: Optional[float] = None
+    """Time from the first to the last byte of the response"""
+
+    dom_content_loaded_ms: Optional[float] = None
+    load_ms: Optional[float] = None
+
+    transfer_bytes: Optional[int] = None
+    """Bytes transferred for the page and every resource. Cross-origin resources without a Timing-Allow-Origin header count as 0"""
+
+    resource_count: Optional[int] = None
+
+    slowest_resources: tuple[dict[str, Any], ...] = ()
+    """The slowest resources, with their "name", "duration_ms" and "transfer_bytes" """
+
+
+def _ms(value: object) -> Optional[float]:
+    return round(float(value), 1) if isinstance(value, (int, float)) else None
+
+
+def _since_start(navigation: dict[str, Any], key: str) -> Optional[float]:
+    """Milliseconds from the start of the navigation to an event, None if it hasn't happened (reported as 0)"""
+    value = navigation.get(key)
+    return _ms(value) if value else None
+
+
+def _between(navigation: dict[str, Any], start: str, end: str) -> Optional[float]:
+    """Milliseconds between two events, None if either hasn't happened"""
+    if not (navigation.get(start) and navigation.get(end)):
+        return None
+    return _ms(navigation[end] - navigation[start])
+
+
+def build_scrape_attempt(
+    source: str,
+    attempt: int,
+    url: str,
+    ok: bool,
+    error: Optional[str] = None,
+    attempted_at: Optional[datetime] = None,
+    goto_ms: Optional[float] = None,
+    wait_ms: Optional[float] = None,
+    entries: Optional[dict[str, Any]] = None,
+) -> ScrapeAttempt:
+    """
+    Builds an attempt from what was measured outside the browser, and the performance entries read from the page
+
+    Parameters
+    ----------
+    source : str
+        The site, like "nse"
+    attempt : int
+        Which try of the run this was
+    url : str
+        The URL loaded
+    ok : bool
+        Whether the attempt succeeded
+    error : Optional[str]
+        Why it failed
+    attempted_at : Optional[datetime]
+        When it started. Defaults to now
+    goto_ms : Optional[float]
+        Time `page.goto()` took
+    wait_ms : Optional[float]
+        Time spent waiting for the selector
+    entries : Optional[dict[str, Any]]
+        "navigation" (the PerformanceNavigationTiming entry as JSON), "resources" (the PerformanceResourceTiming entries, with "name", "duration" and "transferSize") and "selector" (`performance.now()` when the selector appeared). Empty if they couldn't be read
+
+    Returns
+    -------
+    ScrapeAttempt
+        The attempt
+
+    Examples
+    --------
+    >>> build_scrape_attempt("nse", 1, NSE_SGB_URL, True, goto_ms=2310.4, entries={"navigation": {"responseStart": 812.0, ...}, "resources": [...]})
+    ScrapeAttempt(source="nse", attempt=1, ..., ttfb_ms=812.0, ...)
+    """
+    entries = entries or dict()
+    navigation: dict[str, Any] = entries.get("navigation") or dict()
+    resources: list[dict[str, Any]] = entries.get("resources") or list()
+
+    slowest = sorted(resources, key=lambda r: r.get("duration") or 0, reverse=True)
+    transfer_sizes = [navigation.get("transferSize") or 0] + [
+        r.get("transferSize") or 0 for r in resources
+    ]
+
+    return ScrapeAttempt(
+        source=source,
+        attempt=attempt,
+        url=url,
+        ok=ok,
+        error=error,
+        attempted_at=(attempted_at or datetime.now(timezone.utc)).isoformat(),
+        goto_ms=_ms(goto_ms),
+        wait_ms=_ms(wait_ms),
+        selector_ms=_ms(entries.get("selector")),
+        dns_ms=_between(navigation, "domainLookupStart", "domainLookupEnd"),
+        connect_ms=_between(navigation, "connectStart", "connectEnd"),
+        tls_ms=_between(navigation, "secureConnectionStart", "connectEnd"),
+        ttfb_ms=_since_start(navigation, "responseStart"),
+        download_ms=_between(navigation, "responseStart", "responseEnd"),
+        dom_content_loaded_ms=_since_start(navigation, "domContentLoadedEventEnd"),
+        load_ms=_since_start(navigation, "loadEventEnd"),
+        transfer_bytes=int(sum(transfer_sizes)) if navigation else None,
+        resource_count=len(resources) if navigation else None,
+        slowest_resources=tuple(
+            {
+                "name": r.get("name"),
+                "duration_ms": _ms(r.get("duration")),
+                "transfer_bytes": r.get("transferSize"),
+            }
+            for r in slowest[:SLOWEST_RESOURCES]
+        ),
+    )
+
+
+def _connect(db_path: Optional[Path] = None) -> Connection:
+    conn = connect_history_db(db_path)
+    conn.executescript(SCRAPES_SCHEMA)
+    return conn
+
+
+def record_scrape_attempt(
+    scrape_attempt: ScrapeAttempt, db_path: Optional[Path] = None
+) -> int:
+    """
+    Appends an attempt to the history database
+
+    Parameters
+    ----------
+    scrape_attempt : ScrapeAttempt
+        The attempt, from `build_scrape_attempt()`
+    db_path : Optional[Path]
+        Path of the database. Defaults to `get_history_db_path()`
+
+    Returns
+    -------
+    int
+        The ID of the attempt in the database
+
+    Examples
+    --------
+    >>> record_scrape_attempt(build_scrape_attempt("nse", 1, NSE_SGB_URL, True))
+    7
+    """
+    row = scrape_attempt._asdict()
+    row["ok"] = int(scrape_attempt.ok)
+    row["slowest_resources"] = json_dumps(scrape_attempt.slowest_resources)
+
+    conn = _connect(db_path)
+    try:
+        with conn:
+            cursor = conn.execute(
+                f"INSERT INTO scrape_attempts ({', '.join(row)}) VALUES ({', '.join('?' * len(row))})",
+                tuple(row.values()),
+            )
+    finally:
+        conn.close()
+
+    logger.debug(
+        "recorded {source} attempt {attempt} ({outcome})",
+        source=scrape_attempt.source,
+        attempt=scrape_attempt.attempt,
+        outcome="ok" if scrape_attempt.ok else scrape_attempt.error,
+    )
+    return int(cursor.lastrowid or 0)
+
+
+def _quantile(ordered: list[float], q: float) -> float:
+    """Nearest rank percentile of sorted values"""
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def get_scrape_stats(
+    source: Optional[str] = None,
+    since: Optional[date] = None,
+    db_path: Optional[Path] = None,
+) -> dict[str, dict[str, Any]]:
+    """
+    Aggregates the recorded attempts of every site, to tune timeouts and retries with
+
+    Parameters
+    ----------
+    source : Optional[str]
+        Only this site. Defaults to every site
+    since : Optional[date]
+        Only attempts on or after this day (UTC). Defaults to every attempt
+    db_path : Optional[Path]
+        Path of the database. Defaults to `get_history_db_path()`
+
+    Returns
+    -------
+    dict[str, dict[str, Any]]
+        For every site, the number of attempts and failures, the failures by error, how many attempts succeeded by their number in the run, and the p50, p90, p99 and max of every timing in TIMING_FIELDS
+
+    Examples
+    --------
+    >>> get_scrape_stats("nse")
+    {"nse": {"attempts": 40, "failed": 18, "failure_rate": 0.45, "errors": {"SiteNotLoadedError": 18}, "by_attempt": {"1": {"attempts": 20, "ok": 9}, ...}, "ttfb_ms": {"p50": 640.2, ...}, ...}}
+    """
+    clauses, params = list(), list()
+    if source:
+        clauses.append("source = ?")
+        params.append(source)
+    if since:
+        clauses.append("attempted_at >= ?")
+        params.append(since.isoformat())
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+
+    conn = _connect(db_path)
+    try:
+        rows = conn.execute(
+            f"SELECT * FROM scrape_attempts {where} ORDER BY id", params
+        ).fetchall()
+    finally:
+        conn.close()
+
+    grouped: dict[str, list[dict[str, Any]]] = dict()
+    for row in rows:
+        grouped.setdefault(row["source"], list()).append(dict(row))
+
+    stats: dict[str, dict[str, Any]] = dict()
+    for name, attempts in grouped.items():
+        failed = [a for a in attempts if not a["ok"]]
+        by_attempt: dict[str, dict[str, int]] = dict()
+        for a in attempts:
+            counts = by_attempt.setdefault(str(a["attempt"]), {"attempts": 0, "ok": 0})
+            counts["attempts"] += 1
+            counts["ok"] += a["ok"]
+
+        stats[name] = {
+            "attempts": len(attempts),
+            "failed": len(failed),
+            "failure_rate": round(len(failed) / len(attempts), 3),
+            "errors": dict(
+                Counter(str(a["error"]).split(":")[0] for a in failed).most_common()
+            ),
+            "by_attempt": by_attempt,
+        }
+        for field in TIMING_FIELDS:
+            ordered = sorted(a[field] for a in attempts if a[field] is not None)
+            if ordered:
+                stats[name][field] = {
+                    **{f"p{q * 100:g}": _quantile(ordered, q) for q in QUANTILES},
+                    "max": ordered[-1],
+                    "count": len(ordered),
+                }
+    return stats
@@ -0,0 +1,389 @@
+"""
+SQLite backed store that keeps the raw quotes, gold price and computed XIRRs of every run
+"""
+
+from datetime import date, datetime
+from os import getenv
+from pathlib import Path
+from sqlite3 import Connection, Row
+from sqlite3 import connect as sqlite_connect
+from typing import Any, Optional
+
+from ..config import ARTIFACT_DIR
+from ..logg import logger
+from ..models import SGB
+
+HISTORY_DB_PATH_ENV: str = "SGB_HISTORY_DB_PATH"
+"""Path of the SQLite database. Set it to an empty string to disable the history store"""
+
+DEFAULT_HISTORY_DB_PATH: Path = ARTIFACT_DIR / "sgb_advisor_history.sqlite3"
+"""Kept with the other on-disk state in SGB_ARTIFACT_DIR, so runs don't leave a database wherever they were started from"""
+
+SCHEMA: str = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_at TEXT NOT NULL,
+    date TEXT NOT NULL,
+    gold_price REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_runs_date ON runs (date);
+
+CREATE TABLE IF NOT EXISTS quotes (
+    run_id INTEGER NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+    date TEXT NOT NULL,
+    symbol TEXT NOT NULL,
+    ltp REAL NOT NULL,
+    volume INTEGER NOT NULL,
+    issue_price REAL NOT NULL,
+    interest_rate REAL NOT NULL,
+    maturity_date TEXT NOT NULL,
+    xirr REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_quotes_symbol_date ON quotes (symbol, date);
+CREATE INDEX IF NOT EXISTS idx_quotes_date ON quotes (date);
+"""
+"""Every query filters on either (symbol, date) or date, so both have their own index"""
+
+
+def get_history_db_path() -> Optional[Path]:
+    """
+    Returns the path of the history database, read from the SGB_HISTORY_DB_PATH environment variable. Defaults to DEFAULT_HISTORY_DB_PATH, in SGB_ARTIFACT_DIR.
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    Optional[Path]
+        The path of the database. `None` if the history store has been disabled by setting the variable to an empty string.
+
+    Examples
+    --------
+    >>> get_history_db_path()
+    Path("/tmp/sgb_advisor/sgb_advisor_history.sqlite3")
+    """
+    db_path = getenv(HISTORY_DB_PATH_ENV, str(DEFAULT_HISTORY_DB_PATH))
+    return Path(db_path) if db_path else None
+
+
+def connect_history_db(db_path: Optional[Path] = None) -> Connection:
+    """
+    Opens a connection to the history database in WAL mode, creating the file and the schema if they don't exist.
+
+    Parameters
+    ----------
+    db_path : Optional[Path]
+        Path of the database. Defaults to `get_history_db_path()`
+
+    Returns
+    -------
+    Connection
+        The SQLite connection, which returns rows as `sqlite3.Row`
+
+    Examples
+    --------
+    >>> connect_history_db()
+    <sqlite3.Connection object at 0x7f1c2b3c4d50>
+    """
+    db_path = db_path or get_history_db_path()
+    if not db_path:
+        msg = f"history store is disabled since {HISTORY_DB_PATH_ENV} is set to an empty string"
+        logger.error(msg)
+        raise RuntimeError(msg)
+
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+
+    conn = sqlite_connect(db_path)
+    conn.row_factory = Row
+    # WAL lets readers (like the query API) work while a run is appending to the database
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA foreign_keys=ON")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def record_run(
+    sgbs: list[SGB],
+    gold_price: float,
+    run_at: datetime,
+    db_path: Optional[Path] = None,
+) -> int:
+    """
+    Appends the snapshot of a run to the history database in a single transaction.
+
+    Parameters
+    ----------
+    sgbs : list[SGB]
+        The SGBs fetched in this run, with their XIRRs calculated
+    gold_price : float
+        The price of gold used to calculate the XIRRs
+    run_at : datetime
+        The time of the run. The date of this is used as the trading date of the snapshot
+    db_path : Optional[Path]
+        Path of the database. Defaults to `get_history_db_path()`
+
+    Returns
+    -------
+    int
+        The ID of the run in the database
+
+    Examples
+    --------
+    >>> record_run(sgbs, 7956.0, get_ist_time())
+    42
+    """
+    trading_date = run_at.date().isoformat()
+
+    conn = connect_history_db(db_path)
+    try:
+        with conn:
+            cursor = conn.execute(
+                "INSERT INTO runs (run_at, date, gold_price) VALUES (?, ?, ?)",
+                (run_at.isoformat(), trading_date, gold_price),
+            )
+            run_id = cursor.lastrowid
+            conn.executemany(
+                """INSERT INTO quotes (
+                    run_id, date, symbol, ltp, volume, issue_price, interest_rate, maturity_date, xirr
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                [
+                    (
+                        run_id,
+                        trading_date,
+                        sgb.nse_symbol,
+                        sgb.ltp,
+                        sgb.volume,
+                        sgb.issue_price,
+                        sgb.interest_rate,
+                        sgb.maturity_date.isoformat(),
+                        sgb.xirr,
+                    )
+                    for sgb in sgbs
+                ],
+            )
+    finally:
+        conn.close()
+
+    logger.info(f"recorded {len(sgbs)} SGBs to history as run {run_id}")
+    return int(run_id or 0)
+
+
+def _date_range_clause(
+    start: Optional[date], end: Optional[date], column: str = "date"
+) -> tuple[str, list[str]]:
+    """Builds an SQL condition (without WHERE) and its parameters for an inclusive date range"""
+    conditions: list[str] = list()
+    params: list[str] = list()
+    if start:
+        conditions.append(f"{column} >= ?")
+        params.append(start.isoformat())
+    if end:
+        conditions.append(f"{column} <= ?")
+        params.append(end.isoformat())
+    return " AND ".join(conditions) or "1", params
+
+
+def _fetch_all(
+    query: str, params: list[Any], db_path: Optional[Path] = None
+) -> list[dict[str, Any]]:
+    conn = connect_history_db(db_path)
+    try:
+        return [dict(row) for row in conn.execute(query, params)]
+    finally:
+        conn.close()
+
+
+def get_runs(
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    db_path: Optional[Path] = None,
+) -> list[dict[str, Any]]:
+    """
+    Returns every run recorded between the start and end trading dates, both inclusive.
+
+    Parameters
+    ----------
+    start : Optional[date]
+        First trading date to include. Defaults to the beginning of history
+    end : Optional[date]
+        Last trading date to include. Defaults to the end of history
+    db_path : Optional[Path]
+        Path of the database. Defaults to `get_history_db_path()`
+
+    Returns
+    -------
+    list[dict[str, Any]]
+        The runs, ordered by time
+
+    Examples
+    --------
+    >>> get_runs(date(2024, 9, 1), date(2024, 9, 30))
+    [{"id": 1, "run_at": "2024-09-02T10:00:21.802675+00:00", "date": "2024-09-02", "gold_price": 7290.0}]
+    """
+    condition, params = _date_range_clause(start, end)
+    return _fetch_all(
+        f"SELECT * FROM runs WHERE {condition} ORDER BY date, run_at",
+        params,
+        db_path,
+    )
+
+
+def get_quotes(
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    db_path: Optional[Path] = None,
+) -> list[dict[str, Any]]:
+    """
+    Returns the quotes of all SGBs recorded between the start and end trading dates, both inclusive.
+
+    Parameters
+    ----------
+    start : Optional[date]
+        First trading date to include. Defaults to the beginning of history
+    end : Optional[date]
+        Last trading date to include. Defaults to the end of history
+    db_path : Optional[Path]
+        Path of the database. Defaults to `get_history_db_path()`
+
+    Returns
+    -------
+    list[dict[str, Any]]
+        The quotes along with the gold price of their run, ordered by date and descending XIRR
+
+    Examples
+    --------
+    >>> get_quotes(date(2024, 9, 2), date(2024, 9, 2))
+    [{"run_id": 1, "date": "2024-09-02", "symbol": "SGBSEP27", "ltp": 7900.02, ..., "gold_price": 7290.0}]
+    """
+    condition, params = _date_range_clause(start, end, "q.date")
+    return _fetch_all(
+        f"""SELECT q.*, r.gold_price FROM quotes q JOIN runs r ON r.id = q.run_id
+        WHERE {condition} ORDER BY q.date, q.run_id, q.xirr DESC""",
+        params,
+        db_path,
+    )
+
+
+def get_symbol_history(
+    symbol: str,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    db_path: Optional[Path] = None,
+) -> list[dict[str, Any]]:
+    """
+    Returns the quotes of a single SGB recorded between the start and end trading dates, both inclusive.
+
+    Parameters
+    ----------
+    symbol : str
+        NSE symbol of the SGB
+    start : Optional[date]
+        First trading date to include. Defaults to the beginning of history
+    end : Optional[date]
+        Last trading date to include. Defaults to the end of history
+    db_path : Optional[Path]
+        Path of the database. Defaults to `get_history_db_path()`
+
+    Returns
+    -------
+    list[dict[str, Any]]
+        The quotes along with the gold price of their run, ordered by date
+
+    Examples
+    --------
+    >>> get_symbol_history("SGBSEP27")
+    [{"run_id": 1, "date": "2024-09-02", "symbol": "SGBSEP27", "ltp": 7900.02, ..., "gold_price": 7290.0}]
+    """
+    condition, params = _date_range_clause(start, end, "q.date")
+    return _fetch_all(
+        f"""SELECT q.*, r.gold_price FROM quotes q JOIN runs r ON r.id = q.run_id
+        WHERE q.symbol = ? AND {condition} ORDER BY q.date, q.run_id""",
+        [symbol, *params],
+        db_path,
+    )
+
+
+def sgb_from_quote(quote: dict[str, Any]) -> SGB:
+    """
+    Builds an SGB back from a quote returned by the history store, including its XIRR
+
+    Parameters
+    ----------
+    quote : dict[str, Any]
+        A quote from `get_quotes()`, `get_symbol_history()` or `get_latest_run()`
+
+    Returns
+    -------
+    SGB object
+
+    Examples
+    --------
+    >>> sgb_from_quote(get_latest_run()["quotes"][0])
+    SGB_Object
+    """
+    sgb = SGB(
+        quote["symbol"],
+        quote["ltp"],
+        quote["issue_price"],
+        quote["interest_rate"],
+        date.fromisoformat(quote["maturity_date"]),
+        quote["volume"],
+    )
+    sgb.xirr = quote["xirr"]
+    return sgb
+
+
+def get_latest_run(db_path: Optional[Path] = None) -> Optional[dict[str, Any]]:
+    """
+    Returns the most recent run along with its quotes.
+
+    Parameters
+    ----------
+    db_path : Optional[Path]
+        Path of the database. Defaults to `get_history_db_path()`
+
+    Returns
+    -------
+    Optional[dict[str, Any]]
+        The run, with its quotes under the "quotes" key ordered by descending XIRR. `None` if nothing has been recorded yet
+
+    Examples
+    --------
+    >>> get_latest_run()
+    {"id": 42, "run_at": "2024-09-02T10:00:21.802675+00:00", "date": "2024-09-02", "gold_price": 7290.0, "quotes": [...]}
+    """
+    runs = _fetch_all("SELECT * FROM runs ORDER BY id DESC LIMIT 1", [], db_path)
+    if not runs:
+        return None
+    run = runs[0]
+    run["quotes"] = _fetch_all(
+        "SELECT * FROM quotes WHERE run_id = ? ORDER BY xirr DESC",
+        [run["id"]],
+        db_path,
+    )
+    return run
+
+
+def get_latest_run_id(db_path: Optional[Path] = None) -> Optional[int]:
+    """
+    Returns the ID of the most recent run, which is a cheap way to check if anything new has been recorded.
+
+    Parameters
+    ----------
+    db_path : Optional[Path]
+        Path of the database. Defaults to `get_history_db_path()`
+
+    Returns
+    -------
+    Optional[int]
+        The ID of the run. `None` if nothing has been recorded yet
+
+    Examples
+    --------
+    >>> get_latest_run_id()
+    42
+    """
+    runs = _fetch_all("SELECT MAX(id) AS id FROM runs", [], db_path)
+    return runs[0]["id"] if runs else None
@@ -0,0 +1,303 @@
+"""
+Delta encoded store for intraday snapshots ("ticks"). Every tick only stores the SGBs whose LTP, volume or XIRR changed since the previous tick, with a full keyframe written periodically so any point in time can be rebuilt from a handful of rows.
+"""
+
+from datetime import date, datetime, timedelta
+from json import dumps as json_dumps
+from json import loads as json_loads
+from os import getenv
+from pathlib import Path
+from sqlite3 import Connection
+from typing import Any, Optional
+
+from ..logg import logger
+from ..models import SGB
+from .store import connect_history_db
+
+TICK_KEYFRAME_INTERVAL_ENV: str = "SGB_TICK_KEYFRAME_INTERVAL"
+TICK_KEYFRAME_INTERVAL: int = int(getenv(TICK_KEYFRAME_INTERVAL_ENV, "60") or 60)
+"""A keyframe is written after these many ticks, which bounds how many deltas have to be applied to rebuild a snapshot"""
+
+PRICE_SCALE: int = 100
+"""Prices are stored as integer paise"""
+
+XIRR_SCALE: int = 1000
+"""XIRRs are rounded to 3 digits by `calculate_sgb_xirr`, so they are stored as integer thousandths of a percent"""
+
+TICKS_SCHEMA: str = """
+CREATE TABLE IF NOT EXISTS ticks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    tick_at TEXT NOT NULL,
+    is_keyframe INTEGER NOT NULL,
+    gold_price INTEGER NOT NULL,
+    payload TEXT NOT NULL,
+    full_size INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_ticks_tick_at ON ticks (tick_at);
+CREATE INDEX IF NOT EXISTS idx_ticks_keyframe ON ticks (is_keyframe, tick_at);
+"""
+
+TickState = dict[str, list[int]]
+"""Maps an NSE symbol to its integer scaled [ltp, volume, xirr]"""
+
+
+def _connect(db_path: Optional[Path] = None) -> Connection:
+    conn = connect_history_db(db_path)
+    conn.executescript(TICKS_SCHEMA)
+    return conn
+
+
+def _encode_sgb(sgb: SGB) -> list[int]:
+    return [
+        round(sgb.ltp * PRICE_SCALE),
+        int(sgb.volume),
+        round(sgb.xirr * XIRR_SCALE),
+    ]
+
+
+def _compact_json(obj: dict[str, Optional[list[int]]]) -> str:
+    return json_dumps(obj, separators=(",", ":"))
+
+
+def _get_full_snapshot_size(
+    sgbs: list[SGB], gold_price: float, tick_at: datetime
+) -> int:
+    """Size in bytes of the snapshot if it was stored as a full JSON document, like the JSON file sent on Telegram"""
+    return len(
+        json_dumps(
+            {
+                "time": str(tick_at),
+                "gold_price": gold_price,
+                "sgbs": [sgb.to_dict() for sgb in sgbs],
+            }
+        ).encode()
+    )
+
+
+def _get_state_at(
+    conn: Connection, at: Optional[str] = None
+) -> tuple[Optional[TickState], int, int, Optional[str]]:
+    """
+    Rebuilds the state at (or before) the given ISO timestamp from the closest keyframe and the deltas that follow it.
+
+    Returns
+    -------
+    tuple[Optional[TickState], int, int, Optional[str]]
+        The state (None if there are no ticks), the gold price in paise, the number of ticks since the keyframe and the time of the last tick applied
+    """
+    time_condition = "AND tick_at <= ?" if at else ""
+    params: list[str] = [at] if at else []
+
+    keyframe = conn.execute(
+        f"""SELECT * FROM ticks WHERE is_keyframe = 1 {time_condition}
+        ORDER BY tick_at DESC, id DESC LIMIT 1""",
+        params,
+    ).fetchone()
+    if not keyframe:
+        return None, 0, 0, None
+
+    state: TickState = json_loads(keyframe["payload"])
+    gold_price: int = keyframe["gold_price"]
+    tick_at: str = keyframe["tick_at"]
+    n_deltas = 0
+
+    for delta in conn.execute(
+        f"SELECT * FROM ticks WHERE id > ? {time_condition} ORDER BY id",
+        [keyframe["id"], *params],
+    ):
+        n_deltas += 1
+        gold_price = delta["gold_price"]
+        tick_at = delta["tick_at"]
+        for symbol, values in json_loads(delta["payload"]).items():
+            if values is None:
+                state.pop(symbol, None)
+            else:
+                state[symbol] = values
+
+    return state, gold_price, n_deltas, tick_at
+
+
+def record_tick(
+    sgbs: list[SGB],
+    gold_price: float,
+    tick_at: datetime,
+    db_path: Optional[Path] = None,
+) -> bool:
+    """
+    Appends a tick to the history database. Only the SGBs that changed since the previous tick are stored, unless a keyframe is due.
+
+    Parameters
+    ----------
+    sgbs : list[SGB]
+        The SGBs fetched in this tick, with their XIRRs calculated
+    gold_price : float
+        The price of gold used to calculate the XIRRs
+    tick_at : datetime
+        The time of the tick
+    db_path : Optional[Path]
+        Path of the database. Defaults to `get_history_db_path()`
+
+    Returns
+    -------
+    bool
+        `True` if the tick was stored as a keyframe, `False` if it was stored as a delta
+
+    Examples
+    --------
+    >>> record_tick(sgbs, 7956.0, get_ist_time())
+    False
+    """
+    current: TickState = {sgb.nse_symbol: _encode_sgb(sgb) for sgb in sgbs}
+    scaled_gold_price = round(gold_price * PRICE_SCALE)
+
+    conn = _connect(db_path)
+    try:
+        with conn:
+            # Takes the write lock before reading the previous tick, so two writers can't both write a delta against the same one
+            conn.execute("BEGIN IMMEDIATE")
+            previous, _, n_deltas, previous_tick_at = _get_state_at(conn)
+
+            # A new trading day always starts with a keyframe, so reading a day never needs the previous one
+            is_keyframe = (
+                previous is None
+                or n_deltas + 1 >= TICK_KEYFRAME_INTERVAL
+                or (previous_tick_at or "")[:10] != tick_at.date().isoformat()
+            )
+
+            if is_keyframe or previous is None:
+                payload: dict[str, Optional[list[int]]] = dict(current)
+            else:
+                payload = {
+                    symbol: values
+                    for symbol, values in current.items()
+                    if previous.get(symbol) != values
+                }
+                payload.update(
+                    {symbol: None for symbol in previous if symbol not in current}
+                )
+
+            conn.execute(
+                """INSERT INTO ticks (tick_at, is_keyframe, gold_price, payload, full_size)
+                VALUES (?, ?, ?, ?, ?)""",
+                (
+                    tick_at.isoformat(),
+                    int(is_keyframe),
+                    scaled_gold_price,
+                    _compact_json(payload),
+                    _get_full_snapshot_size(sgbs, gold_price, tick_at),
+                ),
+            )
+    finally:
+        conn.close()
+
+    logger.debug(
+        "recorded tick at {} as {}",
+        tick_at,
+        "keyframe" if is_keyframe else f"delta of {len(payload)} SGB(s)",
+    )
+    return is_keyframe
+
+
+def get_snapshot_at(
+    at: datetime, db_path: Optional[Path] = None
+) -> Optional[dict[str, Any]]:
+    """
+    Rebuilds the snapshot as it was at the given time, from the closest keyframe before it and the deltas that follow.
+
+    Parameters
+    ----------
+    at : datetime
+        The point in time to rebuild
+    db_path : Optional[Path]
+        Path of the database. Defaults to `get_history_db_path()`
+
+    Returns
+    -------
+    Optional[dict[str, Any]]
+        The time of the last tick at or before `at`, the gold price and the SGBs sorted in descending order of XIRR. `None` if there are no ticks before `at`
+
+    Examples
+    --------
+    >>> get_snapshot_at(datetime(2024, 9, 2, 13, 0))
+    {"time": "2024-09-02T12:59:03", "gold_price": 7290.0, "sgbs": [{"nse_symbol": "SGBSEP27", "ltp": 7900.02, "volume": 31, "xirr": 5.123}]}
+    """
+    conn = _connect(db_path)
+    try:
+        state, gold_price, _, tick_at = _get_state_at(conn, at.isoformat())
+    finally:
+        conn.close()
+
+    if state is None:
+        return None
+
+    sgbs = [
+        {
+            "nse_symbol": symbol,
+            "ltp": ltp / PRICE_SCALE,
+            "volume": volume,
+            "xirr": xirr / XIRR_SCALE,
+        }
+        for symbol, (ltp, volume, xirr) in state.items()
+    ]
+    sgbs.sort(key=lambda x: x["xirr"], reverse=True)
+
+    return {
+        "time": tick_at,
+        "gold_price": gold_price / PRICE_SCALE,
+        "sgbs": sgbs,
+    }
+
+
+def get_tick_compression_ratio(
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    db_path: Optional[Path] = None,
+) -> float:
+    """
+    Returns how many times smaller the stored ticks are compared to storing every tick as a full JSON snapshot.
+
+    Parameters
+    ----------
+    start : Optional[date]
+        First date to include. Defaults to the beginning of history
+    end : Optional[date]
+        Last date to include, inclusive. Defaults to the end of history
+    db_path : Optional[Path]
+        Path of the database. Defaults to `get_history_db_path()`
+
+    Returns
+    -------
+    float
+        Size of full JSON snapshots divided by the size of the stored payloads. 0 if there are no ticks
+
+    Examples
+    --------
+    >>> get_tick_compression_ratio()
+    23.41
+    """
+    conditions: list[str] = list()
+    params: list[str] = list()
+    if start:
+        conditions.append("tick_at >= ?")
+        params.append(start.isoformat())
+    if end:
+        # tick_at is a full timestamp, so compare against the start of the next day
+        conditions.append("tick_at < ?")
+        params.append((end + timedelta(days=1)).isoformat())
+
+    conn = _connect(db_path)
+    try:
+        full_size, stored_size = conn.execute(
+            f"""SELECT SUM(full_size), SUM(LENGTH(CAST(payload AS BLOB))) FROM ticks
+            WHERE {" AND ".join(conditions) or "1"}""",
+            params,
+        ).fetchone()
+    finally:
+        conn.close()
+
+    if not stored_size:
+        return 0
+
+    ratio = round(full_size / stored_size, 2)
+    logger.info(f"ticks are stored {ratio} times smaller than full JSON snapshots")
+    return ratio
@@ -1,15 +1,95 @@
 """
-Logger object for all files. Prints and writes logs to the file `sgb_advisor.log`
+Logger object for all files. Prints logs and writes them to the file SGB_LOG_FILE (`sgb_advisor.log` by default), as text or as JSON lines
+
+Both sinks are queued, so a log call never waits on the disk or the terminal, and the file is rotated, compressed and deleted after a while, so long running commands like `bot` and `serve` don't fill the disk.
+
+Structured fields, like the stage, source, attempt or duration, are passed as keyword arguments and are written as fields of the JSON lines
+
+    logger.info("fetching {source} - {attempt} time(s)", source="nse", attempt=2)
+
+Debug logs pass their values as arguments instead of using f-strings, so that they are only formatted when the debug level is enabled
+
+    logger.debug("read {} SGBs from {}", len(sgbs), path)
 """
 
-from sys import stdout
+from json import dumps as json_dumps
 from os import getenv
+from sys import stdout
+from traceback import format_exception
+from typing import TYPE_CHECKING
 
 from loguru import logger
 
-log_level = getenv("SGB_LOG_LEVEL", "INFO").upper() or "INFO"
+if TYPE_CHECKING:
+    from loguru import Record
+
+TEXT_FORMAT: str = "text"
+JSON_FORMAT: str = "json"
+
+LOG_LEVEL_ENV: str = "SGB_LOG_LEVEL"
+LOG_LEVEL: str = getenv(LOG_LEVEL_ENV, "INFO").upper() or "INFO"
+
+LOG_FILE_ENV: str = "SGB_LOG_FILE"
+LOG_FILE: str = getenv(LOG_FILE_ENV, "sgb_advisor.log")
+"""File the logs are written to. Empty to only print them"""
+
+LOG_FORMAT_ENV: str = "SGB_LOG_FORMAT"
+LOG_FORMAT: str = getenv(LOG_FORMAT_ENV, TEXT_FORMAT).lower() or TEXT_FORMAT
+"""TEXT_FORMAT for loguru's usual lines, JSON_FORMAT for one JSON object per line"""
+
+LOG_ROTATION: str = getenv("SGB_LOG_ROTATION", "10 MB") or "10 MB"
+"""When the log file is closed and a new one started. A size like "10 MB", an interval like "1 day", or a time like "00:00" """
+
+LOG_RETENTION: str = getenv("SGB_LOG_RETENTION", "14 days") or "14 days"
+"""How long rotated log files are kept, like "14 days", or how many of them, like "10" """
+
+LOG_COMPRESSION: str = getenv("SGB_LOG_COMPRESSION", "gz")
+"""Format rotated log files are compressed to, like "gz" or "zip". Empty to not compress them"""
+
+
+def format_json(record: "Record") -> str:
+    """Formats a record as a JSON line, with its structured fields next to the message"""
+    extra = {key: value for key, value in record["extra"].items() if key != "json"}
+    exception = record["exception"]
+    record["extra"]["json"] = json_dumps(
+        {
+            "time": record["time"].isoformat(),
+            "level": record["level"].name,
+            "message": record["message"],
+            "module": record["name"],
+            "function": record["function"],
+            "line": record["line"],
+            **extra,
+            **(
+                {"exception": "".join(format_exception(*exception))}
+                if exception and exception.type
+                else {}
+            ),
+        },
+        default=str,
+    )
+    return "{extra[json]}\n"
+
+
 logger.remove()
-logger.level(log_level)
-logger.add("sgb_advisor.log", level=log_level)
-logger.add(stdout, level=log_level)
-logger.debug(f"Log level set to {log_level}")
+logger.level(LOG_LEVEL)
+log_format = format_json if LOG_FORMAT == JSON_FORMAT else None
+if LOG_FILE:
+    # delay, so the file is only created when something is logged instead of on import
+    logger.add(
+        LOG_FILE,
+        level=LOG_LEVEL,
+        delay=True,
+        enqueue=True,
+        rotation=LOG_ROTATION,
+        retention=int(LOG_RETENTION) if LOG_RETENTION.isdigit() else LOG_RETENTION,
+        compression=LOG_COMPRESSION or None,
+        **({"format": log_format} if log_format else {}),
+    )
+logger.add(
+    stdout,
+    level=LOG_LEVEL,
+    enqueue=True,
+    **({"format": log_format} if log_format else {}),
+)
+logger.debug("Log level set to {}", LOG_LEVEL)
@@ -0,0 +1,355 @@
+"""
+Times every stage of a run with spans, and exports them as a JSON run report and a Prometheus textfile (for the node_exporter textfile collector), so slow runs can be broken down and latencies charted over time.
+
+    with span("nse.goto", attempt=2):
+        page.goto(NSE_SGB_URL)
+
+Only the most recent spans and durations are kept, so long running commands like `serve` and `bot` don't grow without bound. Those commands also export every SGB_METRICS_EXPORT_INTERVAL seconds while they run, instead of only when they exit.
+"""
+
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from json import dumps as json_dumps
+from os import getenv
+from pathlib import Path
+from threading import Lock
+from time import monotonic, perf_counter, time
+from typing import Any, Iterator, Optional
+
+from .cache import get_cache_stats
+from .logg import logger
+
+METRICS_REPORT_PATH_ENV: str = "SGB_METRICS_REPORT_PATH"
+METRICS_REPORT_PATH: str = getenv(METRICS_REPORT_PATH_ENV, "")
+"""JSON file the run report is written to when a command ends, and periodically while long running ones run. Empty to not write it"""
+
+METRICS_PROMETHEUS_PATH_ENV: str = "SGB_METRICS_PROMETHEUS_PATH"
+METRICS_PROMETHEUS_PATH: str = getenv(METRICS_PROMETHEUS_PATH_ENV, "")
+"""Prometheus textfile the metrics are written to when a command ends, and periodically while long running ones run, like /var/lib/node_exporter/sgb_advisor.prom. Empty to not write it"""
+
+METRICS_EXPORT_INTERVAL: float = float(
+    getenv("SGB_METRICS_EXPORT_INTERVAL", "60") or 60
+)
+"""Seconds between the exports of long running commands, like `serve`, `bot` and `worker`"""
+
+MAX_SPANS: int = 10_000
+"""Spans kept for the run report"""
+
+MAX_DURATIONS_PER_STAGE: int = 1_000
+"""Most recent durations of each stage kept to calculate its percentiles"""
+
+QUANTILES: tuple[float, ...] = (0.5, 0.9, 0.99)
+"""Percentiles reported for every stage"""
+
+AttributeValue = str | int | float | bool
+
+
+class Span:
+    """One timed stage. Fails if an exception is raised inside it, or if `ok` is set to False"""
+
+    __slots__ = {"name", "attributes", "started_at", "duration", "ok", "error"}
+
+    def __init__(self, name: str, attributes: dict[str, AttributeValue]) -> None:
+        self.name = name
+        """Name of the stage, like "nse.goto". Spans with the same name are aggregated"""
+
+        self.attributes = attributes
+        """Details of this span only, like the attempt or the API method. Not exported to Prometheus"""
+
+        self.started_at = time()
+        """Unix time the span started at"""
+
+        self.duration: float = 0
+        """Seconds the span took"""
+
+        self.ok = True
+        """Whether the stage succeeded"""
+
+        self.error: Optional[str] = None
+        """Why the stage failed"""
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "name": self.name,
+            "started_at": datetime.fromtimestamp(
+                self.started_at, timezone.utc
+            ).isoformat(),
+            "duration": round(self.duration, 6),
+            "ok": self.ok,
+            "error": self.error,
+            **({"attributes": self.attributes} if self.attributes else {}),
+        }
+
+
+class StageStats:
+    """Aggregate of every span with the same name"""
+
+    __slots__ = {"count", "failed", "total", "durations"}
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.failed = 0
+        self.total: float = 0
+        self.durations: deque[float] = deque(maxlen=MAX_DURATIONS_PER_STAGE)
+
+    def add(self, span: Span) -> None:
+        self.count += 1
+        self.failed += not span.ok
+        self.total += span.duration
+        self.durations.append(span.duration)
+
+    def quantile(self, q: float) -> float:
+        """Nearest rank percentile of the recent durations"""
+        ordered = sorted(self.durations)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0
+
+
+_lock = Lock()
+_spans: deque[Span] = deque(maxlen=MAX_SPANS)
+_stages: dict[str, StageStats] = dict()
+_started_at: float = time()
+
+
+@contextmanager
+def span(name: str, **attributes: AttributeValue) -> Iterator[Span]:
+    """
+    Times the code inside it as a stage
+
+    Parameters
+    ----------
+    name : str
+        Name of the stage, like "nse.goto"
+    **attributes : AttributeValue
+        Details of this span, like attempt=2
+
+    Returns
+    -------
+    Iterator[Span]
+        The span, which can be marked as failed by setting `ok` to False
+
+    Examples
+    --------
+    >>> with span("telegram.request", method="sendMediaGroup") as s:
+    ...     s.ok = send()
+    """
+    s = Span(name, attributes)
+    start = perf_counter()
+    try:
+        yield s
+    except BaseException as e:
+        s.ok = False
+        s.error = repr(e)
+        raise
+    finally:
+        s.duration = perf_counter() - start
+        with _lock:
+            _spans.append(s)
+            _stages.setdefault(name, StageStats()).add(s)
+        logger.debug(
+            "{stage} took {duration:.3f}s",
+            stage=name,
+            duration=s.duration,
+            ok=s.ok,
+            **attributes,
+        )
+
+
+def reset_metrics() -> None:
+    """Forgets every span recorded so far"""
+    global _started_at
+    with _lock:
+        _spans.clear()
+        _stages.clear()
+        _started_at = time()
+
+
+def build_run_report() -> dict[str, Any]:
+    """
+    Returns every span recorded since the process started (or `reset_metrics()` was called), along with the aggregate of each stage and the counters of the caches
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    dict[str, Any]
+        The report, which can be serialised to JSON
+
+    Examples
+    --------
+    >>> build_run_report()
+    {"started_at": "...", "duration": 482.1, "stages": {"nse.goto": {"count": 3, "failed": 2, "total": 31.2, "p50": 10.0, ...}}, "spans": [...], "caches": [...]}
+    """
+    with _lock:
+        spans = [s.to_dict() for s in _spans]
+        stages = {
+            name: {
+                "count": stats.count,
+                "failed": stats.failed,
+                "total": round(stats.total, 6),
+                **{f"p{q * 100:g}": round(stats.quantile(q), 6) for q in QUANTILES},
+                "max": round(max(stats.durations, default=0), 6),
+            }
+            for name, stats in _stages.items()
+        }
+        started_at = _started_at
+
+    return {
+        "started_at": datetime.fromtimestamp(started_at, timezone.utc).isoformat(),
+        "duration": round(time() - started_at, 6),
+        "stages": stages,
+        "spans": spans,
+        "caches": [stats._asdict() for stats in get_cache_stats()],
+    }
+
+
+def escape_label(value: str) -> str:
+    """Escapes a Prometheus label value"""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render_prometheus() -> str:
+    """
+    Returns the metrics in the Prometheus text format
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    str
+        The metrics
+
+    Examples
+    --------
+    >>> print(render_prometheus())
+    # HELP sgb_advisor_stage_duration_seconds Seconds taken by each stage
+    # TYPE sgb_advisor_stage_duration_seconds summary
+    sgb_advisor_stage_duration_seconds{stage="nse.goto",quantile="0.5"} 10.0
+    ...
+    """
+    lines = [
+        "# HELP sgb_advisor_stage_duration_seconds Seconds taken by each stage",
+        "# TYPE sgb_advisor_stage_duration_seconds summary",
+    ]
+    failures = [
+        "# HELP sgb_advisor_stage_failures_total Spans of each stage that failed",
+        "# TYPE sgb_advisor_stage_failures_total counter",
+    ]
+    with _lock:
+        for name, stats in sorted(_stages.items()):
+            stage = f'stage="{escape_label(name)}"'
+            for q in QUANTILES:
+                lines.append(
+                    f'sgb_advisor_stage_duration_seconds{{{stage},quantile="{q:g}"}} {stats.quantile(q):.6f}'
+                )
+            lines.append(
+                f"sgb_advisor_stage_duration_seconds_sum{{{stage}}} {stats.total:.6f}"
+            )
+            lines.append(
+                f"sgb_advisor_stage_duration_seconds_count{{{stage}}} {stats.count}"
+            )
+            failures.append(
+                f"sgb_advisor_stage_failures_total{{{stage}}} {stats.failed}"
+            )
+
+    lines.extend(failures)
+    lines.extend(
+        [
+            "# HELP sgb_advisor_cache_requests_total Calls to each cache, by whether they were answered from it",
+            "# TYPE sgb_advisor_cache_requests_total counter",
+        ]
+    )
+    for stats in get_cache_stats():
+        cache = f'cache="{escape_label(stats.name)}"'
+        for result, count in (
+            ("hit", stats.hits),
+            ("miss", stats.misses),
+            ("coalesced", stats.coalesced),
+        ):
+            lines.append(
+                f'sgb_advisor_cache_requests_total{{{cache},result="{result}"}} {count}'
+            )
+
+    lines.extend(
+        [
+            "# HELP sgb_advisor_last_export_timestamp_seconds Unix time the metrics were written at",
+            "# TYPE sgb_advisor_last_export_timestamp_seconds gauge",
+            f"sgb_advisor_last_export_timestamp_seconds {time():.3f}",
+        ]
+    )
+    return "\n".join(lines) + "\n"
+
+
+def export_metrics(
+    report_path: str = METRICS_REPORT_PATH,
+    prometheus_path: str = METRICS_PROMETHEUS_PATH,
+) -> None:
+    """
+    Writes the run report and the Prometheus textfile, if their paths are set. Failing to write them is logged, and never fails the command
+
+    Parameters
+    ----------
+    report_path : str
+        JSON file for `build_run_report()`. Defaults to SGB_METRICS_REPORT_PATH
+    prometheus_path : str
+        Textfile for `render_prometheus()`. Defaults to SGB_METRICS_PROMETHEUS_PATH
+
+    Returns
+    -------
+    None
+
+    Examples
+    --------
+    >>> export_metrics("run_report.json", "sgb_advisor.prom")
+    None
+    """
+    # Imported here since the notify package imports this module
+    from .notify.artifact_store import atomic_write
+
+    for path, render in (
+        (report_path, lambda: json_dumps(build_run_report(), indent=4)),
+        (prometheus_path, render_prometheus),
+    ):
+        if not path:
+            continue
+        try:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            atomic_write(Path(path), render().encode())
+            logger.debug("wrote metrics to {}", path)
+        except OSError as e:
+            logger.error(f"could not write metrics to {path} - {e}")
+
+
+_last_export: Optional[float] = None
+"""When `export_metrics_periodically()` last exported, from `time.monotonic()`"""
+
+
+def export_metrics_periodically(interval: float = METRICS_EXPORT_INTERVAL) -> None:
+    """
+    Calls `export_metrics()` if it hasn't been called by this in the last `interval` seconds. Long running commands call this from their loops, so the textfile is kept fresh while they run
+
+    Parameters
+    ----------
+    interval : float
+        Minimum seconds between exports. Defaults to SGB_METRICS_EXPORT_INTERVAL or 60
+
+    Returns
+    -------
+    None
+
+    Examples
+    --------
+    >>> while True:
+    ...     process_outbox(channels)
+    ...     export_metrics_periodically()
+    """
+    global _last_export
+    now = monotonic()
+    if _last_export is not None and now - _last_export < interval:
+        return
+    _last_export = now
+    export_metrics()
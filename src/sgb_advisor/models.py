@@ -1,4 +1,5 @@
-from datetime import date
+from datetime import date, datetime
+from typing import NamedTuple
 
 
 class SGB:
@@ -10,6 +11,7 @@ class SGB:
         "issue_price",
         "interest_rate",
         "maturity_date",
+        "volume",
         "xirr",
     }
 
@@ -20,6 +22,7 @@ class SGB:
         issue_price: float | int,
         interest_rate: float | int,
         maturity_date: date,
+        volume: int = 0,
     ) -> None:
         """
         Initialize an SGB class
@@ -36,6 +39,8 @@ class SGB:
             The rate of interest on the bond, paid on self.issue_price
         maturity_date: datetime.date
             The date of maturity of the bond
+        volume : int
+            Number of units traded on NSE in the session. Defaults to 0
 
         Returns
         -------
@@ -68,6 +73,9 @@ class SGB:
         self.maturity_date = maturity_date
         """The date of maturity of the bond"""
 
+        self.volume = volume
+        """Number of units traded on NSE in the session"""
+
         self.xirr: float = 0
         """XIRR which can be calculated and set later"""
 
@@ -101,5 +109,69 @@ class SGB:
             "issue_price": self.issue_price,
             "interest_rate": self.interest_rate,
             "maturity_date": str(self.maturity_date),
+            "volume": self.volume,
             "xirr": self.xirr,
         }
+
+    @classmethod
+    def from_dict(cls, d: dict[str, float | int | str]) -> "SGB":
+        """
+        Builds an SGB back from `SGB.to_dict()`, including its XIRR
+
+        Parameters
+        ----------
+        d : dict[str, float | int | str]
+            The dictionary from `SGB.to_dict()`
+
+        Returns
+        -------
+        SGB object
+
+        Examples
+        --------
+        >>> SGB.from_dict(sgb.to_dict())
+        SGB_Object
+        """
+        sgb = cls(
+            str(d["nse_symbol"]),
+            d["ltp"],
+            d["issue_price"],
+            d["interest_rate"],
+            date.fromisoformat(str(d["maturity_date"])),
+            int(d.get("volume", 0)),
+        )
+        sgb.xirr = float(d.get("xirr", 0))
+        return sgb
+
+
+class Results(NamedTuple):
+    """Everything computed in a run. Immutable, so that every notifier renders from exactly the same data"""
+
+    sgbs: tuple[SGB, ...]
+    """SGBs sorted in descending order of XIRR"""
+
+    gold_price: float
+    """The price of gold used to calculate the XIRRs"""
+
+    generated_at: datetime
+    """Time of the run in IST"""
+
+    def to_dict(self) -> dict[str, float | str | list[dict[str, float | int | str]]]:
+        """Returns the results as a dictionary that can be serialised to JSON, and read back with `Results.from_dict()`"""
+        return {
+            "sgbs": [sgb.to_dict() for sgb in self.sgbs],
+            "gold_price": self.gold_price,
+            "generated_at": self.generated_at.isoformat(),
+        }
+
+    @classmethod
+    def from_dict(
+        cls, d: dict[str, float | str | list[dict[str, float | int | str]]]
+    ) -> "Results":
+        """Builds the results back from `Results.to_dict()`"""
+        sgbs = d["sgbs"]
+        return cls(
+            tuple(SGB.from_dict(sgb) for sgb in sgbs) if isinstance(sgbs, list) else (),
+            float(str(d["gold_price"])),
+            datetime.fromisoformat(str(d["generated_at"])),
+        )
@@ -1,14 +1,24 @@
-from os import getenv
+"""
+Sends the results through every mode that is set. The Telegram and email modules (and so requests, Playwright and boto3) are only imported by the modes that use them
+"""
 
+from functools import partial
+from time import time
+from typing import Optional
+
+from ..config import Config, get_config
 from ..logg import logger
-from ..models import SGB
+from ..models import SGB, Results
 from .common import tmp_folder
-from .email_sender import AWS_ACCESS_KEY_ENV, send_mail
-from .teleg import (
-    TELEGRAM_BOT_TOKEN_ENV,
-    create_and_send_message,
-    validate_telegram_envs,
+from .dedup import (
+    SKIP_UNCHANGED_DELIVERY,
+    get_content_hash,
+    is_already_delivered,
+    update_delivery_state,
 )
+from .dispatch import Channel, ChannelResult, dispatch_channels, get_exit_status
+from .outbox import enqueue, run_worker
+from .render import Artifacts, build_results, render_artifacts
 
 SGB_MODE_ENV: str = "SGB_MODE"
 TELEGRAM_MODE: str = "telegram"
@@ -16,53 +26,224 @@ EMAIL_MODE: str = "email"
 BOTH_MODE: str = "both"
 NONE_MODE: str = "none"
 
+INLINE_DELIVERY: str = "inline"
+"""Sends at the end of the run"""
+
+OUTBOX_DELIVERY: str = "outbox"
+"""Only queues the deliveries in the outbox, for `run_outbox_worker()` to send"""
+
 
-def notify(sgbs: list[SGB]) -> None:
+def notify(sgbs: list[SGB], config: Optional[Config] = None) -> list[ChannelResult]:
     """
-    Send notifications via all set modes.
+    Send notifications via all set modes at the same time. The HTML, text, caption and JSON are rendered once and shared by every mode. A failure in one mode doesn't stop the others.
 
     Parameters
     ----------
-    None
+    sgbs : list[SGB]
+        SGBs sorted in descending order of XIRR
+    config : Optional[Config]
+        Who to notify and how. Defaults to `get_config()`
 
     Returns
     -------
-    None
+    list[ChannelResult]
+        The result of every mode. Empty if nothing had to be sent
 
     Examples
     --------
     >>> notify(sgbs)
-    None
+    [<ChannelResult [telegram - ok in 1.204s]>, <ChannelResult [email - ok in 0.873s]>]
     """
+    return notify_results(build_results(sgbs), config)
+
+
+def notify_results(
+    results: Results, config: Optional[Config] = None
+) -> list[ChannelResult]:
+    """
+    Same as `notify()`, for results that have already been built, like the ones read from a snapshot. Doesn't fetch anything
+
+    Parameters
+    ----------
+    results : Results
+        The results of the run
+    config : Optional[Config]
+        Who to notify and how. Defaults to `get_config()`
 
-    MODE_OF_OPERATION: set[str] = guess_mode_of_notification()
+    Returns
+    -------
+    list[ChannelResult]
+        The result of every mode. Empty if nothing had to be sent
+
+    Examples
+    --------
+    >>> notify_results(load_snapshot(Path("snapshot.json")))
+    [<ChannelResult [telegram - ok in 1.204s]>]
+    """
+    config = config or get_config()
+    MODE_OF_OPERATION: set[str] = guess_mode_of_notification(config)
 
     if NONE_MODE in MODE_OF_OPERATION:
         logger.info(
             f'not sending any notifications since mode is set to {NONE_MODE}. Output will only be written to the folder "{tmp_folder}".'
         )
-        return
-
-    if TELEGRAM_MODE in MODE_OF_OPERATION:
-        if not validate_telegram_envs():
-            err = "could not send message via telegram"
-            logger.error(err)
-            raise RuntimeError(err)
-        create_and_send_message(sgbs)
-    if EMAIL_MODE in MODE_OF_OPERATION:
-        if not send_mail(sgbs):
-            err = "could not send email via AWS SES"
-            logger.error(err)
-            raise RuntimeError(err)
-
-
-def guess_mode_of_notification() -> set[str]:
+        return list()
+
+    # Checked before rendering, since rendering is the slow part and is wasted if nothing is sent
+    if SKIP_UNCHANGED_DELIVERY and is_already_delivered(
+        get_content_hash(results, config.held_sgbs)
+    ):
+        logger.info(
+            "not sending any notifications since the results haven't changed since they were last delivered"
+        )
+        return list()
+
+    artifacts = render_artifacts(results, config.held_sgbs)
+
+    channels: dict[str, Channel] = {
+        mode: channel
+        for mode, channel in get_channels(config).items()
+        if mode in MODE_OF_OPERATION
+    }
+
+    if config.delivery_mode == OUTBOX_DELIVERY:
+        # The worker sends these later and records the delivery once it has, see `run_outbox_worker()`
+        return enqueue(
+            artifacts,
+            {
+                mode: recipients
+                for mode, recipients in get_recipients(config).items()
+                if mode in channels
+            },
+        )
+
+    channel_results = dispatch_channels(artifacts, channels)
+    if get_exit_status(channel_results) == 0:
+        update_delivery_state(content_hash=artifacts.content_hash, delivered_at=time())
+    return channel_results
+
+
+def send_via_telegram(
+    artifacts: Artifacts,
+    config: Optional[Config] = None,
+    recipients: Optional[list[str]] = None,
+) -> bool:
+    """
+    Validates the Telegram bot token and chat IDs and sends every chat its output
+
+    Parameters
+    ----------
+    artifacts : Artifacts
+        The artifacts rendered for this run
+    config : Optional[Config]
+        The config with the bot token and chat IDs. Defaults to `get_config()`
+    recipients : Optional[list[str]]
+        The chat IDs to send to. Defaults to the chat IDs of the config
+
+    Returns
+    -------
+    bool
+        If the message was sent to every chat
+
+    Examples
+    --------
+    >>> send_via_telegram(artifacts)
+    True
+    """
+    from .teleg import send_to_subscribers, validate_telegram_envs
+
+    if not validate_telegram_envs(config=config):
+        logger.error("could not send message via telegram")
+        return False
+    return send_to_subscribers(artifacts, recipients, config=config)
+
+
+def send_via_email(
+    artifacts: Artifacts,
+    config: Optional[Config] = None,
+    recipients: Optional[list[str]] = None,
+) -> bool:
+    """
+    Sends every email recipient its output through SES
+
+    Parameters
+    ----------
+    artifacts : Artifacts
+        The artifacts rendered for this run
+    config : Optional[Config]
+        The config with the AWS credentials and recipients. Defaults to `get_config()`
+    recipients : Optional[list[str]]
+        The email addresses to send to. Defaults to the recipients of the config
+
+    Returns
+    -------
+    bool
+        If the email was sent to every recipient
+
+    Examples
+    --------
+    >>> send_via_email(artifacts)
+    True
+    """
+    from .email_sender import send_mail
+
+    return send_mail(artifacts, config, recipients)
+
+
+def get_channels(config: Optional[Config] = None) -> dict[str, Channel]:
+    """Maps every mode to the function that sends through it with the config"""
+    config = config or get_config()
+    return {
+        TELEGRAM_MODE: partial(send_via_telegram, config=config),
+        EMAIL_MODE: partial(send_via_email, config=config),
+    }
+
+
+def get_recipients(config: Optional[Config] = None) -> dict[str, list[str]]:
+    """Maps every mode to the recipients of the config it sends to"""
+    config = config or get_config()
+    return {
+        TELEGRAM_MODE: list(config.telegram_chat_ids),
+        EMAIL_MODE: list(config.aws_ses_recipients),
+    }
+
+
+def run_outbox_worker(
+    once: bool = False, interval: float = 5, config: Optional[Config] = None
+) -> int:
+    """
+    Sends the deliveries queued in the outbox by runs with SGB_DELIVERY_MODE set to "outbox"
+
+    Parameters
+    ----------
+    once : bool
+        Send what is due and return, instead of polling forever
+    interval : float
+        Seconds between polls of the outbox
+    config : Optional[Config]
+        The config the deliveries are sent with. Defaults to `get_config()`
+
+    Returns
+    -------
+    int
+        When run once, 0 if every delivery attempted succeeded and 1 otherwise
+
+    Examples
+    --------
+    >>> run_outbox_worker(once=True)
+    0
+    """
+    return run_worker(get_channels(config), once, interval)
+
+
+def guess_mode_of_notification(config: Optional[Config] = None) -> set[str]:
     """
-    Tries to guess which channel(s) to notify the user through. Reads the "MODE" environment variable first. If empty, it tries to guess it by reading other environment variables like TELEGRAM_BOT_TOKEN and AWS_ACCESS_KEY
+    Tries to guess which channel(s) to notify the user through. Reads the mode of the config (SGB_MODE) first. If empty, it tries to guess it from which of the Telegram bot token and AWS access key are set
 
     Parameters
     ----------
-    None
+    config : Optional[Config]
+        The config to read. Defaults to `get_config()`
 
     Returns
     -------
@@ -75,7 +256,8 @@ def guess_mode_of_notification() -> set[str]:
     {"telegram", "email"}
     """
 
-    mode: set[str] = set(getenv(SGB_MODE_ENV, "").casefold().split(","))
+    config = config or get_config()
+    mode: set[str] = set(config.mode.casefold().split(","))
 
     if NONE_MODE in mode:
         mode = {NONE_MODE}
@@ -84,15 +266,15 @@ def guess_mode_of_notification() -> set[str]:
     elif mode == {""}:
         mode = set()
         # Guessing mode(s) by looking at which env variables are set
-        if getenv(TELEGRAM_BOT_TOKEN_ENV):
+        if config.telegram_bot_token:
             mode.add(TELEGRAM_MODE)
-        if getenv(AWS_ACCESS_KEY_ENV):
+        if config.aws_access_key:
             mode.add(EMAIL_MODE)
     elif EMAIL_MODE not in mode and TELEGRAM_MODE not in mode:
         mode = set()
 
     if not mode:
-        msg: str = f"could not guess mode of operation. ENV {SGB_MODE_ENV} is set as {getenv(SGB_MODE_ENV)}"
+        msg: str = f"could not guess mode of operation. ENV {SGB_MODE_ENV} is set as {config.mode}"
 
         logger.error(msg)
         raise RuntimeError(msg)
@@ -0,0 +1,248 @@
+"""
+Keeps the HTML, PNG and JSON outputs of every run in one folder, under a size cap. Files are named by a hash of their contents, so the same output is only ever stored once and two different outputs never share a name.
+"""
+
+from datetime import datetime
+from hashlib import sha256
+from json import JSONDecodeError
+from json import dumps as json_dumps
+from json import loads as json_loads
+from os import getenv, getpid, replace
+from pathlib import Path
+from threading import Lock
+from time import time
+
+from ..config import ARTIFACT_DIR as ARTIFACT_DIR
+from ..logg import logger
+
+ARTIFACT_MAX_BYTES: int = int(
+    getenv("SGB_ARTIFACT_MAX_BYTES", str(100 * 1024 * 1024)) or 0
+)
+"""Total size the outputs may take up before the oldest ones are deleted. Set it to 0 to never delete by size"""
+
+ARTIFACT_MAX_AGE: int = int(getenv("SGB_ARTIFACT_MAX_AGE", str(30 * 24 * 60 * 60)) or 0)
+"""Seconds after which an output is deleted, counted from when it was last used. Set it to 0 to never delete by age"""
+
+LRU_EVICTION: str = "lru"
+AGE_EVICTION: str = "age"
+ARTIFACT_EVICTION: str = (
+    getenv("SGB_ARTIFACT_EVICTION", LRU_EVICTION).casefold() or LRU_EVICTION
+)
+"""Which outputs are deleted first when over the size cap. "lru" deletes the ones least recently written or reused, "age" deletes the ones created first"""
+
+ARTIFACT_NAME_MARKER: str = "SGB Advisor Output"
+"""Every managed file has this in its name. Other files in the folder, like the caches, are never deleted"""
+
+INDEX_FILE_NAME: str = "artifact_index.json"
+
+_index_lock = Lock()
+
+ArtifactIndex = dict[str, dict[str, float]]
+"""Maps a file name to its "size", "created_at" and "last_used_at" """
+
+
+def get_artifact_name(content: bytes, file_extension: str) -> str:
+    """
+    Returns the name an output is stored under, made from today's date and a hash of its contents
+
+    Parameters
+    ----------
+    content : bytes
+        Contents of the file
+    file_extension : str
+        The extension of the file, without the '.' prefix
+
+    Returns
+    -------
+    str
+        The file name
+
+    Examples
+    --------
+    >>> get_artifact_name(b"{}", "json")
+    "2024-11-20 SGB Advisor Output 44136fa355b3678a.json"
+    """
+    return f"{datetime.now().date()} {ARTIFACT_NAME_MARKER} {sha256(content).hexdigest()[:16]}.{file_extension}"
+
+
+def read_artifact_index(artifact_dir: Path = ARTIFACT_DIR) -> ArtifactIndex:
+    """
+    Reads the index of stored outputs. Files that are on disk but missing from the index (like ones written by older versions) are added using their modification time, and entries whose files are gone are dropped.
+
+    Parameters
+    ----------
+    artifact_dir : Path
+        Folder of the outputs. Defaults to SGB_ARTIFACT_DIR
+
+    Returns
+    -------
+    ArtifactIndex
+        Maps a file name to its size, creation time and last use time
+
+    Examples
+    --------
+    >>> read_artifact_index()
+    {"2024-11-20 SGB Advisor Output 44136fa355b3678a.json": {"size": 2, "created_at": 1732112421.8, "last_used_at": 1732112421.8}}
+    """
+    try:
+        index: ArtifactIndex = json_loads(
+            (artifact_dir / INDEX_FILE_NAME).read_text(encoding="utf-8")
+        )
+    except (OSError, JSONDecodeError):
+        index = dict()
+
+    on_disk: ArtifactIndex = dict()
+    for file in artifact_dir.glob(f"*{ARTIFACT_NAME_MARKER}*"):
+        if file.suffix == ".tmp" or not file.is_file():
+            continue
+        stat = file.stat()
+        on_disk[file.name] = index.get(file.name) or {
+            "size": stat.st_size,
+            "created_at": stat.st_mtime,
+            "last_used_at": stat.st_mtime,
+        }
+    return on_disk
+
+
+def write_artifact_index(
+    index: ArtifactIndex, artifact_dir: Path = ARTIFACT_DIR
+) -> None:
+    """Writes the index atomically, so a concurrent run never reads a half written file"""
+    atomic_write(artifact_dir / INDEX_FILE_NAME, json_dumps(index).encode())
+
+
+def atomic_write(path: Path, content: bytes) -> None:
+    """
+    Writes to a temporary file next to the path and renames it over the path, so readers see either the old file or the complete new one
+
+    Parameters
+    ----------
+    path : Path
+        The file to write
+    content : bytes
+        Contents of the file
+
+    Returns
+    -------
+    None
+
+    Examples
+    --------
+    >>> atomic_write(Path("/tmp/sgb_advisor/output.json"), b"{}")
+    None
+    """
+    tmp_path = path.with_name(f".{path.name}.{getpid()}.{time()}.tmp")
+    try:
+        tmp_path.write_bytes(content)
+        replace(tmp_path, path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+def store_artifact(
+    content: bytes, file_extension: str, artifact_dir: Path = ARTIFACT_DIR
+) -> Path:
+    """
+    Stores an output, then deletes old outputs if the folder is over its size cap. If an output with the same contents was already stored today, it is reused instead of written again.
+
+    Parameters
+    ----------
+    content : bytes
+        Contents of the file
+    file_extension : str
+        The extension of the file, without the '.' prefix
+    artifact_dir : Path
+        Folder of the outputs. Defaults to SGB_ARTIFACT_DIR
+
+    Returns
+    -------
+    Path
+        The path of the stored file
+
+    Examples
+    --------
+    >>> store_artifact(b"{}", "json")
+    Path("/tmp/sgb_advisor/2024-11-20 SGB Advisor Output 44136fa355b3678a.json")
+    """
+    artifact_dir.mkdir(parents=True, exist_ok=True)
+    name = get_artifact_name(content, file_extension)
+    path = artifact_dir / name
+    now = time()
+
+    if not path.is_file():
+        atomic_write(path, content)
+
+    with _index_lock:
+        index = read_artifact_index(artifact_dir)
+        entry = index.setdefault(
+            name, {"size": len(content), "created_at": now, "last_used_at": now}
+        )
+        entry["last_used_at"] = now
+        evicted = evict_artifacts(index, artifact_dir, keep=name)
+        write_artifact_index(index, artifact_dir)
+
+    if evicted:
+        logger.debug("deleted {} old output(s) from {}", len(evicted), artifact_dir)
+    return path
+
+
+def evict_artifacts(
+    index: ArtifactIndex,
+    artifact_dir: Path = ARTIFACT_DIR,
+    keep: str = "",
+    max_bytes: int = ARTIFACT_MAX_BYTES,
+    max_age: int = ARTIFACT_MAX_AGE,
+    policy: str = ARTIFACT_EVICTION,
+) -> list[str]:
+    """
+    Deletes outputs that haven't been used for longer than the maximum age, and then the least recently used (or oldest) ones until the folder is under the size cap. Deleted files are removed from the index in place.
+
+    Parameters
+    ----------
+    index : ArtifactIndex
+        The index from `read_artifact_index()`
+    artifact_dir : Path
+        Folder of the outputs. Defaults to SGB_ARTIFACT_DIR
+    keep : str
+        Name of a file that must not be deleted, like the one just written
+    max_bytes : int
+        Size cap in bytes. Defaults to SGB_ARTIFACT_MAX_BYTES
+    max_age : int
+        Maximum age in seconds. Defaults to SGB_ARTIFACT_MAX_AGE
+    policy : str
+        "lru" or "age". Defaults to SGB_ARTIFACT_EVICTION
+
+    Returns
+    -------
+    list[str]
+        Names of the deleted files
+
+    Examples
+    --------
+    >>> evict_artifacts(read_artifact_index(), max_bytes=1024 * 1024)
+    ["2024-11-01 SGB Advisor Output 3fa2b1c9d0e8f7a6.png"]
+    """
+    sort_key = "created_at" if policy == AGE_EVICTION else "last_used_at"
+    candidates = sorted(
+        (name for name in index if name != keep),
+        key=lambda name: index[name][sort_key],
+    )
+
+    now = time()
+    total_size = sum(entry["size"] for entry in index.values())
+    evicted: list[str] = list()
+
+    for name in candidates:
+        too_old = bool(max_age) and now - index[name]["last_used_at"] > max_age
+        too_big = bool(max_bytes) and total_size > max_bytes
+        if not too_old and not too_big:
+            continue
+        try:
+            (artifact_dir / name).unlink(missing_ok=True)
+        except OSError as e:
+            logger.warning(f'could not delete old output "{name}" - {e}')
+            continue
+        total_size -= index.pop(name)["size"]
+        evicted.append(name)
+
+    return evicted
@@ -0,0 +1,297 @@
+"""
+Interactive Telegram bot. Long polls `getUpdates` and answers commands from an in-memory index of the latest run in the history store, so a burst of users never triggers a scrape or a query per message.
+
+Commands -
+    /top [n]        the best n SGBs by XIRR (3 if not given)
+    /sgb <SYMBOL>   the details of one SGB
+    /held           the SGBs held by the chat, from its subscriber profile or SGB_ALREADY_HELD_SGBS
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from os import getenv
+from threading import BoundedSemaphore
+from time import monotonic, sleep
+from typing import Any, Optional
+
+from ..config import get_config
+from ..history import (
+    get_history_db_path,
+    get_latest_run,
+    get_latest_run_id,
+    sgb_from_quote,
+)
+from ..logg import logger
+from ..metrics import export_metrics_periodically
+from ..models import SGB, Results
+from .common import DISCLAIMER_URL, get_telegram_caption
+from .subscribers import get_profile
+from .teleg import escape_reserved_characters, get_telegram_client, test_bot_status
+from .telegram_client import TELEGRAM_MAX_WORKERS
+
+TELEGRAM_BOT_POLL_TIMEOUT_ENV: str = "SGB_TELEGRAM_BOT_POLL_TIMEOUT"
+TELEGRAM_BOT_POLL_TIMEOUT: int = int(getenv(TELEGRAM_BOT_POLL_TIMEOUT_ENV, "25") or 25)
+"""Seconds a `getUpdates` call waits for new messages before returning empty"""
+
+TELEGRAM_BOT_REFRESH_INTERVAL_ENV: str = "SGB_TELEGRAM_BOT_REFRESH_INTERVAL"
+TELEGRAM_BOT_REFRESH_INTERVAL: float = float(
+    getenv(TELEGRAM_BOT_REFRESH_INTERVAL_ENV, "60") or 60
+)
+"""Seconds between checks of the history store for a new run"""
+
+MAX_TOP_N: int = 20
+"""Most SGBs a single /top answers with"""
+
+MAX_PENDING_REPLIES: int = TELEGRAM_MAX_WORKERS * 8
+"""Replies waiting for a worker, after which polling pauses until some are sent. Telegram holds the updates until then"""
+
+HELP_TEXT: str = (
+    "Commands:\n"
+    "/top 5 - the best 5 SGBs by XIRR\n"
+    "/sgb SGBAUG28V - the details of one SGB\n"
+    "/held - the SGBs you hold\n"
+    f"\n[Disclaimers]({DISCLAIMER_URL})"
+)
+
+
+class BotIndex:
+    """The latest run, indexed for the commands. Built once per run, and every reply is cached until the next one"""
+
+    __slots__ = {"run_id", "results", "by_symbol", "_replies"}
+
+    def __init__(self, run_id: Optional[int], results: Optional[Results]) -> None:
+        self.run_id = run_id
+        """ID of the run in the history store. `None` if nothing has been recorded yet"""
+
+        self.results = results
+        """The results of the run"""
+
+        self.by_symbol: dict[str, SGB] = (
+            {sgb.nse_symbol: sgb for sgb in results.sgbs} if results else dict()
+        )
+        """Maps an NSE symbol to its SGB"""
+
+        self._replies: dict[tuple[str, ...], str] = dict()
+
+    @classmethod
+    def from_history(cls) -> "BotIndex":
+        """Builds the index from the most recent run in the history store"""
+        latest = get_latest_run()
+        if latest is None:
+            return cls(None, None)
+        return cls(
+            latest["id"],
+            Results(
+                tuple(sgb_from_quote(quote) for quote in latest["quotes"]),
+                latest["gold_price"],
+                datetime.fromisoformat(latest["run_at"]),
+            ),
+        )
+
+    def reply(self, chat_id: str, command: str, argument: str) -> str:
+        """
+        Returns the escaped MarkdownV2 reply to a command, building it only the first time it is asked for. Replies to /sgb with a symbol that isn't traded are built every time
+
+        Parameters
+        ----------
+        chat_id : str
+            The chat that sent the command, used to find its held SGBs
+        command : str
+            The command without the leading "/" or the bot's username, like "top"
+        argument : str
+            Whatever followed the command
+
+        Returns
+        -------
+        str
+            The reply, ready to be sent with the MarkdownV2 parse mode
+
+        Examples
+        --------
+        >>> index.reply("123456789", "top", "5")
+        "Top 5 SGBs are: \\n\\n`SGBJUN31I` \\- ₹5926\\.0 \\- 0\\.687%..."
+        """
+        if command == "top":
+            try:
+                n = min(max(int(argument or 3), 1), MAX_TOP_N)
+            except ValueError:
+                n = 3
+            key: tuple[str, ...] = (command, str(n))
+        elif command == "sgb":
+            key = (command, argument.upper())
+            if key[1] not in self.by_symbol:
+                # Not cached, since the argument can be anything and the cache would grow with every new one
+                return escape_reserved_characters(self._build_reply(key))
+        elif command == "held":
+            key = (
+                command,
+                *sorted(
+                    get_profile(chat_id).get_held_sgbs(get_config().held_sgbs)
+                    & self.by_symbol.keys()
+                ),
+            )
+        else:
+            key = ("help",)
+
+        if key not in self._replies:
+            self._replies[key] = escape_reserved_characters(self._build_reply(key))
+        return self._replies[key]
+
+    def _build_reply(self, key: tuple[str, ...]) -> str:
+        command, *arguments = key
+        if command == "help":
+            return HELP_TEXT
+        if self.results is None:
+            return "No results have been recorded yet, try again after the next run"
+
+        if command == "top":
+            return get_telegram_caption(self.results, int(arguments[0]))
+
+        if command == "sgb":
+            if not arguments[0]:
+                return "Send the NSE symbol of an SGB, like /sgb SGBAUG28V"
+            sgb = self.by_symbol.get(arguments[0])
+            if sgb is None:
+                return f"{arguments[0]} is not traded on NSE right now"
+            return (
+                f"`{sgb.nse_symbol}` - ₹{sgb.ltp} - {sgb.xirr}%\n"
+                f"Issued at ₹{sgb.issue_price} with {sgb.interest_rate}% interest\n"
+                f"Matures on {sgb.maturity_date}\n"
+                f"Volume - {sgb.volume}\n"
+                f"Gold price - ₹{self.results.gold_price}\n"
+                f"[Disclaimers]({DISCLAIMER_URL})"
+            )
+
+        if not arguments:
+            return "You don't hold any of the SGBs traded on NSE right now"
+        held = tuple(sgb for sgb in self.results.sgbs if sgb.nse_symbol in arguments)
+        return get_telegram_caption(
+            self.results._replace(sgbs=held), len(held), "SGBs you hold are: "
+        )
+
+
+def parse_command(text: str) -> Optional[tuple[str, str]]:
+    """
+    Splits a message into its command and argument
+
+    Parameters
+    ----------
+    text : str
+        The text of the message
+
+    Returns
+    -------
+    Optional[tuple[str, str]]
+        The command in lower case without the "/" or the bot's username, and the rest of the message. `None` if the message isn't a command
+
+    Examples
+    --------
+    >>> parse_command("/top@sgb_advisor_bot 5")
+    ("top", "5")
+    """
+    if not text.startswith("/"):
+        return None
+    command, _, argument = text[1:].partition(" ")
+    return command.split("@", 1)[0].casefold(), argument.strip()
+
+
+def run_bot(
+    poll_timeout: int = TELEGRAM_BOT_POLL_TIMEOUT,
+    refresh_interval: float = TELEGRAM_BOT_REFRESH_INTERVAL,
+) -> int:
+    """
+    Answers commands until interrupted. Replies are sent by a bounded pool of workers within Telegram's rate limits, while this thread keeps polling.
+
+    Parameters
+    ----------
+    poll_timeout : int
+        Seconds each `getUpdates` call waits for messages. Defaults to SGB_TELEGRAM_BOT_POLL_TIMEOUT
+    refresh_interval : float
+        Seconds between checks for a new run. Defaults to SGB_TELEGRAM_BOT_REFRESH_INTERVAL
+
+    Returns
+    -------
+    int
+        0 once stopped, 1 if the bot token is invalid
+
+    Examples
+    --------
+    >>> run_bot()
+    0
+    """
+    if not get_history_db_path():
+        msg = "the bot answers from the history store, which is disabled since SGB_HISTORY_DB_PATH is set to an empty string"
+        logger.error(msg)
+        raise RuntimeError(msg)
+
+    if not test_bot_status():
+        return 1
+
+    client = get_telegram_client()
+    index = BotIndex.from_history()
+    refreshed_at = monotonic()
+    offset = 0
+    pending = BoundedSemaphore(MAX_PENDING_REPLIES)
+
+    def answer(index: BotIndex, chat_id: str, text: str) -> None:
+        try:
+            parsed = parse_command(text)
+            if parsed is None:
+                return
+            client.send(
+                "sendMessage",
+                chat_id,
+                {"text": index.reply(chat_id, *parsed), "parse_mode": "MarkdownV2"},
+            )
+        except Exception as e:
+            logger.error(f"could not answer {chat_id} - {e}")
+        finally:
+            pending.release()
+
+    logger.info(f"bot is answering commands from run {index.run_id}")
+    with ThreadPoolExecutor(
+        max_workers=TELEGRAM_MAX_WORKERS, thread_name_prefix="telegram-bot"
+    ) as executor:
+        try:
+            while True:
+                if monotonic() - refreshed_at >= refresh_interval:
+                    refreshed_at = monotonic()
+                    try:
+                        if get_latest_run_id() != index.run_id:
+                            # Replies already queued keep the index they were queued with
+                            index = BotIndex.from_history()
+                            logger.info(f"bot is answering from run {index.run_id}")
+                    except Exception as e:
+                        logger.error(f"could not refresh the bot's index - {e}")
+                export_metrics_periodically()
+
+                response, _ = client.call(
+                    "getUpdates",
+                    {
+                        "offset": offset,
+                        "timeout": poll_timeout,
+                        "allowed_updates": '["message"]',
+                    },
+                    # Telegram holds the request for up to poll_timeout, so only give up a while after that
+                    read_timeout=poll_timeout + 10,
+                )
+                if not response.get("ok"):
+                    logger.warning(
+                        f"could not get updates - {response.get('description')}"
+                    )
+                    sleep(5)
+                    continue
+
+                for update in response.get("result", list()):
+                    offset = max(offset, int(update["update_id"]) + 1)
+                    message: dict[str, Any] = update.get("message") or dict()
+                    text = message.get("text")
+                    chat = message.get("chat") or dict()
+                    if not text or "id" not in chat:
+                        continue
+                    # Blocks polling once enough replies are queued, instead of queueing without bound
+                    pending.acquire()
+                    executor.submit(answer, index, str(chat["id"]), text)
+        except KeyboardInterrupt:
+            logger.info("stopping the bot")
+    return 0
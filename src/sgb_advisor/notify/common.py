@@ -4,27 +4,32 @@ Commons functions that can be used by all methods of notifications
 
 from datetime import datetime, timedelta, timezone
 from functools import lru_cache
-from os import getenv
+from json import dumps as json_dumps
 from os.path import dirname
 from pathlib import Path
-from random import randint
-from tempfile import gettempdir
-from typing import Optional
+from typing import Collection, Optional
+from uuid import uuid4
 
-from ..data import get_price_of_gold
+from ..cache import ttl_cache
+from ..config import get_config
 from ..logg import logger
-from ..models import SGB
+from ..models import SGB, Results
+from .artifact_store import ARTIFACT_DIR, store_artifact
 
-tmp_folder = Path(f"{gettempdir()}/sgb_advisor")
-tmp_folder.mkdir(parents=True, exist_ok=True)
+tmp_folder = ARTIFACT_DIR
+"""Folder outputs and caches are written to. Created by whatever writes to it first, not on import"""
 
-SGB_ALREADY_HELD_SGBS: list[str] = str(getenv("SGB_ALREADY_HELD_SGBS", "")).split(",")
-"""List of SGBs already held, which will be highlited in the screenshot"""
+TEMPLATE_PLACEHOLDER: str = '<section id="app-generated-results-placeholder"></section>'
+"""The section of `assets/template.html` that is replaced with the table"""
+
+DISCLAIMER_URL: str = (
+    "https://github.com/vishalnandagopal/sgb-advisor/blob/master/README.md#disclaimers"
+)
 
 
 def get_temp_file_path(file_extension: Optional[str] = "html") -> Path:
     """
-    Get a file path located at a folder in the the temp folder of the OS. Creates required parents folders if it doesn't exist.
+    Get a unique file path located at a folder in the the temp folder of the OS. Files at these paths are not managed by the artifact store, so prefer `store_artifact()` for outputs.
 
     Paramters
     ---------
@@ -39,10 +44,10 @@ def get_temp_file_path(file_extension: Optional[str] = "html") -> Path:
     Examples
     --------
     >>> get_temp_file_path()
-    Path("E:/Code/sgb_advisor/tmp/sgb_advisor/1730403483.2583637-9432.html")
+    Path("E:/Code/sgb_advisor/tmp/sgb_advisor/2024-11-20 SGB Advisor Output 5f0c6a2b9e4d4a7c.html")
     """
 
-    file_name = f"{datetime.now().date()} SGB Advisor Output {randint(10000, 99999)}.{file_extension}"
+    file_name = f"{datetime.now().date()} SGB Advisor Output {uuid4().hex[:16]}.{file_extension}"
 
     p = Path(rf"{tmp_folder}/{file_name}")
 
@@ -56,13 +61,15 @@ def get_sgb_symbol_css() -> str:
     return 'style="color: red;"'
 
 
-def get_table_row_html(sgb: SGB) -> str:
+def get_table_row_html(sgb: SGB, is_held: Optional[bool] = None) -> str:
     """
     Get a <tr> element that can be used in any HTML template
 
     Parameters
     ----------
     sgb : SGB
+    is_held : Optional[bool]
+        Whether to highlight the symbol. Defaults to whether it is held in `get_config()`
 
     Returns
     -------
@@ -80,17 +87,46 @@ def get_table_row_html(sgb: SGB) -> str:
     </tr>"
     """
 
+    if is_held is None:
+        is_held = sgb.nse_symbol in get_config().held_sgbs
+
     return f"""<tr>
-        <td {get_sgb_symbol_css() if sgb.nse_symbol in SGB_ALREADY_HELD_SGBS else ""}>{sgb.nse_symbol}</td>
+        <td {get_sgb_symbol_css() if is_held else ""}>{sgb.nse_symbol}</td>
         <td>{sgb.ltp}</td>
         <td>{sgb.maturity_date.day} {sgb.maturity_date.strftime("%B %Y")}</td>
         <td>{sgb.xirr}</td>
     </tr>\n"""
 
 
-def get_table_html(sgbs: list[SGB]) -> str:
-    gold_price = get_price_of_gold()
-    dt = get_ist_time()
+def get_table_html(
+    results: Results,
+    held_sgbs: Optional[Collection[str]] = None,
+    rows_html: Optional[list[str]] = None,
+) -> str:
+    """
+    Get the <section> showing the table of SGBs and the price of gold, to place in the template
+
+    Parameters
+    ----------
+    results : Results
+        The results of the run
+    held_sgbs : Optional[Collection[str]]
+        NSE symbols of the SGBs to highlight. Defaults to the held SGBs of `get_config()`
+    rows_html : Optional[list[str]]
+        The <tr> of every SGB, if they have already been built. Built with `get_table_row_html()` if not given
+
+    Returns
+    -------
+    str
+        The HTML of the section
+
+    Examples
+    --------
+    >>> get_table_html(results)
+    '<section id="app-generated-results-placeholder"><table id="sgb-returns-table">...</table></section>'
+    """
+    sgbs, gold_price, dt = results
+    held_sgbs = get_config().held_sgbs if held_sgbs is None else held_sgbs
     if len(sgbs) > 0:
         return f"""<section id="app-generated-results-placeholder">
         <table id="sgb-returns-table">
@@ -104,7 +140,7 @@ def get_table_html(sgbs: list[SGB]) -> str:
                 </tr>
             </thead>
             <tbody>
-                {"".join(get_table_row_html(sgb) for sgb in sgbs)}
+                {"".join(rows_html if rows_html is not None else (get_table_row_html(sgb, sgb.nse_symbol in held_sgbs) for sgb in sgbs))}
                 <tr>
                     <td class="tcb" colspan="3">Gold price: ₹{gold_price}</td>
                     <td class="tcb">{dt.date()}</td>
@@ -118,7 +154,7 @@ def get_table_html(sgbs: list[SGB]) -> str:
 
 def write_html_to_file(html: str) -> Path:
     """
-    Writes the HTML to the a temporary output file and returns the path of the temp file.
+    Stores the HTML as an output file and returns its path.
 
     Parameters
     ----------
@@ -133,25 +169,20 @@ def write_html_to_file(html: str) -> Path:
     Examples
     --------
     >>> write_html_to_file("<html></html>")
-    Path("E:/Code/sgb_advisor/tmp/sgb_advisor/1730403483.2583637-9432.html")
+    Path("E:/Code/sgb_advisor/tmp/sgb_advisor/2024-11-20 SGB Advisor Output 7d5a1e0f3c2b4a69.html")
     """
+    try:
+        return store_artifact(html.encode("utf-8"), "html")
+    except OSError as e:
+        msg = f"couldn't save output HTML file to {tmp_folder} - {e}"
+        logger.error(msg)
+        raise RuntimeError(msg)
 
-    output_file = get_temp_file_path("html")
-
-    with open(output_file, "w", encoding="utf-8") as f:
-        f.write(html)
-        return output_file
-
-    msg = f'couldn\'t save output HTML file to "{output_file}"'
 
-    logger.error(msg)
-    raise RuntimeError(msg)
-
-
-@lru_cache(maxsize=None)
+@ttl_cache()
 def get_ist_time() -> datetime:
     """
-    Get a datetime object that represents the current time in IST
+    Get a datetime object that represents the current time in IST. Cached for as long as the prices are (SGB_DATA_CACHE_TTL seconds), so everything built from the same prices is stamped with the same time
 
     Parameters
     ----------
@@ -172,14 +203,14 @@ def get_ist_time() -> datetime:
     return utc_now + ist_offset
 
 
-def write_html_output(sgbs: list[SGB]) -> Path:
+def write_html_output(html: str) -> Path:
     """
-    Write the HTML output showing all data to a file. Generates a string with all the SGBs and their returns. Calls the `write_html_to_file()` function to write the HTML
+    Write the HTML output showing all data to a file. Calls the `write_html_to_file()` function to write the HTML
 
     Parameters
     ----------
-    sgbs : list[SGB]
-        The list of SGBs
+    html : str
+        The HTML from `generate_html_from_template()`
 
     Returns
     -------
@@ -188,28 +219,182 @@ def write_html_output(sgbs: list[SGB]) -> Path:
 
     Examples
     --------
-    >>> write_html_output(
-    ...     [
-    ...         SGB1,
-    ...         SGB2,
-    ...         SGB3,
-    ...     ]
-    ... )
-    Path("E:/Code/sgb_advisor/tmp/sgb_advisor/1730403483.2583637-9432.html")
+    >>> write_html_output(generate_html_from_template(results))
+    Path("E:/Code/sgb_advisor/tmp/sgb_advisor/2024-11-20 SGB Advisor Output 7d5a1e0f3c2b4a69.html")
     """
-    html = generate_html_from_template(sgbs)
-
     return write_html_to_file(html)
 
 
-def generate_html_from_template(sgbs: list[SGB]) -> str:
-    STRING_TO_REPLACE_IN_TEMPLATE = (
-        '<section id="app-generated-results-placeholder"></section>'
-    )
+@lru_cache(maxsize=None)
+def get_html_template_parts() -> tuple[str, str]:
+    """
+    Reads `assets/template.html` once per process and splits it around the placeholder section
 
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    tuple[str, str]
+        The HTML before and after the placeholder
+
+    Examples
+    --------
+    >>> get_html_template_parts()
+    ("<html>...<p>...</p>", "<h2>Disclaimer</h2>...</html>")
+    """
     with open(dirname(__file__) + "/../assets/template.html") as f:
         email_template = f.read()
 
-    replacement_string = get_table_html(sgbs)
+    before, found, after = email_template.partition(TEMPLATE_PLACEHOLDER)
+    if not found:
+        msg = f"could not find {TEMPLATE_PLACEHOLDER} in the HTML template"
+        logger.error(msg)
+        raise RuntimeError(msg)
+
+    return before, after
+
+
+def generate_html_from_template(
+    results: Results,
+    held_sgbs: Optional[Collection[str]] = None,
+    rows_html: Optional[list[str]] = None,
+) -> str:
+    """
+    Places the table of the results in the HTML template
+
+    Parameters
+    ----------
+    results : Results
+        The results of the run
+    held_sgbs : Optional[Collection[str]]
+        NSE symbols of the SGBs to highlight. Defaults to the held SGBs of `get_config()`
+    rows_html : Optional[list[str]]
+        The <tr> of every SGB, if they have already been built
+
+    Returns
+    -------
+    str
+        The complete HTML page
+
+    Examples
+    --------
+    >>> generate_html_from_template(results)
+    "<html>...</html>"
+    """
+    before, after = get_html_template_parts()
+    return before + get_table_html(results, held_sgbs, rows_html) + after
+
 
-    return email_template.replace(STRING_TO_REPLACE_IN_TEMPLATE, replacement_string, 1)
+def get_email_body_plain_text(results: Results) -> str:
+    """
+    Get text that shows the trading symbols, maturity dates, XIRR of each SGBs
+
+    Parameters
+    ----------
+    results : Results
+        The results of the run
+
+    Returns
+    -------
+    str
+        Plain text that shows info on many SGBs
+
+    Examples
+    --------
+    >>> get_email_body_plain_text(results)
+    "You can consider the following SGBs. THIS IS NOT INVESTMENT ADVICE. IT CAN BE WRONG, DUE TO DATA, CALCULATION, TIMING OR ANY OTHER ERRORS. DO YOUR OWN RESEARCH. PROFITS ARE NOT GUARANTEED, LOSSES CAN BE UPTO 100%!
+
+    SGBSEP27 - Issued at ₹5400 - LTP ₹7900.02 - 2.5% interest - 2024-09-01"
+    """
+    NEW_LINE = "\n"
+    body_text = (
+        "You can consider the following SGBs\n"
+        + "THIS IS NOT INVESTMENT ADVICE. IT CAN BE WRONG, DUE TO DATA, CALCULATION, TIMING OR ANY OTHER ERRORS. DO YOUR OWN RESEARCH. PROFITS ARE NOT GUARANTEED, LOSSES CAN BE UPTO 100%!\n"
+        + f"{NEW_LINE.join(str(sgb) for sgb in results.sgbs)}"
+    )
+    return body_text
+
+
+def get_telegram_caption(
+    results: Results, n: int = 3, heading: Optional[str] = None
+) -> str:
+    """
+    Returns a caption for the telegram post
+
+    Parameters
+    ----------
+    results : Results
+        The results of the run
+
+    n : int
+        The number of SGGs to generate text for (top n)
+
+    heading : Optional[str]
+        The first line of the caption. Defaults to "Top n SGBs are: "
+
+    Returns
+    -------
+    str
+        Text showing data for top n SGBs
+
+    Examples
+    --------
+    >>> get_telegram_caption(results, 3)
+    \"\"\"Top 3 SGBs are:\n
+    SGBJUN31I - ₹5926.0 - 0.687%\n
+    SGBAUG28V - ₹5334.0 - 0.558%\n
+    SGBJU29III - ₹4889.0 - 0.556%\"\"\"
+    """
+    sgbs = results.sgbs[:n]
+    text = f"Top {len(sgbs)} SGBs are: " if heading is None else heading
+
+    for sgb in sgbs:
+        # Replacing . in XIRR  with \. since . is reserved for some reason in the markdown mode in Telegram API
+        text += f"\n\n`{sgb.nse_symbol}` - ₹{sgb.ltp} - {sgb.xirr}%"
+
+    disclaimer_text = f"\n[Disclaimers]({DISCLAIMER_URL})"
+
+    gold_price_text = f"\nGold price - ₹{results.gold_price}"
+
+    text += gold_price_text + disclaimer_text
+
+    return text
+
+
+def get_json_representation(
+    results: Results, sgbs_json: Optional[list[str]] = None
+) -> str:
+    """
+    Returns the results as a JSON string, which is sent as a file on Telegram
+
+    Parameters
+    ----------
+    results : Results
+        The results of the run
+    sgbs_json : Optional[list[str]]
+        The JSON of every SGB, if it has already been serialised. Serialised here if not given
+
+    Returns
+    -------
+    str
+        The JSON
+
+    Examples
+    --------
+    >>> get_json_representation(results)
+    '{"time": "2024-11-20 19:50:21.802675+00:00", "gold_price": 7956.0, "disclaimer": "...", "sgbs": [...]}'
+    """
+    d = {
+        "time": str(results.generated_at),
+        "gold_price": results.gold_price,
+        "disclaimer": DISCLAIMER_URL,
+        "sgbs": []
+        if sgbs_json is not None
+        else [sgb.to_dict() for sgb in results.sgbs],
+    }
+    if sgbs_json is None:
+        return json_dumps(d, indent=None)
+    # Splice the serialised SGBs into the empty list at the end, which gives the same JSON as serialising everything at once
+    return json_dumps(d, indent=None)[: -len("[]}")] + f"[{', '.join(sgbs_json)}]}}"
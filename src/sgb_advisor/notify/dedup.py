@@ -0,0 +1,149 @@
+"""
+Remembers what the previous run delivered, so unchanged results are not rendered, uploaded or sent again
+"""
+
+from hashlib import sha256
+from json import JSONDecodeError
+from json import dumps as json_dumps
+from json import loads as json_loads
+from os import getenv
+from pathlib import Path
+from typing import Any, Collection, Optional
+
+from ..config import get_config
+from ..logg import logger
+from ..models import Results
+from .artifact_store import atomic_write
+from .common import tmp_folder
+
+DELIVERY_STATE_PATH: Path = Path(
+    getenv("SGB_DELIVERY_STATE_PATH", str(tmp_folder / "delivery_state.json"))
+)
+"""File where the content hash and Telegram file IDs of the last delivery are kept between runs"""
+
+SKIP_UNCHANGED_DELIVERY: bool = (
+    getenv("SGB_SKIP_UNCHANGED_DELIVERY", "false").casefold() == "true"
+)
+"""Don't notify at all if the results are the same as the ones last delivered"""
+
+
+def get_content_hash(
+    results: Results, held_sgbs: Optional[Collection[str]] = None
+) -> str:
+    """
+    Returns a hash of everything that is shown to the user - the SGB rows, the price of gold, the trading date and the highlighted SGBs. The time of the run and the traded volumes are left out, so reruns with the same prices hash the same.
+
+    Parameters
+    ----------
+    results : Results
+        The results of the run
+    held_sgbs : Optional[Collection[str]]
+        NSE symbols of the SGBs highlighted. Defaults to the held SGBs of `get_config()`
+
+    Returns
+    -------
+    str
+        SHA-256 hex digest of the results
+
+    Examples
+    --------
+    >>> get_content_hash(results)
+    "3a7bd3e2360a3d29eea436fcfb7e44c735d117c42d1c1835420b6b9942dd4f1b"
+    """
+    held_sgbs = get_config().held_sgbs if held_sgbs is None else held_sgbs
+    content = {
+        "date": results.generated_at.date().isoformat(),
+        "gold_price": results.gold_price,
+        "held_sgbs": sorted(
+            sgb.nse_symbol for sgb in results.sgbs if sgb.nse_symbol in held_sgbs
+        ),
+        "sgbs": [
+            [
+                sgb.nse_symbol,
+                sgb.ltp,
+                sgb.issue_price,
+                sgb.interest_rate,
+                sgb.maturity_date.isoformat(),
+                sgb.xirr,
+            ]
+            for sgb in results.sgbs
+        ],
+    }
+    return sha256(json_dumps(content, separators=(",", ":")).encode()).hexdigest()
+
+
+def read_delivery_state() -> dict[str, Any]:
+    """
+    Reads what the previous run delivered
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    dict[str, Any]
+        The state written by `update_delivery_state()`. Empty if nothing has been delivered yet
+
+    Examples
+    --------
+    >>> read_delivery_state()
+    {"content_hash": "3a7bd3e2...", "delivered_at": 1730403483.2583637, "telegram": {"content_hash": "3a7bd3e2...", "bot": "9f86d081...", "file_ids": ["BQACAgUAAxkDAAI...", "BQACAgUAAxkDAAJ..."]}}
+    """
+    try:
+        state: dict[str, Any] = json_loads(
+            DELIVERY_STATE_PATH.read_text(encoding="utf-8")
+        )
+    except (OSError, JSONDecodeError):
+        return dict()
+    return state if isinstance(state, dict) else dict()
+
+
+def update_delivery_state(**values: str | float | dict[str, str | list[str]]) -> None:
+    """
+    Merges the values into the delivery state and writes it atomically, so a concurrent run never reads a half written file
+
+    Parameters
+    ----------
+    **values : str | float | dict[str, str | list[str]]
+        Keys to set in the state
+
+    Returns
+    -------
+    None
+
+    Examples
+    --------
+    >>> update_delivery_state(content_hash="3a7bd3e2...", delivered_at=time())
+    None
+    """
+    state = read_delivery_state()
+    state.update(values)
+    try:
+        DELIVERY_STATE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        atomic_write(DELIVERY_STATE_PATH, json_dumps(state).encode())
+    except OSError as e:
+        # Not being able to save the state only means everything is sent again next time
+        logger.warning(f"could not write delivery state - {e}")
+
+
+def is_already_delivered(content_hash: str) -> bool:
+    """
+    Checks if the results with this hash were the last ones delivered
+
+    Parameters
+    ----------
+    content_hash : str
+        The hash from `get_content_hash()`
+
+    Returns
+    -------
+    bool
+        True if nothing material changed since the last delivery
+
+    Examples
+    --------
+    >>> is_already_delivered(artifacts.content_hash)
+    True
+    """
+    return read_delivery_state().get("content_hash") == content_hash
@@ -0,0 +1,142 @@
+"""
+Runs every notification channel at the same time, each with its own timeout, so a run takes as long as its slowest channel instead of all of them added up
+"""
+
+from os import getenv
+from threading import Thread
+from time import monotonic, perf_counter
+from typing import Callable, Optional
+
+from ..logg import logger
+from ..metrics import span
+from .render import Artifacts
+
+NOTIFY_CHANNEL_TIMEOUT_ENV: str = "SGB_NOTIFY_CHANNEL_TIMEOUT"
+NOTIFY_CHANNEL_TIMEOUT: float = float(getenv(NOTIFY_CHANNEL_TIMEOUT_ENV, "300") or 0)
+"""Seconds a channel gets to send before it is reported as failed. Set it to 0 to wait for as long as it takes"""
+
+Channel = Callable[..., bool]
+"""Sends the artifacts and returns whether it succeeded. Sends to every recipient of its config, unless given a list of them as `recipients`"""
+
+
+class ChannelResult:
+    """Outcome of sending through a single channel"""
+
+    __slots__ = {"channel", "ok", "duration", "error", "timed_out"}
+
+    def __init__(
+        self,
+        channel: str,
+        ok: bool,
+        duration: float,
+        error: Optional[str] = None,
+        timed_out: bool = False,
+    ) -> None:
+        self.channel = channel
+        """Name of the channel, like "telegram" """
+
+        self.ok = ok
+        """Whether the channel sent everything"""
+
+        self.duration = duration
+        """Seconds the channel took, or the timeout if it didn't finish"""
+
+        self.error = error
+        """Why the channel failed, if it raised or timed out"""
+
+        self.timed_out = timed_out
+        """Whether the channel was still sending when it ran out of time. It may still finish sending afterwards"""
+
+    def __repr__(self) -> str:
+        status = "ok" if self.ok else f"failed ({self.error or 'not sent'})"
+        return f"<ChannelResult [{self.channel} - {status} in {self.duration:.3f}s]>"
+
+
+def dispatch_channels(
+    artifacts: Artifacts,
+    channels: dict[str, Channel],
+    timeout: float = NOTIFY_CHANNEL_TIMEOUT,
+) -> list[ChannelResult]:
+    """
+    Sends the artifacts through every channel concurrently. A channel that raises or doesn't finish within the timeout is reported as failed, without affecting the others.
+
+    Parameters
+    ----------
+    artifacts : Artifacts
+        The artifacts rendered for this run
+    channels : dict[str, Channel]
+        Maps the name of each channel to the function that sends through it
+    timeout : float
+        Seconds each channel gets to finish. Defaults to SGB_NOTIFY_CHANNEL_TIMEOUT. 0 waits forever
+
+    Returns
+    -------
+    list[ChannelResult]
+        The result of every channel, in the same order as channels
+
+    Examples
+    --------
+    >>> dispatch_channels(artifacts, {"telegram": send_via_telegram, "email": send_mail}, 60)
+    [<ChannelResult [telegram - ok in 1.204s]>, <ChannelResult [email - ok in 0.873s]>]
+    """
+    results: dict[str, ChannelResult] = dict()
+
+    def run(name: str, channel: Channel) -> None:
+        start = perf_counter()
+        with span(f"notify.{name}") as channel_span:
+            try:
+                ok, error = bool(channel(artifacts)), None
+            except Exception as e:
+                logger.exception(f"{name} channel failed")
+                ok, error = False, str(e)
+            channel_span.ok, channel_span.error = ok, error
+        results[name] = ChannelResult(name, ok, perf_counter() - start, error)
+
+    # Daemon threads, so a channel that hangs past its timeout can't keep the process alive
+    threads = {
+        name: Thread(
+            target=run, args=(name, channel), name=f"notify-{name}", daemon=True
+        )
+        for name, channel in channels.items()
+    }
+    for thread in threads.values():
+        thread.start()
+
+    # Every channel starts at the same time, so one deadline is a timeout per channel
+    deadline = monotonic() + timeout if timeout else None
+    for name, thread in threads.items():
+        thread.join(None if deadline is None else max(0, deadline - monotonic()))
+        if name not in results:
+            logger.error(f"{name} channel did not finish within {timeout}s")
+            results[name] = ChannelResult(
+                name, False, timeout, f"timed out after {timeout}s", timed_out=True
+            )
+
+    ordered = [results[name] for name in channels]
+    for result in ordered:
+        logger.info(
+            f"{result.channel} {'sent' if result.ok else 'failed'} in {result.duration * 1000:.0f} ms"
+        )
+    return ordered
+
+
+def get_exit_status(results: list[ChannelResult]) -> int:
+    """
+    Aggregates the results of every channel into a process exit status
+
+    Parameters
+    ----------
+    results : list[ChannelResult]
+        The results from `dispatch_channels()`
+
+    Returns
+    -------
+    int
+        0 if every channel succeeded (or nothing had to be sent), 1 if any channel failed
+
+    Examples
+    --------
+    >>> get_exit_status(results)
+    0
+    """
+    return 0 if all(result.ok for result in results) else 1
@@ -2,30 +2,22 @@
 Use this to send emails
 """
 
-from os import getenv
+from functools import lru_cache
+from json import dumps as json_dumps
+from time import sleep
+from typing import TYPE_CHECKING, Any, Optional
 
 from boto3 import client as aws_client
-from botocore.exceptions import ClientError
+from botocore.config import Config as BotocoreConfig
+from botocore.exceptions import BotoCoreError, ClientError
 
-from ..data import SGB
+from ..config import Config, get_config
 from ..logg import logger
-from .common import generate_html_from_template
+from ..metrics import span
+from .render import Artifacts, render_for_subscribers
 
-AWS_ACCESS_KEY_ENV: str = "SGB_AWS_ACCESS_KEY"
-AWS_ACCESS_KEY: str = getenv(AWS_ACCESS_KEY_ENV, "")
-"""AWS access key from the AWS console. Try to create one for a non-root user"""
-
-AWS_SECRET_ACCESS_KEY: str = getenv("SGB_AWS_SECRET_ACCESS_KEY", "")
-"""AWS secret access key from the AWS console. Try to create one for a non-root user"""
-
-SENDER: str = getenv("SGB_AWS_SES_SENDER_EMAIL", "")
-"""The sender from which the email will appear to be sent by. Must be verified in Amazon SES dashboard"""
-
-RECIPIENT: str = getenv("SGB_AWS_SES_RECIPIENT", "")
-"""The recipient of the email. If your account is still in the AWS SES sandbox, the recipient must also verify his email"""
-
-AWS_REGION: str = getenv("SGB_AWS_REGION", "")
-"""The AWS region where the SES resource will be hosted"""
+if TYPE_CHECKING:
+    from botocore.client import BaseClient
 
 SUBJECT: str = "SGBs you can consider buying"
 """Subject of the email"""
@@ -33,113 +25,362 @@ SUBJECT: str = "SGBs you can consider buying"
 CHARSET: str = "UTF-8"
 """The character encoding for the email."""
 
+MAX_DESTINATIONS_PER_BATCH: int = 50
+"""SES accepts at most 50 destinations in one SendBulkTemplatedEmail request"""
+
+MAX_BATCH_ATTEMPTS: int = 3
+"""Attempts for every batch, when SES throttles or fails to respond"""
+
+TEMPLATE_HTML_PART: str = "{{{html}}}"
+TEMPLATE_TEXT_PART: str = "{{{text}}}"
+"""The bulk sending template only has placeholders, filled with the bodies sent along with every request. Triple braces so SES doesn't escape the HTML"""
 
-def get_email_body_plain_text(sgbs: list[SGB]) -> str:
+RETRYABLE_ERROR_CODES: set[str] = {
+    "Throttling",
+    "ThrottlingException",
+    "ServiceUnavailable",
+    "InternalFailure",
+}
+"""SES errors after which a batch is retried"""
+
+
+def send_mail(
+    artifacts: Artifacts,
+    config: Optional[Config] = None,
+    recipients: Optional[list[str]] = None,
+) -> bool:
     """
-    Get text that shows the trading symbols, maturity dates, XIRR of each SGBs
+    Sends an email using AWS SES. Every recipient gets the output for their profile, and recipients that see the same output are sent to together.
 
     Parameters
     ----------
-    list[sgb] : List of SGBs
+    artifacts : Artifacts
+        The artifacts rendered for this run with the default profile
+    config : Optional[Config]
+        The config with the AWS credentials, sender and recipients. Defaults to `get_config()`
+    recipients : Optional[list[str]]
+        Email addresses to send to. Defaults to the recipients of the config
 
     Returns
     -------
-    str
-        Plain text that shows info on many SGBs
+    bool : True if successful
 
     Examples
     --------
-    >>> get_email_body_plain_text(sgbs)
-    "You can consider the following SGBs. THIS IS NOT INVESTMENT ADVICE. IT CAN BE WRONG, DUE TO DATA, CALCULATION, TIMING OR ANY OTHER ERRORS. DO YOUR OWN RESEARCH. PROFITS ARE NOT GUARANTEED, LOSSES CAN BE UPTO 100%!
+    >>> send_mail(artifacts)
+    True
+    """
+    config = config or get_config()
+    recipients = list(config.aws_ses_recipients) if recipients is None else recipients
+    if not recipients:
+        return send_aws_email(artifacts.html, artifacts.text, config=config)
+
+    success = True
+    for output, output_recipients in render_for_subscribers(
+        artifacts, recipients, config
+    ):
+        success = (
+            send_aws_email(output.html, output.text, output_recipients, config)
+            and success
+        )
+    return success
+
+
+def mask_email(email: str) -> str:
+    """Hides most of an email address before logging it"""
+    return email[:4] + "****" + email[-9:]
+
+
+def get_ses_client(config: Optional[Config] = None) -> "BaseClient":
+    """
+    Returns the SES client shared by every email sent in this process with the config's credentials, so connections to SES are reused
+
+    Parameters
+    ----------
+    config : Optional[Config]
+        The config with the AWS credentials and region. Defaults to `get_config()`
+
+    Returns
+    -------
+    BaseClient
+        The boto3 SES client
 
-    SGBSEP27 - Issued at ₹5400 - LTP ₹7900.02 - 2.5% interest - 2024-09-01"
+    Examples
+    --------
+    >>> get_ses_client()
+    <botocore.client.SES object at 0x7f...>
     """
-    NEW_LINE = "\n"
-    body_text = (
-        "You can consider the following SGBs\n"
-        + "THIS IS NOT INVESTMENT ADVICE. IT CAN BE WRONG, DUE TO DATA, CALCULATION, TIMING OR ANY OTHER ERRORS. DO YOUR OWN RESEARCH. PROFITS ARE NOT GUARANTEED, LOSSES CAN BE UPTO 100%!\n"
-        + f"{NEW_LINE.join(str(sgb) for sgb in sgbs)}"
+    config = config or get_config()
+    return _get_ses_client(
+        config.aws_region,
+        config.aws_access_key,
+        config.aws_secret_access_key,
+        config.aws_ses_endpoint_url,
+    )
+
+
+@lru_cache(maxsize=None)
+def _get_ses_client(
+    region: str,
+    access_key: str,
+    secret_access_key: str,
+    endpoint_url: Optional[str],
+) -> "BaseClient":
+    return aws_client(
+        "ses",
+        region_name=region,
+        aws_access_key_id=access_key,
+        aws_secret_access_key=secret_access_key,
+        endpoint_url=endpoint_url,
+        config=BotocoreConfig(retries={"mode": "standard"}),
     )
-    return body_text
 
 
-def send_mail(sgbs: list[SGB]) -> bool:
+def get_error_message(e: Exception) -> str:
+    """Returns the message SES sent with a ClientError, or the string of any other error"""
+    if isinstance(e, ClientError):
+        error = e.response.get("Error", {})
+        return f"{error.get('Code', '')} - {error.get('Message', '')}"
+    return str(e)
+
+
+def send_aws_email(
+    email_html: str,
+    email_plain_text: str,
+    recipients: Optional[list[str]] = None,
+    config: Optional[Config] = None,
+) -> bool:
     """
-    Sends an email using AWS SES
+    Sends an email using AWS SES. A single recipient gets a plain email, many recipients are sent to in bulk using `send_bulk_aws_email()`.
 
     Parameters
     ----------
-    list[sgb] : List of SGBs
+    email_html : str
+        HTML body of the email
+    email_plain_text : str
+        Plain text body of the email
+    recipients : Optional[list[str]]
+        Email addresses to send to. Defaults to the recipients of the config
+    config : Optional[Config]
+        The config with the AWS credentials and sender. Defaults to `get_config()`
 
     Returns
     -------
-    bool : True if successful
+    bool
+        True if the email was sent to every recipient
 
     Examples
     --------
-    >>> send_email(sgbs)
+    >>> send_aws_email("<html></html>", "SGBs", ["example@example.com"])
     True
     """
-    return send_aws_email(
-        generate_html_from_template(sgbs),
-        get_email_body_plain_text(sgbs),
-    )
-
+    config = config or get_config()
+    recipients = list(config.aws_ses_recipients) if recipients is None else recipients
 
-def send_aws_email(email_html: str, email_plain_text: str) -> bool:
     required_envs = {
-        AWS_ACCESS_KEY,
-        AWS_SECRET_ACCESS_KEY,
-        AWS_REGION,
-        RECIPIENT,
-        SENDER,
+        config.aws_access_key,
+        config.aws_secret_access_key,
+        config.aws_region,
+        config.aws_ses_sender_email,
     }
 
-    if not all(required_envs):
+    if not all(required_envs) or not recipients:
         logger.error("not all ENV variables seem to be set")
         return False
 
-    # Create a new SES resource and specify a region.
-    client = aws_client(
-        "ses",
-        region_name=AWS_REGION,
-        aws_access_key_id=AWS_ACCESS_KEY,
-        aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-    )
+    if len(recipients) > 1:
+        return send_bulk_aws_email(email_html, email_plain_text, recipients, config)
+
+    client = get_ses_client(config)
 
     try:
         # Provide the contents of the email.
-        response = client.send_email(
-            Destination={
-                "ToAddresses": [
-                    RECIPIENT,
-                ],
-            },
-            Message={
-                "Body": {
-                    "Html": {"Charset": CHARSET, "Data": email_html},
-                    "Text": {
+        with span("email.send", recipients=1):
+            response = client.send_email(
+                Destination={
+                    "ToAddresses": recipients,
+                },
+                Message={
+                    "Body": {
+                        "Html": {"Charset": CHARSET, "Data": email_html},
+                        "Text": {
+                            "Charset": CHARSET,
+                            "Data": email_plain_text,
+                        },
+                    },
+                    "Subject": {
                         "Charset": CHARSET,
-                        "Data": email_plain_text,
+                        "Data": SUBJECT,
                     },
                 },
-                "Subject": {
-                    "Charset": CHARSET,
-                    "Data": SUBJECT,
-                },
-            },
-            Source=SENDER,
-        )
+                Source=config.aws_ses_sender_email,
+            )
         logger.info(
-            f"email sent to {RECIPIENT[:4] + '****' + RECIPIENT[-9:]}! Message ID: {response['MessageId']}"
+            f"email sent to {mask_email(recipients[0])}! Message ID: {response['MessageId']}"
         )
         return True
+    except (ClientError, BotoCoreError) as e:
+        logger.error(f"error sending email - {get_error_message(e)}")
+
+    return False
+
+
+def upsert_email_template(config: Optional[Config] = None) -> None:
+    """
+    Creates or updates the SES template used for bulk sending. It never holds a run's email, only placeholders for the bodies, so overlapping runs and subscriber groups sent at the same time can't send each other's email.
+
+    Parameters
+    ----------
+    config : Optional[Config]
+        The config with the AWS credentials and template name. Defaults to `get_config()`
+
+    Returns
+    -------
+    None
+
+    Examples
+    --------
+    >>> upsert_email_template()
+    None
+    """
+    config = config or get_config()
+    client = get_ses_client(config)
+    template: Any = {
+        "TemplateName": config.aws_ses_template_name,
+        "SubjectPart": SUBJECT,
+        "HtmlPart": TEMPLATE_HTML_PART,
+        "TextPart": TEMPLATE_TEXT_PART,
+    }
+    try:
+        client.update_template(Template=template)
     except ClientError as e:
-        error_msg = "error sending email"
+        if e.response.get("Error", {}).get("Code") != "TemplateDoesNotExist":
+            raise
+        try:
+            client.create_template(Template=template)
+        except ClientError as e:
+            # Another run or group created it first, with the same placeholders
+            if e.response.get("Error", {}).get("Code") != "AlreadyExists":
+                raise
+    logger.debug("updated SES template {}", config.aws_ses_template_name)
+
 
-        if "Error" in e.response and "Message" in e.response["Error"]:
-            error_msg += f" - {e.response['Error']['Message']}"
+def get_max_send_rate(config: Optional[Config] = None) -> float:
+    """
+    Returns the maximum number of emails the SES account can send per second
 
-        logger.error(error_msg)
+    Parameters
+    ----------
+    config : Optional[Config]
+        The config with the AWS credentials. Defaults to `get_config()`
 
-    return False
+    Returns
+    -------
+    float
+        The send rate. Defaults to 1, the SES sandbox limit, if the quota can't be read
+
+    Examples
+    --------
+    >>> get_max_send_rate()
+    14.0
+    """
+    try:
+        return float(get_ses_client(config).get_send_quota()["MaxSendRate"]) or 1
+    except (ClientError, BotoCoreError, KeyError) as e:
+        logger.warning(f"could not read SES send quota - {get_error_message(e)}")
+        return 1
+
+
+def send_bulk_aws_email(
+    email_html: str,
+    email_plain_text: str,
+    recipients: list[str],
+    config: Optional[Config] = None,
+) -> bool:
+    """
+    Sends the email to many recipients with SendBulkTemplatedEmail, in batches of at most 50 destinations paced to the account's maximum send rate. A batch that is throttled or fails is retried with exponential backoff.
+
+    Parameters
+    ----------
+    email_html : str
+        HTML body of the email
+    email_plain_text : str
+        Plain text body of the email
+    recipients : list[str]
+        Email addresses to send to. Each one gets their own copy
+    config : Optional[Config]
+        The config with the AWS credentials, sender and template name. Defaults to `get_config()`
+
+    Returns
+    -------
+    bool
+        True if the email was sent to every recipient
+
+    Examples
+    --------
+    >>> send_bulk_aws_email("<html></html>", "SGBs", ["a@example.com", "b@example.com"])
+    True
+    """
+    config = config or get_config()
+    client = get_ses_client(config)
+
+    try:
+        with span("email.upsert_template"):
+            upsert_email_template(config)
+    except (ClientError, BotoCoreError) as e:
+        logger.error(f"could not update SES template - {get_error_message(e)}")
+        return False
+
+    max_send_rate = get_max_send_rate(config)
+    failed: list[str] = list()
+    # Sent once per request instead of with every destination, since every recipient gets the same bodies
+    template_data = json_dumps({"html": email_html, "text": email_plain_text})
+    empty_template_data = json_dumps({})
+
+    for start in range(0, len(recipients), MAX_DESTINATIONS_PER_BATCH):
+        batch = recipients[start : start + MAX_DESTINATIONS_PER_BATCH]
+
+        # Spacing batches so that the number of emails per second stays within the quota
+        if start:
+            sleep(len(batch) / max_send_rate)
+
+        for attempt in range(1, MAX_BATCH_ATTEMPTS + 1):
+            try:
+                with span("email.send_batch", attempt=attempt, recipients=len(batch)):
+                    response = client.send_bulk_templated_email(
+                        Source=config.aws_ses_sender_email,
+                        Template=config.aws_ses_template_name,
+                        DefaultTemplateData=template_data,
+                        Destinations=[
+                            {
+                                "Destination": {"ToAddresses": [recipient]},
+                                "ReplacementTemplateData": empty_template_data,
+                            }
+                            for recipient in batch
+                        ],
+                    )
+            except (ClientError, BotoCoreError) as e:
+                retryable = not isinstance(e, ClientError) or (
+                    e.response.get("Error", {}).get("Code") in RETRYABLE_ERROR_CODES
+                )
+                logger.warning(
+                    f"could not send batch {start // MAX_DESTINATIONS_PER_BATCH + 1} on attempt {attempt} - {get_error_message(e)}"
+                )
+                if retryable and attempt < MAX_BATCH_ATTEMPTS:
+                    sleep(2**attempt)
+                    continue
+                failed.extend(batch)
+                break
+
+            for recipient, status in zip(batch, response["Status"]):
+                if status.get("Status", "Success") != "Success" or status.get("Error"):
+                    logger.error(
+                        f"could not send email to {mask_email(recipient)} - {status.get('Status')} {status.get('Error', '')}"
+                    )
+                    failed.append(recipient)
+            break
+
+    logger.info(
+        f"email sent to {len(recipients) - len(failed)}/{len(recipients)} recipients in {-(-len(recipients) // MAX_DESTINATIONS_PER_BATCH)} batch(es)"
+    )
+    return not failed
@@ -0,0 +1,390 @@
+"""
+Durable on-disk outbox for deliveries. A run only writes its artifacts to the outbox and returns, and a worker sends them later with retries, so fetching the data and delivering it fail independently.
+
+Every delivery is one JSON file, which moves between these folders with atomic renames -
+    pending/     waiting to be sent, possibly after a backoff
+    processing/  claimed by a worker
+    sent/        an empty marker per idempotency key that has been delivered, and per recipient it was delivered to
+    dead/        failed too many times, kept for inspection
+"""
+
+from functools import partial
+from hashlib import sha256
+from json import JSONDecodeError
+from json import dumps as json_dumps
+from json import loads as json_loads
+from os import getenv, replace
+from pathlib import Path
+from time import sleep, time
+from typing import Any, Optional
+
+from ..logg import logger
+from ..metrics import export_metrics_periodically
+from .artifact_store import atomic_write
+from .common import tmp_folder
+from .dedup import update_delivery_state
+from .dispatch import Channel, ChannelResult, dispatch_channels
+from .render import Artifacts, artifacts_from_dict, artifacts_to_dict
+
+OUTBOX_DIR: Path = Path(getenv("SGB_OUTBOX_DIR", str(tmp_folder / "outbox")))
+"""Folder of the outbox"""
+
+OUTBOX_MAX_ATTEMPTS: int = int(getenv("SGB_OUTBOX_MAX_ATTEMPTS", "5") or 5)
+"""Attempts for a delivery before it is moved to dead/"""
+
+OUTBOX_RETRY_BACKOFF: float = float(getenv("SGB_OUTBOX_RETRY_BACKOFF", "30") or 30)
+"""Seconds to wait before the first retry. Doubled after every failed attempt"""
+
+OUTBOX_LEASE: float = float(getenv("SGB_OUTBOX_LEASE", "900") or 900)
+"""Seconds after which a delivery claimed by a worker that died is given to another worker"""
+
+OUTBOX_SENT_RETENTION: float = 7 * 24 * 60 * 60
+"""Seconds for which the idempotency keys of sent deliveries are kept"""
+
+PENDING: str = "pending"
+PROCESSING: str = "processing"
+SENT: str = "sent"
+DEAD: str = "dead"
+
+
+def get_outbox_folder(state: str, outbox_dir: Path = OUTBOX_DIR) -> Path:
+    """Returns the folder of a state of the outbox, creating it if it doesn't exist"""
+    folder = outbox_dir / state
+    folder.mkdir(parents=True, exist_ok=True)
+    return folder
+
+
+def get_idempotency_key(channel: str, artifacts: Artifacts) -> str:
+    """
+    Returns the key that identifies the delivery of a run's artifacts through a channel. Enqueueing the same run twice only queues it once, and retries skip the recipients it was already sent to. A recipient can still get it twice if a send times out or the worker dies after the channel sent it but before it was recorded, since there is no way to ask Telegram or SES if they got it.
+
+    Parameters
+    ----------
+    channel : str
+        Name of the channel, like "telegram"
+    artifacts : Artifacts
+        The artifacts rendered for the run
+
+    Returns
+    -------
+    str
+        SHA-256 hex digest of the channel, the content hash and the time of the run
+
+    Examples
+    --------
+    >>> get_idempotency_key("telegram", artifacts)
+    "c1d4a4a1e9b0c7d7f4ad0c1fd2f0f3b8a7a45e0f8f4d5ce2a1b3a9e6d9f7c0b2"
+    """
+    return sha256(
+        f"{channel}:{artifacts.content_hash}:{artifacts.results.generated_at.isoformat()}".encode()
+    ).hexdigest()
+
+
+def get_recipient_key(key: str, recipient: str) -> str:
+    """Returns the key of the marker written once a delivery has been sent to one of its recipients"""
+    return sha256(f"{key}:{recipient}".encode()).hexdigest()
+
+
+def enqueue(
+    artifacts: Artifacts, channels: dict[str, list[str]], outbox_dir: Path = OUTBOX_DIR
+) -> list[ChannelResult]:
+    """
+    Writes one delivery per channel to the outbox
+
+    Parameters
+    ----------
+    artifacts : Artifacts
+        The artifacts rendered for this run
+    channels : dict[str, list[str]]
+        Maps the name of each channel to deliver through to its recipients. With no recipients, the channel sends to the recipients of the worker's config
+    outbox_dir : Path
+        Folder of the outbox. Defaults to SGB_OUTBOX_DIR
+
+    Returns
+    -------
+    list[ChannelResult]
+        Whether each delivery was queued. Deliveries that were already queued or sent count as queued
+
+    Examples
+    --------
+    >>> enqueue(artifacts, {"telegram": ["123456789"], "email": ["user@example.com"]})
+    [<ChannelResult [telegram - ok in 0.001s]>, <ChannelResult [email - ok in 0.001s]>]
+    """
+    results: list[ChannelResult] = list()
+    payload = artifacts_to_dict(artifacts)
+    run_keys = [get_idempotency_key(channel, artifacts) for channel in channels]
+
+    for (channel, recipients), key in zip(channels.items(), run_keys):
+        name = f"{key}.json"
+
+        if (
+            any(
+                (get_outbox_folder(state, outbox_dir) / name).exists()
+                for state in (PENDING, PROCESSING, DEAD)
+            )
+            or (get_outbox_folder(SENT, outbox_dir) / key).exists()
+        ):
+            logger.info(f"{channel} delivery {key[:12]} is already in the outbox")
+            results.append(ChannelResult(channel, True, 0))
+            continue
+
+        job = {
+            "key": key,
+            "channel": channel,
+            "recipients": recipients,
+            "run_keys": run_keys,
+            "created_at": time(),
+            "attempts": 0,
+            "next_attempt_at": 0,
+            "last_error": None,
+            "artifacts": payload,
+        }
+        try:
+            atomic_write(
+                get_outbox_folder(PENDING, outbox_dir) / name, json_dumps(job).encode()
+            )
+        except OSError as e:
+            logger.error(f"could not queue {channel} delivery - {e}")
+            results.append(ChannelResult(channel, False, 0, str(e)))
+            continue
+
+        logger.info(f"queued {channel} delivery {key[:12]}")
+        results.append(ChannelResult(channel, True, 0))
+
+    return results
+
+
+def _claim(path: Path, outbox_dir: Path) -> Optional[Path]:
+    """Moves a pending delivery to processing/. Only one worker succeeds if many try at once"""
+    claimed = get_outbox_folder(PROCESSING, outbox_dir) / path.name
+    try:
+        replace(path, claimed)
+    except OSError:
+        return None
+    # The modification time of a claimed delivery is when its lease started
+    claimed.touch()
+    return claimed
+
+
+def _release_expired_leases(outbox_dir: Path) -> None:
+    """Puts deliveries claimed by workers that died back in pending/"""
+    now = time()
+    for path in get_outbox_folder(PROCESSING, outbox_dir).glob("*.json"):
+        try:
+            if now - path.stat().st_mtime > OUTBOX_LEASE:
+                replace(path, get_outbox_folder(PENDING, outbox_dir) / path.name)
+                logger.warning(f"released expired lease on delivery {path.stem[:12]}")
+        except OSError:
+            continue
+
+
+def _prune_sent_markers(outbox_dir: Path) -> None:
+    """Deletes the idempotency keys of deliveries sent longer than OUTBOX_SENT_RETENTION ago"""
+    now = time()
+    for path in get_outbox_folder(SENT, outbox_dir).iterdir():
+        try:
+            if now - path.stat().st_mtime > OUTBOX_SENT_RETENTION:
+                path.unlink(missing_ok=True)
+        except OSError:
+            continue
+
+
+def _is_run_delivered(job: dict[str, Any], outbox_dir: Path) -> bool:
+    """Checks if the run the delivery belongs to has been sent through every channel it was queued for"""
+    sent = get_outbox_folder(SENT, outbox_dir)
+    return all((sent / key).exists() for key in job.get("run_keys") or [job["key"]])
+
+
+def _send_to_recipient(
+    channel: Channel, artifacts: Artifacts, recipient: str, marker: Path
+) -> bool:
+    """Sends to a single recipient and writes its marker once sent, even if the worker has stopped waiting for it"""
+    sent = bool(channel(artifacts, recipients=[recipient]))
+    if sent:
+        marker.touch()
+    return sent
+
+
+def _deliver(
+    job: dict[str, Any],
+    artifacts: Artifacts,
+    channel: Channel,
+    claimed: Path,
+    outbox_dir: Path,
+) -> ChannelResult:
+    """Sends a delivery to each of its recipients that it hasn't been sent to yet, one at a time. Stops at the first send that times out, since it may still go through"""
+    name: str = job["channel"]
+    recipients: list[str] = job.get("recipients") or []
+    if not recipients:
+        return dispatch_channels(artifacts, {name: channel})[0]
+
+    sent = get_outbox_folder(SENT, outbox_dir)
+    duration, failed, error = 0.0, 0, None
+    for recipient in recipients:
+        marker = sent / get_recipient_key(job["key"], recipient)
+        if marker.exists():
+            continue
+        # Renews the lease, so a delivery to many recipients isn't given to another worker while it is still being sent
+        claimed.touch()
+        result = dispatch_channels(
+            artifacts,
+            {
+                name: partial(
+                    _send_to_recipient, channel, recipient=recipient, marker=marker
+                )
+            },
+        )[0]
+        duration += result.duration
+        if result.timed_out:
+            return ChannelResult(name, False, duration, result.error, timed_out=True)
+        if not result.ok:
+            failed += 1
+            error = error or result.error
+
+    if not failed:
+        return ChannelResult(name, True, duration)
+    return ChannelResult(
+        name,
+        False,
+        duration,
+        f"not sent to {failed}/{len(recipients)} recipient(s)"
+        + (f" - {error}" if error else ""),
+    )
+
+
+def process_outbox(
+    channels: dict[str, Channel], outbox_dir: Path = OUTBOX_DIR
+) -> list[ChannelResult]:
+    """
+    Sends every delivery that is due. Failed deliveries are put back with an exponential backoff and only sent to the recipients that didn't get them, or moved to dead/ after SGB_OUTBOX_MAX_ATTEMPTS attempts. A delivery that times out is left in processing/ until its lease expires, since it may still be sent. Once a run has been sent through every channel it was queued for, it is recorded as the last delivery.
+
+    Parameters
+    ----------
+    channels : dict[str, Channel]
+        Maps the name of each channel to the function that sends through it
+    outbox_dir : Path
+        Folder of the outbox. Defaults to SGB_OUTBOX_DIR
+
+    Returns
+    -------
+    list[ChannelResult]
+        The result of every delivery attempted
+
+    Examples
+    --------
+    >>> process_outbox({"telegram": send_via_telegram, "email": send_mail})
+    [<ChannelResult [telegram - ok in 1.204s]>]
+    """
+    _release_expired_leases(outbox_dir)
+    _prune_sent_markers(outbox_dir)
+
+    now = time()
+    results: list[ChannelResult] = list()
+
+    for path in sorted(get_outbox_folder(PENDING, outbox_dir).glob("*.json")):
+        try:
+            job: dict[str, Any] = json_loads(path.read_text(encoding="utf-8"))
+        except (OSError, JSONDecodeError):
+            # Claimed by another worker in the meantime
+            continue
+
+        if job.get("next_attempt_at", 0) > now:
+            continue
+
+        claimed = _claim(path, outbox_dir)
+        if not claimed:
+            continue
+
+        key: str = job["key"]
+        channel: str = job["channel"]
+
+        if (get_outbox_folder(SENT, outbox_dir) / key).exists():
+            logger.info(f"{channel} delivery {key[:12]} was already sent, dropping it")
+            claimed.unlink(missing_ok=True)
+            continue
+
+        artifacts = artifacts_from_dict(job["artifacts"])
+        if channel not in channels:
+            result = ChannelResult(channel, False, 0, "unknown channel")
+        else:
+            result = _deliver(job, artifacts, channels[channel], claimed, outbox_dir)
+        results.append(result)
+
+        if result.ok:
+            # The marker is written before the delivery is removed, so a crash in between never sends it again
+            (get_outbox_folder(SENT, outbox_dir) / key).touch()
+            claimed.unlink(missing_ok=True)
+            # Only a run that reached every channel counts as delivered for SGB_SKIP_UNCHANGED_DELIVERY
+            if _is_run_delivered(job, outbox_dir):
+                update_delivery_state(
+                    content_hash=artifacts.content_hash, delivered_at=time()
+                )
+            continue
+
+        job["attempts"] += 1
+        job["last_error"] = result.error or "not sent"
+
+        if result.timed_out and job["attempts"] < OUTBOX_MAX_ATTEMPTS:
+            # Rewriting it restarts the lease, which gives the send time to finish before it is retried
+            atomic_write(claimed, json_dumps(job).encode())
+            logger.warning(
+                f"{channel} delivery {key[:12]} timed out, leaving it in {PROCESSING} until its lease expires"
+            )
+            continue
+
+        if job["attempts"] >= OUTBOX_MAX_ATTEMPTS or channel not in channels:
+            atomic_write(claimed, json_dumps(job).encode())
+            replace(claimed, get_outbox_folder(DEAD, outbox_dir) / claimed.name)
+            logger.error(
+                f"{channel} delivery {key[:12]} failed {job['attempts']} time(s), moved it to {DEAD}"
+            )
+            continue
+
+        backoff = OUTBOX_RETRY_BACKOFF * 2 ** (job["attempts"] - 1)
+        job["next_attempt_at"] = time() + backoff
+        atomic_write(claimed, json_dumps(job).encode())
+        replace(claimed, get_outbox_folder(PENDING, outbox_dir) / claimed.name)
+        logger.warning(
+            f"{channel} delivery {key[:12]} failed, retrying in {backoff:.0f}s"
+        )
+
+    return results
+
+
+def run_worker(
+    channels: dict[str, Channel],
+    once: bool = False,
+    interval: float = 5,
+    outbox_dir: Path = OUTBOX_DIR,
+) -> int:
+    """
+    Drains the outbox, either once or forever
+
+    Parameters
+    ----------
+    channels : dict[str, Channel]
+        Maps the name of each channel to the function that sends through it
+    once : bool
+        Send what is due and return, instead of polling forever
+    interval : float
+        Seconds between polls of the outbox
+    outbox_dir : Path
+        Folder of the outbox. Defaults to SGB_OUTBOX_DIR
+
+    Returns
+    -------
+    int
+        When run once, 0 if every delivery attempted succeeded and 1 otherwise
+
+    Examples
+    --------
+    >>> run_worker({"telegram": send_via_telegram}, once=True)
+    0
+    """
+    logger.info(f"outbox worker started on {outbox_dir}")
+    while True:
+        results = process_outbox(channels, outbox_dir)
+        if once:
+            return 0 if all(result.ok for result in results) else 1
+        export_metrics_periodically()
+        sleep(interval)
@@ -0,0 +1,256 @@
+"""
+Render stage that runs once per run, and produces every artifact the notifiers send
+"""
+
+from json import dumps as json_dumps
+from time import perf_counter
+from typing import Any, Collection, NamedTuple, Optional
+
+from ..config import Config, get_config
+from ..logg import logger
+from ..metrics import span
+from ..models import SGB, Results
+from .common import (
+    generate_html_from_template,
+    get_email_body_plain_text,
+    get_ist_time,
+    get_json_representation,
+    get_table_row_html,
+    get_telegram_caption,
+)
+from .dedup import get_content_hash
+from .subscribers import DEFAULT_PROFILE, get_profile
+
+
+class Artifacts(NamedTuple):
+    """Everything rendered from the results of a run. Notifiers only read from this, and never render anything themselves"""
+
+    results: Results
+    """The results everything was rendered from"""
+
+    html: str
+    """The complete HTML page, used as the email body and to screenshot the table"""
+
+    text: str
+    """Plain text version of the email"""
+
+    caption: str
+    """Caption of the Telegram post, before escaping"""
+
+    json: str
+    """JSON representation of the results, sent as a file on Telegram"""
+
+    content_hash: str
+    """Hash of what is shown to the user, from `get_content_hash()`. Same for reruns where nothing material changed"""
+
+    held_sgbs: frozenset[str] = frozenset()
+    """NSE symbols of the SGBs highlighted in the outputs"""
+
+
+class RowFragments:
+    """The HTML row and JSON of every SGB, built once and shared by every output that shows it"""
+
+    __slots__ = {"_html", "_json"}
+
+    def __init__(self) -> None:
+        self._html: dict[tuple[str, bool], str] = dict()
+        self._json: dict[str, str] = dict()
+
+    def html(self, sgb: SGB, is_held: bool) -> str:
+        """The <tr> of the SGB from `get_table_row_html()`"""
+        key = (sgb.nse_symbol, is_held)
+        if key not in self._html:
+            self._html[key] = get_table_row_html(sgb, is_held)
+        return self._html[key]
+
+    def json(self, sgb: SGB) -> str:
+        """The SGB serialised as a JSON object"""
+        if sgb.nse_symbol not in self._json:
+            self._json[sgb.nse_symbol] = json_dumps(sgb.to_dict(), indent=None)
+        return self._json[sgb.nse_symbol]
+
+
+def build_results(sgbs: list[SGB]) -> Results:
+    """
+    Freezes the SGBs along with the price of gold and the time of the run
+
+    Parameters
+    ----------
+    sgbs : list[SGB]
+        SGBs sorted in descending order of XIRR
+
+    Returns
+    -------
+    Results
+        The results of the run
+
+    Examples
+    --------
+    >>> build_results(sgbs)
+    Results(sgbs=(SGB1, SGB2), gold_price=7956.0, generated_at=datetime.datetime(2024, 11, 20, 19, 50, 21, 802675, tzinfo=datetime.timezone.utc))
+    """
+    # The data module imports Playwright, so it is only imported once there is something to build
+    from ..data import get_price_of_gold
+
+    return Results(tuple(sgbs), get_price_of_gold(), get_ist_time())
+
+
+def render_artifacts(
+    results: Results,
+    held_sgbs: Optional[Collection[str]] = None,
+    fragments: Optional[RowFragments] = None,
+) -> Artifacts:
+    """
+    Renders the HTML, plain text, caption and JSON from the results
+
+    Parameters
+    ----------
+    results : Results
+        The results of the run
+    held_sgbs : Optional[Collection[str]]
+        NSE symbols of the SGBs to highlight. Defaults to the held SGBs of `get_config()`
+    fragments : Optional[RowFragments]
+        Rows already built for other outputs of the same run, which are reused instead of built again
+
+    Returns
+    -------
+    Artifacts
+        Everything the notifiers need to send
+
+    Examples
+    --------
+    >>> render_artifacts(results)
+    Artifacts(results=Results(...), html="<html>...</html>", text="...", caption="...", json="{...}", content_hash="3a7bd3e2...", held_sgbs=frozenset({"SGBAUG28V"}))
+    """
+    start = perf_counter()
+    fragments = fragments or RowFragments()
+    held_sgbs = get_config().held_sgbs if held_sgbs is None else held_sgbs
+    held_sgbs = frozenset(
+        sgb.nse_symbol for sgb in results.sgbs if sgb.nse_symbol in held_sgbs
+    )
+
+    with span("render", sgbs=len(results.sgbs)):
+        artifacts = Artifacts(
+            results=results,
+            html=generate_html_from_template(
+                results,
+                held_sgbs,
+                [
+                    fragments.html(sgb, sgb.nse_symbol in held_sgbs)
+                    for sgb in results.sgbs
+                ],
+            ),
+            text=get_email_body_plain_text(results),
+            caption=get_telegram_caption(results),
+            json=get_json_representation(
+                results, [fragments.json(sgb) for sgb in results.sgbs]
+            ),
+            content_hash=get_content_hash(results, held_sgbs),
+            held_sgbs=held_sgbs,
+        )
+
+    logger.debug("rendered artifacts in {:.1f} ms", (perf_counter() - start) * 1000)
+    return artifacts
+
+
+def artifacts_to_dict(artifacts: Artifacts) -> dict[str, Any]:
+    """
+    Returns the artifacts as a dictionary that can be serialised to JSON, and read back with `artifacts_from_dict()`
+
+    Parameters
+    ----------
+    artifacts : Artifacts
+        The artifacts rendered for a run
+
+    Returns
+    -------
+    dict[str, Any]
+        The artifacts, with the results from `Results.to_dict()` and the held SGBs as a sorted list
+
+    Examples
+    --------
+    >>> artifacts_to_dict(artifacts)
+    {"results": {"sgbs": [...], "gold_price": 7956.0, "generated_at": "2024-11-20T19:50:21.802675+00:00"}, "html": "<html>...</html>", ...}
+    """
+    return {
+        **artifacts._asdict(),
+        "results": artifacts.results.to_dict(),
+        "held_sgbs": sorted(artifacts.held_sgbs),
+    }
+
+
+def artifacts_from_dict(d: dict[str, Any]) -> Artifacts:
+    """Builds the artifacts back from `artifacts_to_dict()`"""
+    return Artifacts(
+        **{
+            **d,
+            "results": Results.from_dict(d["results"]),
+            "held_sgbs": frozenset(d.get("held_sgbs", list())),
+        }
+    )
+
+
+def render_for_subscribers(
+    artifacts: Artifacts, addresses: list[str], config: Optional[Config] = None
+) -> list[tuple[Artifacts, list[str]]]:
+    """
+    Renders the outputs of every subscriber in one batch. Subscribers that would see the same SGBs with the same highlights share one output, which is rendered only once, and every SGB's row is built only once across all outputs. Subscribers without a profile get the given artifacts.
+
+    Parameters
+    ----------
+    artifacts : Artifacts
+        The artifacts rendered for this run with the default profile
+    addresses : list[str]
+        Telegram chat IDs or email addresses of the subscribers
+    config : Optional[Config]
+        The config whose profiles and held SGBs are used. Defaults to `get_config()`
+
+    Returns
+    -------
+    list[tuple[Artifacts, list[str]]]
+        Every distinct output, with the subscribers it should be sent to
+
+    Examples
+    --------
+    >>> render_for_subscribers(artifacts, ["123456789", "@sgb_advisor"])
+    [(Artifacts(...), ["123456789", "@sgb_advisor"])]
+    """
+    start = perf_counter()
+    config = config or get_config()
+
+    default_key = (
+        tuple(sgb.nse_symbol for sgb in artifacts.results.sgbs),
+        artifacts.held_sgbs,
+    )
+    views: dict[tuple[tuple[str, ...], frozenset[str]], Results] = dict()
+    groups: dict[tuple[tuple[str, ...], frozenset[str]], list[str]] = {
+        default_key: list()
+    }
+
+    for address in addresses:
+        profile = get_profile(address, config)
+        if profile is DEFAULT_PROFILE:
+            groups[default_key].append(address)
+            continue
+        results, held_sgbs = profile.apply(artifacts.results, config.held_sgbs)
+        key = (tuple(sgb.nse_symbol for sgb in results.sgbs), held_sgbs)
+        views.setdefault(key, results)
+        groups.setdefault(key, list()).append(address)
+
+    fragments = RowFragments()
+    outputs: list[tuple[Artifacts, list[str]]] = list()
+    for key, group in groups.items():
+        if not group:
+            continue
+        output = (
+            artifacts
+            if key == default_key
+            else render_artifacts(views[key], key[1], fragments)
+        )
+        outputs.append((output, group))
+
+    if len(outputs) > 1:
+        logger.info(
+            f"rendered {len(outputs)} distinct output(s) for {len(addresses)} subscriber(s) in {(perf_counter() - start) * 1000:.1f} ms"
+        )
+    return outputs
@@ -0,0 +1,214 @@
+"""
+Per-subscriber profiles, so every chat ID or email can have its own held SGBs, number of SGBs shown and filters
+"""
+
+from datetime import date
+from functools import lru_cache
+from json import JSONDecodeError
+from json import loads as json_loads
+from pathlib import Path
+from typing import Collection, Optional
+
+from ..config import Config, get_config
+from ..logg import logger
+from ..models import Results
+
+SUBSCRIBERS_PATH_ENV: str = "SGB_SUBSCRIBERS_PATH"
+"""
+Path of a JSON file mapping chat IDs and email addresses to their profile, read into `Config.subscribers_path`. Subscribers missing from it (or everyone, if it isn't set) get the default profile. For example
+
+{
+    "123456789": {"held_sgbs": ["SGBAUG28V"], "top_n": 5},
+    "someone@example.com": {"min_xirr": 2.5, "max_years_to_maturity": 4}
+}
+"""
+
+
+class SubscriberProfile:
+    """What a subscriber wants to see"""
+
+    __slots__ = {"held_sgbs", "top_n", "min_xirr", "max_years_to_maturity", "symbols"}
+
+    def __init__(
+        self,
+        held_sgbs: Optional[frozenset[str]] = None,
+        top_n: Optional[int] = None,
+        min_xirr: Optional[float] = None,
+        max_years_to_maturity: Optional[float] = None,
+        symbols: Optional[frozenset[str]] = None,
+    ) -> None:
+        """
+        Initialize a subscriber profile
+
+        Parameters
+        ----------
+        held_sgbs : Optional[frozenset[str]]
+            NSE symbols of the SGBs to highlight. Defaults to the held SGBs of the config
+        top_n : Optional[int]
+            Only the best these many SGBs (after filtering) are shown. Defaults to all of them
+        min_xirr : Optional[float]
+            Only SGBs with at least this XIRR are shown
+        max_years_to_maturity : Optional[float]
+            Only SGBs maturing within these many years are shown
+        symbols : Optional[frozenset[str]]
+            Only these SGBs are shown
+
+        Returns
+        -------
+        SubscriberProfile object
+
+        Examples
+        --------
+        >>> SubscriberProfile(frozenset({"SGBAUG28V"}), top_n=5)
+        SubscriberProfile_Object
+        """
+        self.held_sgbs = held_sgbs
+        self.top_n = top_n
+        self.min_xirr = min_xirr
+        self.max_years_to_maturity = max_years_to_maturity
+        self.symbols = symbols
+
+    @classmethod
+    def from_dict(
+        cls, profile: dict[str, list[str] | int | float]
+    ) -> "SubscriberProfile":
+        """Builds a profile from an entry of the SGB_SUBSCRIBERS_PATH file. Missing keys take their defaults"""
+        held_sgbs = profile.get("held_sgbs")
+        symbols = profile.get("symbols")
+        top_n = profile.get("top_n")
+        min_xirr = profile.get("min_xirr")
+        max_years_to_maturity = profile.get("max_years_to_maturity")
+        return cls(
+            frozenset(held_sgbs) if isinstance(held_sgbs, list) else None,
+            int(top_n) if isinstance(top_n, (int, float)) else None,
+            float(min_xirr) if isinstance(min_xirr, (int, float)) else None,
+            float(max_years_to_maturity)
+            if isinstance(max_years_to_maturity, (int, float))
+            else None,
+            frozenset(symbols) if isinstance(symbols, list) else None,
+        )
+
+    def get_held_sgbs(self, default: Collection[str]) -> frozenset[str]:
+        """The SGBs this subscriber holds, or the default if their profile doesn't say"""
+        return frozenset(default) if self.held_sgbs is None else self.held_sgbs
+
+    def apply(
+        self, results: Results, default_held_sgbs: Collection[str] = frozenset()
+    ) -> tuple[Results, frozenset[str]]:
+        """
+        Filters the results down to what this subscriber sees
+
+        Parameters
+        ----------
+        results : Results
+            The results of the run
+        default_held_sgbs : Collection[str]
+            The SGBs to highlight if the profile doesn't list its own
+
+        Returns
+        -------
+        tuple[Results, frozenset[str]]
+            The results with only the SGBs shown to this subscriber, and the held SGBs among them
+
+        Examples
+        --------
+        >>> SubscriberProfile(frozenset({"SGBAUG28V"}), top_n=1).apply(results)
+        (Results(sgbs=(SGB1,), gold_price=7956.0, generated_at=...), frozenset({"SGBAUG28V"}))
+        """
+        today = results.generated_at.date()
+        sgbs = tuple(
+            sgb
+            for sgb in results.sgbs
+            if (self.symbols is None or sgb.nse_symbol in self.symbols)
+            and (self.min_xirr is None or sgb.xirr >= self.min_xirr)
+            and (
+                self.max_years_to_maturity is None
+                or get_years_to_maturity(sgb.maturity_date, today)
+                <= self.max_years_to_maturity
+            )
+        )
+        if self.top_n is not None:
+            sgbs = sgbs[: self.top_n]
+
+        shown = {sgb.nse_symbol for sgb in sgbs}
+        return results._replace(sgbs=sgbs), self.get_held_sgbs(
+            default_held_sgbs
+        ) & shown
+
+
+DEFAULT_PROFILE: SubscriberProfile = SubscriberProfile()
+"""Profile of subscribers that don't have one. Shows every SGB with the held SGBs of the config highlighted"""
+
+
+def get_years_to_maturity(maturity_date: date, today: date) -> float:
+    """Years left until the maturity date, as a fraction"""
+    return (maturity_date - today).days / 365.25
+
+
+@lru_cache(maxsize=None)
+def get_subscriber_profiles(subscribers_path: str) -> dict[str, SubscriberProfile]:
+    """
+    Reads the subscriber profiles from a file once per process
+
+    Parameters
+    ----------
+    subscribers_path : str
+        Path of the file, usually `Config.subscribers_path`
+
+    Returns
+    -------
+    dict[str, SubscriberProfile]
+        Maps a chat ID or email address to its profile. Empty if the path is empty
+
+    Examples
+    --------
+    >>> get_subscriber_profiles("subscribers.json")
+    {"123456789": SubscriberProfile_Object}
+    """
+    if not subscribers_path:
+        return dict()
+
+    try:
+        profiles = json_loads(Path(subscribers_path).read_text(encoding="utf-8"))
+    except (OSError, JSONDecodeError) as e:
+        msg = f'could not read subscriber profiles from "{subscribers_path}" - {e}'
+        logger.error(msg)
+        raise RuntimeError(msg)
+
+    if not isinstance(profiles, dict):
+        msg = f'subscriber profiles in "{subscribers_path}" must be a JSON object mapping chat IDs and emails to profiles'
+        logger.error(msg)
+        raise RuntimeError(msg)
+
+    logger.debug("loaded {} subscriber profile(s)", len(profiles))
+    return {
+        str(address).strip(): SubscriberProfile.from_dict(profile)
+        for address, profile in profiles.items()
+    }
+
+
+def get_profile(address: str, config: Optional[Config] = None) -> SubscriberProfile:
+    """
+    Returns the profile of a chat ID or email address, or the default profile if it doesn't have one
+
+    Parameters
+    ----------
+    address : str
+        Telegram chat ID or email address
+    config : Optional[Config]
+        The config whose subscribers file is read. Defaults to `get_config()`
+
+    Returns
+    -------
+    SubscriberProfile
+        The profile of the subscriber
+
+    Examples
+    --------
+    >>> get_profile("someone@example.com")
+    SubscriberProfile_Object
+    """
+    config = config or get_config()
+    return get_subscriber_profiles(config.subscribers_path).get(
+        address, DEFAULT_PROFILE
+    )
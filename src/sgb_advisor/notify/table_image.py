@@ -0,0 +1,223 @@
+"""
+Draws the SGB returns table as a PNG in-process using [Pillow](https://python-pillow.org), without launching a browser
+"""
+
+from datetime import datetime
+from io import BytesIO
+from os import getenv
+from typing import TYPE_CHECKING, Collection
+
+from ..models import SGB
+
+if TYPE_CHECKING:
+    from PIL.ImageFont import FreeTypeFont, ImageFont
+
+TELEGRAM_FONT_PATH_ENV: str = "SGB_TELEGRAM_FONT_PATH"
+"""Path to a regular TrueType font to draw the table with. A bold font is looked up next to it by adding "-Bold" to its name"""
+
+REGULAR_FONTS: tuple[str, ...] = ("DejaVuSans.ttf", "LiberationSans-Regular.ttf")
+BOLD_FONTS: tuple[str, ...] = ("DejaVuSans-Bold.ttf", "LiberationSans-Bold.ttf")
+"""Fonts tried in order when SGB_TELEGRAM_FONT_PATH is not set. Pillow searches the system font folders for these"""
+
+FONT_SIZE: int = 16
+SCALE: int = 2
+"""Everything is drawn at this multiple of the sizes below, so the image stays sharp when Telegram scales it"""
+
+PADDING_Y: int = 8
+PADDING_X: int = 10
+BORDER: int = 1
+
+TEXT_COLOUR: str = "black"
+HELD_SGB_COLOUR: str = "red"
+"""Colour of the symbols in SGB_ALREADY_HELD_SGBS, same as `get_sgb_symbol_css()`"""
+
+PALETTE_COLOURS: int = 16
+"""Colours the image is reduced to before it is encoded"""
+
+HEADERS: tuple[str, ...] = ("NSE Symbol", "LTP", "Maturity Date", "XIRR (%)")
+CAPTION: str = "Estimated returns of each SGB"
+
+
+def _load_font(candidates: tuple[str, ...], size: int) -> "FreeTypeFont | ImageFont":
+    from PIL import ImageFont
+
+    for candidate in candidates:
+        try:
+            return ImageFont.truetype(candidate, size)
+        except OSError:
+            continue
+    return ImageFont.load_default(size)
+
+
+def get_fonts() -> tuple["FreeTypeFont | ImageFont", "FreeTypeFont | ImageFont"]:
+    """
+    Returns the regular and bold fonts to draw the table with
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    tuple[FreeTypeFont | ImageFont, FreeTypeFont | ImageFont]
+        The regular and bold fonts. Falls back to Pillow's default font if none of the fonts can be found
+
+    Examples
+    --------
+    >>> get_fonts()
+    (<PIL.ImageFont.FreeTypeFont object at 0x7f...>, <PIL.ImageFont.FreeTypeFont object at 0x7f...>)
+    """
+    size = FONT_SIZE * SCALE
+    font_path = getenv(TELEGRAM_FONT_PATH_ENV, "")
+    if font_path:
+        stem, _, suffix = font_path.rpartition(".")
+        return _load_font((font_path,), size), _load_font(
+            (f"{stem}-Bold.{suffix}", font_path), size
+        )
+    return _load_font(REGULAR_FONTS, size), _load_font(BOLD_FONTS, size)
+
+
+def render_table_png(
+    sgbs: list[SGB],
+    gold_price: float,
+    dt: datetime,
+    held_sgbs: Collection[str],
+) -> bytes:
+    """
+    Draws the same table as `get_table_html()`, with the symbols of already held SGBs in red.
+
+    Parameters
+    ----------
+    sgbs : list[SGB]
+        List of SGBs, in the order they should be shown
+    gold_price : float
+        The price of gold, shown in the last row
+    dt : datetime
+        The time of the run. Its date is shown in the last row
+    held_sgbs : Collection[str]
+        NSE symbols of the SGBs to highlight
+
+    Returns
+    -------
+    bytes
+        The PNG image
+
+    Examples
+    --------
+    >>> render_table_png(sgbs, 7956.0, get_ist_time(), ["SGBAUG28V"])
+    b"\\x89PNG\\r\\n\\x1a\\n..."
+    """
+    from PIL import Image, ImageDraw
+
+    regular_font, bold_font = get_fonts()
+
+    pad_x, pad_y, border = PADDING_X * SCALE, PADDING_Y * SCALE, BORDER * SCALE
+
+    # Each cell is (text, font, colour)
+    rows: list[list[tuple[str, "FreeTypeFont | ImageFont", str]]] = [
+        [(header, bold_font, TEXT_COLOUR) for header in HEADERS]
+    ]
+    for sgb in sgbs:
+        rows.append(
+            [
+                (
+                    sgb.nse_symbol,
+                    regular_font,
+                    HELD_SGB_COLOUR if sgb.nse_symbol in held_sgbs else TEXT_COLOUR,
+                ),
+                (str(sgb.ltp), regular_font, TEXT_COLOUR),
+                (
+                    f"{sgb.maturity_date.day} {sgb.maturity_date.strftime('%B %Y')}",
+                    regular_font,
+                    TEXT_COLOUR,
+                ),
+                (str(sgb.xirr), regular_font, TEXT_COLOUR),
+            ]
+        )
+
+    def text_size(text: str, font: "FreeTypeFont | ImageFont") -> tuple[int, int]:
+        left, top, right, bottom = font.getbbox(text)
+        return int(right - left), int(bottom - top)
+
+    line_height = max(text_size("Ag₹", regular_font)[1], text_size("Ag₹", bold_font)[1])
+    row_height = line_height + 2 * pad_y + border
+
+    column_widths = [
+        max(text_size(row[i][0], row[i][1])[0] for row in rows) + 2 * pad_x
+        for i in range(len(HEADERS))
+    ]
+
+    # The last row has the gold price spanning the first 3 columns and the date in the 4th, both bold and centered
+    gold_price_text = f"Gold price: ₹{gold_price}"
+    date_text = str(dt.date())
+    spanned_width = sum(column_widths[:3]) + 2 * border
+    spanned_width = max(
+        spanned_width, text_size(gold_price_text, bold_font)[0] + 2 * pad_x
+    )
+    column_widths[3] = max(
+        column_widths[3], text_size(date_text, bold_font)[0] + 2 * pad_x
+    )
+    # Give any extra width needed by the spanned cell to the first column
+    column_widths[0] += spanned_width - (sum(column_widths[:3]) + 2 * border)
+
+    table_width = sum(column_widths) + (len(column_widths) + 1) * border
+    caption_height = line_height + 2 * pad_y
+    table_height = row_height * (len(rows) + 1) + border
+
+    image = Image.new("RGB", (table_width, caption_height + table_height), "white")
+    draw = ImageDraw.Draw(image)
+
+    def draw_text(
+        x: int, y: int, text: str, font: "FreeTypeFont | ImageFont", colour: str
+    ) -> None:
+        # Offset by the bounding box so every cell's text sits on the same baseline
+        left, top, _, _ = font.getbbox("Ag₹")
+        draw.text((x - left, y - top), text, font=font, fill=colour)
+
+    draw_text(
+        (table_width - text_size(CAPTION, regular_font)[0]) // 2,
+        pad_y,
+        CAPTION,
+        regular_font,
+        TEXT_COLOUR,
+    )
+
+    y = caption_height
+    for row in rows:
+        x = 0
+        for (text, font, colour), width in zip(row, column_widths):
+            draw.rectangle(
+                (x, y, x + width + 2 * border - 1, y + row_height + border - 1),
+                outline=TEXT_COLOUR,
+                width=border,
+            )
+            draw_text(x + border + pad_x, y + border + pad_y, text, font, colour)
+            x += width + border
+        y += row_height
+
+    last_row = (
+        (gold_price_text, spanned_width),
+        (date_text, column_widths[3]),
+    )
+    x = 0
+    for text, width in last_row:
+        draw.rectangle(
+            (x, y, x + width + 2 * border - 1, y + row_height + border - 1),
+            outline=TEXT_COLOUR,
+            width=border,
+        )
+        draw_text(
+            x + border + (width - text_size(text, bold_font)[0]) // 2,
+            y + border + pad_y,
+            text,
+            bold_font,
+            TEXT_COLOUR,
+        )
+        x += width + border
+
+    output = BytesIO()
+    # The table only has black, red and their anti-aliased edges on white, so a small palette looks the same and is several times cheaper to encode and upload than RGB
+    image.quantize(PALETTE_COLOURS, method=Image.Quantize.FASTOCTREE).save(
+        output, format="PNG"
+    )
+    return output.getvalue()
@@ -2,31 +2,56 @@
 Send messages and files using the Telegram API
 """
 
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from hashlib import sha256
+from json import JSONDecodeError
 from json import dumps as json_dumps
 from json import loads as json_loads
 from os import getenv
 from pathlib import Path
+from time import perf_counter, time
+from threading import Lock
+from typing import Any, Collection, Optional
 
-from playwright.sync_api import sync_playwright
-from requests import get as r_get
-from requests import post as r_post
-
-from ..data import get_price_of_gold
+from ..config import Config, get_config
 from ..logg import logger
-from ..models import SGB
-from .common import get_ist_time, get_temp_file_path, write_html_output
-
-TELEGRAM_BOT_TOKEN_ENV = "SGB_TELEGRAM_BOT_TOKEN"
-TELEGRAM_BOT_TOKEN = getenv(TELEGRAM_BOT_TOKEN_ENV, "")
-"""Telegram bot token. Get it from [BotFather](https://t.me/BotFather) on Telegram"""
-
+from ..metrics import span
+from ..models import Results
+from .common import (
+    get_json_representation as get_json_representation,
+    get_telegram_caption as get_telegram_caption,
+    tmp_folder,
+    write_html_output,
+)
+from .artifact_store import atomic_write, store_artifact
+from .dedup import read_delivery_state, update_delivery_state
+from .render import Artifacts, render_for_subscribers
+from .telegram_client import TelegramClient
+
+TELEGRAM_VALIDATION_CACHE_PATH: Path = Path(
+    getenv(
+        "SGB_TELEGRAM_VALIDATION_CACHE_PATH",
+        str(tmp_folder / "telegram_validation_cache.json"),
+    )
+)
+"""File where successful validations of the bot token and chat IDs are cached between runs"""
 
-TELEGRAM_CHAT_IDS: list[str] = getenv("SGB_TELEGRAM_CHAT_IDS", "").split(",")
-"""Unique identifier for the target chat or username of the target channel (in the format @channelusername)"""
+TELEGRAM_VALIDATION_TTL: int = int(getenv("SGB_TELEGRAM_VALIDATION_TTL", "86400") or 0)
+"""Seconds for which a cached validation is trusted. Set it to 0 to disable the cache"""
 
+TELEGRAM_FORCE_REVALIDATION: bool = (
+    getenv("SGB_TELEGRAM_FORCE_REVALIDATION", "false").casefold() == "true"
+)
+"""Ignore cached validations and check the bot token and every chat ID again"""
 
-API_URL = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}"
-"""The API URL to use, pre-configured with the bot token"""
+TELEGRAM_RENDERER_ENV: str = "SGB_TELEGRAM_RENDERER"
+NATIVE_RENDERER: str = "native"
+PLAYWRIGHT_RENDERER: str = "playwright"
+TELEGRAM_RENDERER: str = (
+    getenv(TELEGRAM_RENDERER_ENV, NATIVE_RENDERER).casefold() or NATIVE_RENDERER
+)
+"""How the table image is rendered. "native" draws it in-process and falls back to "playwright", which screenshots the HTML in Firefox"""
 
 RESERVED_CHARACTERS = {
     "_",
@@ -50,14 +75,191 @@ RESERVED_CHARACTERS = {
 }
 # Characters that must be escaped before using it in a MarkdownV2 style message - https://core.telegram.org/bots/api#markdownv2-style
 
+RESERVED_CHARACTERS_TABLE: dict[int, str] = str.maketrans(
+    {char: f"\\{char}" for char in RESERVED_CHARACTERS}
+)
+"""Maps every reserved character to its escaped form, so a message is escaped in a single pass"""
+
+MAX_REMEMBERED_UPLOADS: int = 64
+"""File IDs of at most these many distinct outputs are kept for reuse"""
+
+_delivery_state_lock = Lock()
+
+MIME_TYPES: dict[str, str] = {
+    ".png": "image/png",
+    ".json": "application/json",
+}
+"""Only these types of files are sent on Telegram"""
+
+
+class TelegramDocument:
+    """A file held in memory, to be sent as a document on Telegram"""
+
+    __slots__ = {"file_name", "content", "mime_type", "caption"}
+
+    def __init__(
+        self, file_name: str, content: bytes, mime_type: str, caption: str = ""
+    ) -> None:
+        """
+        Initialize a document
+
+        Parameters
+        ----------
+        file_name : str
+            Name of the file shown on Telegram
+        content : bytes
+            Contents of the file
+        mime_type : str
+            MIME type of the file
+        caption : str
+            Caption shown with the file, in MarkdownV2. Defaults to no caption
+
+        Returns
+        -------
+        TelegramDocument object
+
+        Examples
+        --------
+        >>> TelegramDocument("output.json", b"{}", "application/json")
+        TelegramDocument_Object
+        """
+        self.file_name = file_name
+        self.content = content
+        self.mime_type = mime_type
+        self.caption = caption
+
+    @classmethod
+    def from_path(cls, file: Path, caption: str = "") -> "TelegramDocument":
+        """Reads a PNG or JSON file into a document, closing the file once read"""
+        if file.suffix not in MIME_TYPES:
+            msg = f'Only json and png files are allowed. "{file.suffix}" format not allowed.'
+            logger.error(msg)
+            raise ValueError(msg)
+        return cls(file.name, file.read_bytes(), MIME_TYPES[file.suffix], caption)
+
 
-def test_bot_status() -> bool:
+def get_telegram_client(config: Optional[Config] = None) -> TelegramClient:
     """
-    Tests if the bot is properly configured and can authenticate with the Telegram bot server by calling the `getMe` method
+    Returns the client shared by every Telegram call in this process for the config's bot, so connections to the Bot API are kept alive between calls
+
+    Parameters
+    ----------
+    config : Optional[Config]
+        The config with the bot token. Defaults to `get_config()`
+
+    Returns
+    -------
+    TelegramClient
+        The client, configured with the bot token
+
+    Examples
+    --------
+    >>> get_telegram_client()
+    TelegramClient_Object
+    """
+    config = config or get_config()
+    return _get_telegram_client(config.telegram_bot_token, config.telegram_api_base_url)
+
+
+@lru_cache(maxsize=None)
+def _get_telegram_client(bot_token: str, base_url: str) -> TelegramClient:
+    return TelegramClient(bot_token, base_url)
+
+
+def get_validation_cache_key(
+    chat_id: Optional[str] = None, config: Optional[Config] = None
+) -> str:
+    """
+    Returns the key a validation is cached under. The bot token is hashed into the key so that the cache never stores it, and changing the token invalidates every entry.
+
+    Parameters
+    ----------
+    chat_id : Optional[str]
+        The chat ID that was validated. `None` for the bot itself
+    config : Optional[Config]
+        The config with the bot token. Defaults to `get_config()`
+
+    Returns
+    -------
+    str
+        SHA-256 hex digest of the token and chat ID
+
+    Examples
+    --------
+    >>> get_validation_cache_key("@sgb_advisor")
+    "9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08"
+    """
+    bot_token = (config or get_config()).telegram_bot_token
+    return sha256(f"{bot_token}:{chat_id or 'getMe'}".encode()).hexdigest()
+
+
+def read_validation_cache() -> dict[str, float]:
+    """
+    Reads the validations cached by previous runs, dropping the ones older than SGB_TELEGRAM_VALIDATION_TTL
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    dict[str, float]
+        Maps the key from `get_validation_cache_key()` to the UNIX time it was validated at
+
+    Examples
+    --------
+    >>> read_validation_cache()
+    {"9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08": 1730403483.2583637}
+    """
+    try:
+        cache: dict[str, float] = json_loads(
+            TELEGRAM_VALIDATION_CACHE_PATH.read_text(encoding="utf-8")
+        )
+    except (OSError, JSONDecodeError):
+        return dict()
+
+    now = time()
+    return {
+        key: validated_at
+        for key, validated_at in cache.items()
+        if now - validated_at < TELEGRAM_VALIDATION_TTL
+    }
+
+
+def write_validation_cache(cache: dict[str, float]) -> None:
+    """
+    Writes the validation cache atomically, so a concurrent run never reads a half written file
 
     Parameters
     ----------
+    cache : dict[str, float]
+        Maps the key from `get_validation_cache_key()` to the UNIX time it was validated at
+
+    Returns
+    -------
+    None
+
+    Examples
+    --------
+    >>> write_validation_cache({"9f86d08...": 1730403483.2583637})
     None
+    """
+    try:
+        TELEGRAM_VALIDATION_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        atomic_write(TELEGRAM_VALIDATION_CACHE_PATH, json_dumps(cache).encode())
+    except OSError as e:
+        # Not being able to cache only means validating again next time
+        logger.warning(f"could not write telegram validation cache - {e}")
+
+
+def test_bot_status(config: Optional[Config] = None) -> bool:
+    """
+    Tests if the bot is properly configured and can authenticate with the Telegram bot server by calling the `getMe` method
+
+    Parameters
+    ----------
+    config : Optional[Config]
+        The config with the bot token. Defaults to `get_config()`
 
     Returns
     -------
@@ -71,11 +273,12 @@ def test_bot_status() -> bool:
     """
     API_METHOD = "getMe"
 
-    response = json_loads(r_get(f"{API_URL}/{API_METHOD}").text)
+    response, _ = get_telegram_client(config).call(API_METHOD)
 
     if response["ok"]:
         logger.debug(
-            f'telegram bot is be authenticated and running at "@{response["result"]["username"]}"'
+            'telegram bot is be authenticated and running at "@{}"',
+            response["result"]["username"],
         )
         return True
 
@@ -85,19 +288,23 @@ def test_bot_status() -> bool:
     return False
 
 
-def check_chat_ids(chat_ids: list[str] = TELEGRAM_CHAT_IDS) -> bool:
+def check_chat_ids(
+    chat_ids: Optional[list[str]] = None, config: Optional[Config] = None
+) -> bool:
     """
-    Checks if the chat ID given is valid.
+    Checks if the chat IDs given are valid. All chat IDs are checked concurrently.
 
     Parameters
     ----------
-    chat_ids : list[str]
-        Unique identifier for the target chat or username of the target channel (in the format @channelusername)
+    chat_ids : Optional[list[str]]
+        Unique identifier for the target chat or username of the target channel (in the format @channelusername). Defaults to the chat IDs of the config
+    config : Optional[Config]
+        The config with the bot token. Defaults to `get_config()`
 
     Returns
     -------
     bool
-        If the API returns it as a valid chat ID
+        If the API returns every one of them as a valid chat ID
 
     Examples
     --------
@@ -108,33 +315,77 @@ def check_chat_ids(chat_ids: list[str] = TELEGRAM_CHAT_IDS) -> bool:
     ... )
     True
     """
+    config = config or get_config()
+    chat_ids = list(config.telegram_chat_ids) if chat_ids is None else chat_ids
+    return all(check_chat_ids_individually(chat_ids, config).values())
+
+
+def check_chat_ids_individually(
+    chat_ids: list[str], config: Optional[Config] = None
+) -> dict[str, bool]:
+    """
+    Checks if each of the chat IDs given is valid, concurrently.
+
+    Parameters
+    ----------
+    chat_ids : list[str]
+        Unique identifier for the target chat or username of the target channel (in the format @channelusername)
+    config : Optional[Config]
+        The config with the bot token. Defaults to `get_config()`
+
+    Returns
+    -------
+    dict[str, bool]
+        Whether the API returns each chat ID as valid
+
+    Examples
+    --------
+    >>> check_chat_ids_individually(["1234567", "@sgb_advisor"])
+    {"1234567": True, "@sgb_advisor": True}
+    """
     API_METHOD = "getChat"
 
-    success = True
+    client = get_telegram_client(config)
 
-    for chat_id in chat_ids:
-        response = json_loads(r_get(f"{API_URL}/{API_METHOD}?chat_id={chat_id}").text)
+    def check(chat_id: str) -> bool:
+        response: dict[str, Any]
+        response, _ = client.call(API_METHOD, {"chat_id": chat_id})
 
         if not response["ok"]:
-            success = False
             logger.error(
                 f"could not find chat corresponding to chat_id - {chat_id}. Error - {response['description']}"
             )
-        else:
-            logger.debug(
-                f'chat ID {chat_id} is valid and corresponds to username "@{response["result"]["username"]}".'
-            )
+            return False
 
-    return success
+        logger.debug(
+            'chat ID {} is valid and corresponds to username "@{}".',
+            chat_id,
+            response["result"].get("username"),
+        )
+        return True
+
+    if not chat_ids:
+        return dict()
 
+    with ThreadPoolExecutor(
+        max_workers=min(client.max_workers, len(chat_ids)),
+        thread_name_prefix="telegram",
+    ) as executor:
+        return dict(zip(chat_ids, executor.map(check, chat_ids)))
 
-def validate_telegram_envs() -> bool:
+
+def validate_telegram_envs(
+    force: bool = TELEGRAM_FORCE_REVALIDATION, config: Optional[Config] = None
+) -> bool:
     """
-    Checks whether the env variables required for sending a message are both present and valid.
+    Checks whether the bot token and chat IDs required for sending a message are both present and valid. Successful validations are cached for SGB_TELEGRAM_VALIDATION_TTL seconds, so only new or expired chat IDs are checked again.
 
     Parameters
     ----------
-    None
+    force : bool
+        Ignore the cache and check the bot token and every chat ID again. Defaults to SGB_TELEGRAM_FORCE_REVALIDATION
+    config : Optional[Config]
+        The config with the bot token and chat IDs. Defaults to `get_config()`
 
     Returns
     -------
@@ -146,7 +397,40 @@ def validate_telegram_envs() -> bool:
     >>> validate_telegram_envs()
     True
     """
-    return test_bot_status() and check_chat_ids()
+    config = config or get_config()
+    if not config.telegram_bot_token or not config.telegram_chat_ids:
+        logger.error("telegram bot token or chat IDs are not set")
+        return False
+
+    cache: dict[str, float] = dict() if force else read_validation_cache()
+    now = time()
+
+    bot_key = get_validation_cache_key(config=config)
+    if bot_key not in cache:
+        if not test_bot_status(config):
+            return False
+        cache[bot_key] = now
+
+    chat_ids_to_check = [
+        chat_id
+        for chat_id in config.telegram_chat_ids
+        if get_validation_cache_key(chat_id, config) not in cache
+    ]
+    logger.debug(
+        "validating {} of {} chat ID(s), rest are cached",
+        len(chat_ids_to_check),
+        len(config.telegram_chat_ids),
+    )
+
+    results = check_chat_ids_individually(chat_ids_to_check, config)
+    for chat_id, valid in results.items():
+        if valid:
+            cache[get_validation_cache_key(chat_id, config)] = now
+
+    if TELEGRAM_VALIDATION_TTL > 0:
+        write_validation_cache(cache)
+
+    return all(results.values())
 
 
 def escape_reserved_characters(msg: str) -> str:
@@ -168,50 +452,204 @@ def escape_reserved_characters(msg: str) -> str:
     >>> escape_reserved_characters("test.")
     "test\\."
     """
-    for char in RESERVED_CHARACTERS:
-        msg = msg.replace(char, f"\\{char}", -1)
-    return msg
+    return msg.translate(RESERVED_CHARACTERS_TABLE)
 
 
 def create_and_send_message(
-    sgbs: list[SGB],
-    chat_ids: list[str] = TELEGRAM_CHAT_IDS,
-) -> None:
+    artifacts: Artifacts,
+    chat_ids: Optional[list[str]] = None,
+    config: Optional[Config] = None,
+) -> bool:
     """
-    Creates a message with the given SGB list and sends it on Telegram
+    Creates a message from the rendered artifacts and sends it on Telegram
 
     Parameters
     ----------
-    sgb_list : list[SGB]
-        The list of SGBs to include in the message
-    chat_ids : list[SGB]
-        List of unique identifiers for the target chat or username of the target channel (in the format @channelusername)
+    artifacts : Artifacts
+        The artifacts rendered for this run
+    chat_ids : Optional[list[str]]
+        List of unique identifiers for the target chat or username of the target channel (in the format @channelusername). Defaults to the chat IDs of the config
+    config : Optional[Config]
+        The config with the bot token. Defaults to `get_config()`
 
     Returns
     -------
-    None
+    bool
+        If the message was sent to every chat
 
     Examples
     --------
     >>> create_and_send_message(
-    ...     sgbs,
+    ...     artifacts,
     ...     [
     ...         123456789,
     ...     ],
     ... )
-    None
+    True
     """
 
-    photo_path: Path = generate_screenshot_of_html(sgbs)
-    caption: str = get_telegram_caption(sgbs)
-    send_message_with_files(
-        files=[photo_path, get_json_file(sgbs)],
-        photo_captions=[caption, ""],
-        chat_ids=chat_ids,
+    config = config or get_config()
+    caption = escape_reserved_characters(artifacts.caption)
+    remaining_chat_ids = list(
+        config.telegram_chat_ids if chat_ids is None else chat_ids
+    )
+
+    file_ids = get_reusable_file_ids(artifacts.content_hash, config)
+    if file_ids:
+        logger.info(
+            "results haven't changed since they were last uploaded, reusing the telegram file IDs instead of rendering again"
+        )
+        # The contents are never read when file IDs are given
+        remaining_chat_ids, _ = deliver_documents(
+            [
+                TelegramDocument("", b"", MIME_TYPES[".png"], caption),
+                TelegramDocument("", b"", MIME_TYPES[".json"]),
+            ],
+            remaining_chat_ids,
+            file_ids,
+            config,
+        )
+        if not remaining_chat_ids:
+            return True
+        logger.warning(
+            f"could not reuse file IDs for {len(remaining_chat_ids)} chat(s), uploading again"
+        )
+
+    png = render_table_image(artifacts)
+    photo_path = store_artifact(png, "png")
+    logger.info(f"saved table image to {photo_path}")
+
+    json_path = get_json_file(artifacts.json)
+
+    failed_chat_ids, file_ids = deliver_documents(
+        [
+            TelegramDocument(photo_path.name, png, MIME_TYPES[".png"], caption),
+            TelegramDocument(
+                json_path.name, artifacts.json.encode(), MIME_TYPES[".json"]
+            ),
+        ],
+        remaining_chat_ids,
+        config=config,
     )
 
+    if file_ids:
+        remember_file_ids(artifacts.content_hash, file_ids, config)
+    return not failed_chat_ids
+
+
+def send_to_subscribers(
+    artifacts: Artifacts,
+    chat_ids: Optional[list[str]] = None,
+    config: Optional[Config] = None,
+) -> bool:
+    """
+    Sends every chat its own output, according to its profile. Chats that see the same output share one upload.
+
+    Parameters
+    ----------
+    artifacts : Artifacts
+        The artifacts rendered for this run with the default profile
+    chat_ids : Optional[list[str]]
+        List of unique identifiers for the target chat or username of the target channel (in the format @channelusername). Defaults to the chat IDs of the config
+    config : Optional[Config]
+        The config with the bot token, chat IDs and profiles. Defaults to `get_config()`
+
+    Returns
+    -------
+    bool
+        If every chat was sent its output
+
+    Examples
+    --------
+    >>> send_to_subscribers(artifacts)
+    True
+    """
+    config = config or get_config()
+    chat_ids = list(config.telegram_chat_ids) if chat_ids is None else chat_ids
+
+    success = True
+    for output, output_chat_ids in render_for_subscribers(artifacts, chat_ids, config):
+        success = create_and_send_message(output, output_chat_ids, config) and success
+    return success
+
+
+def get_reusable_file_ids(
+    content_hash: str, config: Optional[Config] = None
+) -> list[str]:
+    """
+    Returns the file IDs of the documents uploaded by a previous run, if they were rendered from results with the same hash and uploaded by the same bot
+
+    Parameters
+    ----------
+    content_hash : str
+        The hash from `get_content_hash()`
+    config : Optional[Config]
+        The config with the bot token. Defaults to `get_config()`
+
+    Returns
+    -------
+    list[str]
+        The file IDs of the table image and the JSON. Empty if they can't be reused
+
+    Examples
+    --------
+    >>> get_reusable_file_ids(artifacts.content_hash)
+    ["BQACAgUAAxkDAAI...", "BQACAgUAAxkDAAJ..."]
+    """
+    uploaded = read_delivery_state().get("telegram", dict())
+    remembered = uploaded.get("file_ids")
+    if uploaded.get("bot") != get_validation_cache_key(config=config) or not isinstance(
+        remembered, dict
+    ):
+        return list()
+    return list(remembered.get(content_hash, list()))
+
+
+def remember_file_ids(
+    content_hash: str, file_ids: list[str], config: Optional[Config] = None
+) -> None:
+    """
+    Saves the file IDs of uploaded documents, so later runs with the same output can send them again without rendering or uploading. Only the most recent MAX_REMEMBERED_UPLOADS outputs are kept.
+
+    Parameters
+    ----------
+    content_hash : str
+        The hash from `get_content_hash()` of the output that was uploaded
+    file_ids : list[str]
+        The file IDs Telegram returned
+    config : Optional[Config]
+        The config with the bot token. Defaults to `get_config()`
+
+    Returns
+    -------
+    None
+
+    Examples
+    --------
+    >>> remember_file_ids(artifacts.content_hash, ["BQACAgUAAxkDAAI...", "BQACAgUAAxkDAAJ..."])
+    None
+    """
+    with _delivery_state_lock:
+        bot = get_validation_cache_key(config=config)
+        uploaded = read_delivery_state().get("telegram", dict())
+        remembered: dict[str, list[str]] = (
+            uploaded.get("file_ids", dict()) if uploaded.get("bot") == bot else dict()
+        )
+        if not isinstance(remembered, dict):
+            remembered = dict()
+
+        remembered.pop(content_hash, None)
+        remembered[content_hash] = file_ids
+        remembered = dict(list(remembered.items())[-MAX_REMEMBERED_UPLOADS:])
+
+        update_delivery_state(telegram={"bot": bot, "file_ids": remembered})
 
-def send_message(message_content: str, chat_ids: list[str] = TELEGRAM_CHAT_IDS) -> bool:
+
+def send_message(
+    message_content: str,
+    chat_ids: Optional[list[str]] = None,
+    config: Optional[Config] = None,
+) -> bool:
     """
     Sends a message on Telegram with the given content and chat ID.
 
@@ -220,8 +658,10 @@ def send_message(message_content: str, chat_ids: list[str] = TELEGRAM_CHAT_IDS)
     ----------
     message_content : str
         The content of the message to be sent
-    chat_ids : list[str]
-        Unique identifier for the target chat or username of the target channel (in the format @channelusername)
+    chat_ids : Optional[list[str]]
+        Unique identifier for the target chat or username of the target channel (in the format @channelusername). Defaults to the chat IDs of the config
+    config : Optional[Config]
+        The config with the bot token. Defaults to `get_config()`
 
     Returns
     -------
@@ -238,28 +678,17 @@ def send_message(message_content: str, chat_ids: list[str] = TELEGRAM_CHAT_IDS)
 
     API_METHOD = "sendMessage"
 
-    message_content = escape_reserved_characters(message_content)
-
-    success = True
-    for chat_id in chat_ids:
-        request_body = {
-            "text": message_content,
-            "chat_id": chat_id,
-            "parse_mode": "MarkdownV2",
-        }
-
-        response = json_loads(r_post(f"{API_URL}/{API_METHOD}", data=request_body).text)
-
-        if not response["ok"]:
-            logger.error(
-                f"could not sent message to {chat_id}. Error - {response['description']}"
-            )
-            success = False
+    config = config or get_config()
+    chat_ids = list(config.telegram_chat_ids) if chat_ids is None else chat_ids
+    request_body = {
+        "text": escape_reserved_characters(message_content),
+        "parse_mode": "MarkdownV2",
+    }
 
-        else:
-            logger.debug(
-                f"succesfully sent message to @{response['result']['chat']['username']} with message_id {response['result']['message_id']}"
-            )
+    results = get_telegram_client(config).fan_out(
+        API_METHOD, chat_ids, lambda _: (request_body, None)
+    )
+    success = all(result.ok for result in results)
 
     if not success:
         logger.warning("could not send message to all chat IDs")
@@ -268,206 +697,306 @@ def send_message(message_content: str, chat_ids: list[str] = TELEGRAM_CHAT_IDS)
     return success
 
 
-def send_message_with_files(
-    files: list[Path],
-    photo_captions: list[str] | str,
-    chat_ids: list[str] = TELEGRAM_CHAT_IDS,
-) -> None:
+def send_documents(
+    documents: list[TelegramDocument],
+    chat_ids: Optional[list[str]] = None,
+    config: Optional[Config] = None,
+) -> bool:
     """
-    Sends a message with a photo on Telegram
+    Sends documents to every chat. Look at `deliver_documents()`
 
     Parameters
     ----------
-    files : list[Path]
-        The files to send to every chat_id. Sent as individual messages
-    photo_captions : list[str]
-        The captions for every file. If the length of the captions list is not the same as the length of the files list, then the first caption is used for every file
-    chat_ids : list[str]
-        List of unique identifiers for the target chat or username of the target channel (in the format @channelusername)
-
+    documents : list[TelegramDocument]
+        The documents to send, with their captions already escaped
+    chat_ids : Optional[list[str]]
+        List of unique identifiers for the target chat or username of the target channel (in the format @channelusername). Defaults to the chat IDs of the config
+    config : Optional[Config]
+        The config with the bot token. Defaults to `get_config()`
 
     Returns
     -------
-    None
+    bool
+        If the documents were sent to every chat
 
     Examples
     --------
-    >>> send_message_with_photo(
-    ...     sgbs,
-    ...     "telegram.png",
-    ...     123456789,
+    >>> send_documents(
+    ...     [TelegramDocument("output.json", b"{}", "application/json")],
+    ...     ["123456789"],
     ... )
-    None
+    True
     """
+    config = config or get_config()
+    failed_chat_ids, _ = deliver_documents(
+        documents,
+        list(config.telegram_chat_ids) if chat_ids is None else chat_ids,
+        config=config,
+    )
+    return not failed_chat_ids
 
-    # Sending as document to preserve quality
-    API_METHOD = "sendDocument"
 
-    success = True
+def deliver_documents(
+    documents: list[TelegramDocument],
+    chat_ids: list[str],
+    file_ids: Optional[list[str]] = None,
+    config: Optional[Config] = None,
+) -> tuple[list[str], list[str]]:
+    """
+    Sends documents to every chat. 2 to 10 documents are sent together as one media group per chat, a single document is sent on its own. The bytes are uploaded only once, and the file IDs Telegram returns are sent to every other chat.
 
-    if len(photo_captions) != len(files):
-        photo_captions = [photo_captions[0] * len(files)]
+    Parameters
+    ----------
+    documents : list[TelegramDocument]
+        The documents to send, with their captions already escaped
+    chat_ids : list[str]
+        List of unique identifiers for the target chat or username of the target channel (in the format @channelusername)
+    file_ids : Optional[list[str]]
+        File IDs of the documents, if they have already been uploaded. Nothing is uploaded when these are given
+    config : Optional[Config]
+        The config with the bot token. Defaults to `get_config()`
 
-    for file, caption in zip(files, photo_captions):
-        caption = escape_reserved_characters(caption)
-        file_id = ""
-        if file.suffix not in [".png", ".json"]:
-            msg = f'Only json and png files are allowed. "{file.suffix}" format not allowed.'
-            logger.error(msg)
-            raise ValueError(msg)
+    Returns
+    -------
+    tuple[list[str], list[str]]
+        The chats the documents could not be sent to, and the file IDs of the documents (empty if they could not be uploaded)
 
-        file_mime_type: str = "application/octet-stream"
+    Examples
+    --------
+    >>> deliver_documents(
+    ...     [TelegramDocument("output.json", b"{}", "application/json")],
+    ...     ["123456789", "@sgb_advisor"],
+    ... )
+    ([], ["BQACAgUAAxkDAAI..."])
+    """
+    if not 1 <= len(documents) <= 10:
+        msg = f"can only send 1 to 10 documents at once, got {len(documents)}"
+        logger.error(msg)
+        raise ValueError(msg)
 
-        if file.suffix == ".png":
-            file_mime_type = "image/png"
-        elif file.suffix == ".json":
-            file_mime_type = "application/json"
+    client = get_telegram_client(config)
+    is_media_group = len(documents) > 1
 
-        for chat_id in chat_ids:
-            request_body = {
-                "caption": caption,
-                "chat_id": chat_id,
+    # Sending as document to preserve quality
+    API_METHOD = "sendMediaGroup" if is_media_group else "sendDocument"
+
+    def build_request(
+        file_ids: Optional[list[str]],
+    ) -> tuple[dict[str, Any], Optional[dict[str, Any]]]:
+        """Request that uploads the documents if file_ids is None, else reuses the uploaded ones"""
+        files = (
+            None
+            if file_ids
+            else {
+                f"document{i}": (
+                    document.file_name,
+                    document.content,
+                    document.mime_type,
+                )
+                for i, document in enumerate(documents)
+            }
+        )
+        media = [
+            file_ids[i] if file_ids else f"attach://document{i}"
+            for i in range(len(documents))
+        ]
+
+        if not is_media_group:
+            data = {
+                "caption": documents[0].caption,
                 "parse_mode": "MarkdownV2",
+                "document": media[0],
             }
+            if files:
+                data.pop("document")
+                files = {"document": files["document0"]}
+            return data, files
+
+        data = {
+            "media": json_dumps(
+                [
+                    {
+                        "type": "document",
+                        "media": media[i],
+                        "caption": document.caption,
+                        "parse_mode": "MarkdownV2",
+                    }
+                    for i, document in enumerate(documents)
+                ]
+            )
+        }
+        return data, files
+
+    def get_file_ids(response: dict[str, Any]) -> list[str]:
+        messages = response["result"] if is_media_group else [response["result"]]
+        return [message["document"]["file_id"] for message in messages]
+
+    failed_chat_ids: list[str] = list()
+    file_ids = list(file_ids or list())
+    remaining_chat_ids = list(chat_ids)
+
+    # Upload to the first chat that accepts it
+    while remaining_chat_ids and not file_ids:
+        chat_id = remaining_chat_ids.pop(0)
+        data, files = build_request(None)
+        result = client.send(API_METHOD, chat_id, data, files)
+        if result.ok:
+            file_ids = get_file_ids(result.response)
+        else:
+            failed_chat_ids.append(chat_id)
 
-            if not file_id:
-                document = (
-                    file.stem + file.suffix,
-                    open(file, "rb"),
-                    file_mime_type,
-                    {"Expires": "0"},
-                )
-
-                response = json_loads(
-                    r_post(
-                        f"{API_URL}/{API_METHOD}",
-                        data=request_body,
-                        files={"document": document},
-                    ).text
-                )
-            else:
-                request_body["document"] = file_id
-
-                response = json_loads(
-                    r_post(
-                        f"{API_URL}/{API_METHOD}",
-                        data=request_body,
-                    ).text
-                )
-
-            if not response["ok"]:
-                logger.error(
-                    f"could not sent message to {chat_id}. Error - {response['description']}"
-                )
-                success = False
-
-            else:
-                logger.debug(
-                    f"succesfully sent message to @{response['result']['chat']['username']} with message_id {response['result']['message_id']}"
-                )
-                if not file_id:
-                    file_id = response["result"]["document"]["file_id"]
+    data, _ = build_request(file_ids)
+    results = client.fan_out(API_METHOD, remaining_chat_ids, lambda _: (data, None))
+    failed_chat_ids.extend(result.chat_id for result in results if not result.ok)
 
-    if not success:
+    if failed_chat_ids:
         logger.warning("could not send message to all chat IDs")
     else:
         logger.info("message sent to all chat IDs")
+    return failed_chat_ids, file_ids
 
 
-def generate_screenshot_of_html(sgbs: list[SGB]) -> Path:
+def render_table_image(artifacts: Artifacts) -> bytes:
     """
-    Given a list of SGBs, generates a screnshot of an HTML page showing their returns using the [playwright](https://playwright.dev/python/) library.
+    Renders an image of the table showing the returns of the SGBs. Uses the renderer set in SGB_TELEGRAM_RENDERER, falling back to `screenshot_html_table()` if the native renderer fails.
 
     Parameters
     ----------
-    sgbs: list[SGB]
-        List of SGBs
+    artifacts : Artifacts
+        The artifacts rendered for this run
 
     Returns
     -------
-    Path
-        Screenshot path
+    bytes
+        The PNG image
 
     Examples
     --------
-    >>> generate_screenshot_of_html(sgbs)
-    Path("E:\\Code\\sgb_advisor\\tmp\\1730403483.2583637-9432.png")
+    >>> render_table_image(artifacts)
+    b"\\x89PNG\\r\\n\\x1a\\n..."
     """
+    start = perf_counter()
+
+    png: Optional[bytes] = None
+    renderer = TELEGRAM_RENDERER
+
+    if TELEGRAM_RENDERER != PLAYWRIGHT_RENDERER:
+        try:
+            with span("render.table_image", renderer=NATIVE_RENDERER):
+                png = render_native_table_image(artifacts.results, artifacts.held_sgbs)
+        except Exception as e:
+            # Pillow not being installed, or missing fonts should still let the message go out
+            logger.warning(
+                f"could not render table image natively, falling back to {PLAYWRIGHT_RENDERER} - {e}"
+            )
 
-    html_file_path = write_html_output(sgbs)
+    if not png:
+        renderer = PLAYWRIGHT_RENDERER
+        with span("render.table_image", renderer=PLAYWRIGHT_RENDERER):
+            png = screenshot_html_table(artifacts.html)
+
+    logger.info(
+        f"rendered table image using {renderer} renderer in {(perf_counter() - start) * 1000:.0f} ms"
+    )
+    return png
 
-    with sync_playwright() as p:
-        browser = p.firefox.launch()
-        page = browser.new_page()
-        page.goto(f"file://{html_file_path}")
 
-        logger.debug(f"taking screenshot of html file at {html_file_path}")
+def render_native_table_image(
+    results: Results, held_sgbs: Optional[Collection[str]] = None
+) -> bytes:
+    """
+    Given the results of a run, draws the table showing the returns of the SGBs in-process.
 
-        photo_path = get_temp_file_path("png")
+    Parameters
+    ----------
+    results : Results
+        The results of the run
+    held_sgbs : Optional[Collection[str]]
+        NSE symbols of the SGBs to highlight. Defaults to the held SGBs of `get_config()`
 
-        page.locator("#sgb-returns-table").screenshot(path=photo_path)
+    Returns
+    -------
+    bytes
+        The PNG image
 
-        logger.info(f"saved screnshot to {photo_path}")
+    Examples
+    --------
+    >>> render_native_table_image(results)
+    b"\\x89PNG\\r\\n\\x1a\\n..."
+    """
+    from .table_image import render_table_png
 
-        return photo_path
+    return render_table_png(
+        list(results.sgbs),
+        results.gold_price,
+        results.generated_at,
+        get_config().held_sgbs if held_sgbs is None else held_sgbs,
+    )
 
 
-def get_telegram_caption(sgbs: list[SGB], n: int = 3) -> str:
+def screenshot_html_table(html: str) -> bytes:
     """
-    Returns a caption for the telegram post
+    Given the HTML page showing the returns of the SGBs, takes a screnshot of its table using the [playwright](https://playwright.dev/python/) library.
 
     Parameters
     ----------
-    sgbs : list[SGB]
-        List of SGBs
-
-    n : int
-        The number of SGGs to generate text for (top n)
+    html : str
+        The HTML from `generate_html_from_template()`
 
     Returns
     -------
-    str
-        Text showing data for top n SGBs
+    bytes
+        The PNG screenshot
 
     Examples
     --------
-    >>> get_top_n_sgbs_text(sgbs, 3)
-    \"\"\"Top 3 SGBs are:\n
-    SGBJUN31I - ₹5926.0 - 0.687%\n
-    SGBAUG28V - ₹5334.0 - 0.558%\n
-    SGBJU29III - ₹4889.0 - 0.556%\"\"\"
+    >>> screenshot_html_table(artifacts.html)
+    b"\\x89PNG\\r\\n\\x1a\\n..."
     """
-    text = "Top 3 SGBs are: "
 
-    for sgb in sgbs[:n]:
-        # Replacing . in XIRR  with \. since . is reserved for some reason in the markdown mode in Telegram API
-        text += f"\n\n`{sgb.nse_symbol}` - ₹{sgb.ltp} - {sgb.xirr}%"
+    html_file_path = write_html_output(html)
+
+    # Only imported when the Playwright renderer is used, since it is slow to import
+    from playwright.sync_api import sync_playwright
 
-    disclaimer_text = "\n[Disclaimers](https://github.com/vishalnandagopal/sgb-advisor/blob/master/README.md#disclaimers)"
+    with sync_playwright() as p:
+        with span("screenshot.browser_launch"):
+            browser = p.firefox.launch()
+            page = browser.new_page()
+        with span("screenshot.goto"):
+            page.goto(f"file://{html_file_path}")
 
-    gold_price_text = f"\nGold price - ₹{get_price_of_gold()}"
+        logger.debug("taking screenshot of html file at {}", html_file_path)
 
-    text += gold_price_text + disclaimer_text
+        with span("screenshot.capture"):
+            png = page.locator("#sgb-returns-table").screenshot()
 
-    return text
+        browser.close()
 
+    return png
 
-def get_json_file(sgbs: list[SGB]) -> Path:
-    json_path = get_temp_file_path("json")
 
-    with open(json_path, "w") as f:
-        f.write(get_json_representation(sgbs))
+def get_json_file(json_str: str) -> Path:
+    """
+    Stores the JSON representation of the results as an output file
 
-    logger.info(f"saved json to {json_path}")
+    Parameters
+    ----------
+    json_str : str
+        The JSON from `get_json_representation()`
 
-    return json_path
+    Returns
+    -------
+    Path
+        The path of the JSON file
+
+    Examples
+    --------
+    >>> get_json_file(artifacts.json)
+    Path("E:/Code/sgb_advisor/tmp/sgb_advisor/2024-11-20 SGB Advisor Output 44136fa355b3678a.json")
+    """
+    json_path = store_artifact(json_str.encode(), "json")
 
+    logger.info(f"saved json to {json_path}")
 
-def get_json_representation(sgbs: list[SGB]) -> str:
-    d = {
-        "time": str(get_ist_time()),
-        "gold_price": get_price_of_gold(),
-        "disclaimer": "https://github.com/vishalnandagopal/sgb-advisor/blob/master/README.md#disclaimers",
-        "sgbs": [sgb.to_dict() for sgb in sgbs],
-    }
-    return json_dumps(d, indent=None)
+    return json_path
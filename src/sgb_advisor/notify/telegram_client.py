@@ -0,0 +1,417 @@
+"""
+Telegram Bot API client that keeps connections alive and sends to many chats concurrently, within Telegram's rate limits
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from os import getenv
+from statistics import median
+from threading import Lock
+from time import monotonic, perf_counter, sleep
+from types import TracebackType
+from typing import Any, Callable, Optional
+
+from requests import ConnectionError as RequestsConnectionError
+from requests import RequestException, Session
+from requests.adapters import HTTPAdapter
+
+from ..logg import logger
+from ..metrics import span
+
+TELEGRAM_MAX_WORKERS_ENV: str = "SGB_TELEGRAM_MAX_WORKERS"
+TELEGRAM_MAX_WORKERS: int = int(getenv(TELEGRAM_MAX_WORKERS_ENV, "8") or 8)
+"""Maximum number of chats sent to at the same time"""
+
+GLOBAL_MESSAGES_PER_SECOND: int = 30
+"""Telegram allows a bot to send ~30 messages per second overall - https://core.telegram.org/bots/faq#my-bot-is-hitting-limits-how-do-i-avoid-this"""
+
+PRIVATE_CHAT_INTERVAL: float = 1.0
+"""Minimum seconds between two messages to the same user"""
+
+GROUP_CHAT_INTERVAL: float = 3.0
+"""Minimum seconds between two messages to the same group or channel, which are limited to 20 messages per minute"""
+
+TELEGRAM_CONNECT_TIMEOUT: float = 10
+"""Seconds to wait for a connection to the Bot API"""
+
+TELEGRAM_READ_TIMEOUT_ENV: str = "SGB_TELEGRAM_READ_TIMEOUT"
+TELEGRAM_READ_TIMEOUT: float = float(getenv(TELEGRAM_READ_TIMEOUT_ENV, "60") or 60)
+"""Seconds to wait for a response, so a stalled connection is retried instead of blocking a worker forever. Long polls like `getUpdates` pass their own"""
+
+MAX_ATTEMPTS: int = 5
+"""Maximum attempts for a single request, when Telegram asks to retry after a while or the connection fails"""
+
+READ_ONLY_METHODS: frozenset[str] = frozenset({"getMe", "getChat", "getUpdates"})
+"""Methods that can be retried after a read timeout or an unreadable response. Anything else, like sendMessage, may have been processed by Telegram already, so it is only retried when it never reached Telegram or Telegram asked for it to be"""
+
+RequestBuilder = Callable[[str], tuple[dict[str, Any], Optional[dict[str, Any]]]]
+"""Given a chat ID, returns the form data and the files (or None) to send to it"""
+
+
+def is_group_chat(chat_id: str) -> bool:
+    """Group and supergroup IDs are negative, and channels are addressed with their @username"""
+    return chat_id.startswith(("-", "@"))
+
+
+class RateLimiter:
+    """
+    Spaces out requests so that the bot stays within Telegram's global and per-chat limits. Every call to `wait()` reserves the next free slot and sleeps until it.
+    """
+
+    __slots__ = {"_lock", "_global_interval", "_next_global_slot", "_next_chat_slot"}
+
+    def __init__(self, messages_per_second: int = GLOBAL_MESSAGES_PER_SECOND) -> None:
+        self._lock = Lock()
+        self._global_interval = 1 / messages_per_second
+        self._next_global_slot: float = 0
+        self._next_chat_slot: dict[str, float] = dict()
+
+    def wait(self, chat_id: Optional[str] = None) -> None:
+        """
+        Blocks until a request to the chat can be sent
+
+        Parameters
+        ----------
+        chat_id : Optional[str]
+            The chat the request is for. Requests which aren't for a chat (like `getMe`) are only globally limited
+
+        Returns
+        -------
+        None
+        """
+        with self._lock:
+            now = monotonic()
+            slot = max(now, self._next_global_slot)
+            if chat_id is not None:
+                slot = max(slot, self._next_chat_slot.get(chat_id, 0))
+                self._next_chat_slot[chat_id] = slot + (
+                    GROUP_CHAT_INTERVAL
+                    if is_group_chat(chat_id)
+                    else PRIVATE_CHAT_INTERVAL
+                )
+            self._next_global_slot = slot + self._global_interval
+
+        if slot > now:
+            sleep(slot - now)
+
+    def back_off(self, seconds: float, chat_id: Optional[str] = None) -> None:
+        """Pushes the next slot of the chat (or every chat, if the chat is not known) by the given seconds, when Telegram asks to retry later"""
+        with self._lock:
+            until = monotonic() + seconds
+            if chat_id is None:
+                self._next_global_slot = max(self._next_global_slot, until)
+            else:
+                self._next_chat_slot[chat_id] = max(
+                    self._next_chat_slot.get(chat_id, 0), until
+                )
+
+
+class DeliveryResult:
+    """Outcome of sending a request to a single chat"""
+
+    __slots__ = {"chat_id", "ok", "response", "latency", "attempts"}
+
+    def __init__(
+        self,
+        chat_id: str,
+        ok: bool,
+        response: dict[str, Any],
+        latency: float,
+        attempts: int,
+    ) -> None:
+        self.chat_id = chat_id
+        """The chat the request was sent to"""
+
+        self.ok = ok
+        """Whether Telegram accepted the request"""
+
+        self.response = response
+        """The decoded JSON response from Telegram"""
+
+        self.latency = latency
+        """Seconds taken to deliver, including time spent waiting for rate limits and retries"""
+
+        self.attempts = attempts
+        """Number of requests made"""
+
+    def __repr__(self) -> str:
+        return f"<DeliveryResult [{self.chat_id} - {'ok' if self.ok else 'failed'} in {self.latency:.3f}s after {self.attempts} attempt(s)]>"
+
+
+class TelegramClient:
+    """
+    A client for the Telegram Bot API. Reuses one keep-alive session for every request and sends to many chats concurrently using a bounded pool of workers.
+    """
+
+    __slots__ = {"api_url", "max_workers", "session", "rate_limiter"}
+
+    def __init__(
+        self,
+        bot_token: str,
+        base_url: str,
+        max_workers: int = TELEGRAM_MAX_WORKERS,
+    ) -> None:
+        """
+        Initialize a Telegram client
+
+        Parameters
+        ----------
+        bot_token : str
+            Telegram bot token
+        base_url : str
+            Base URL of the Bot API, from `Config.telegram_api_base_url`. Can be a local Bot API server or a fake one for testing
+        max_workers : int
+            Maximum number of chats to send to at the same time. Defaults to SGB_TELEGRAM_MAX_WORKERS or 8
+
+        Returns
+        -------
+        TelegramClient object
+
+        Examples
+        --------
+        >>> TelegramClient("123:abc", "http://127.0.0.1:8081")
+        TelegramClient_Object
+        """
+        self.api_url = f"{base_url.rstrip('/')}/bot{bot_token}"
+        """The API URL to use, pre-configured with the bot token"""
+
+        self.max_workers = max(1, max_workers)
+
+        self.session = Session()
+        # One pooled connection per worker, so concurrent sends don't open new TCP/TLS connections
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=self.max_workers, max_retries=0
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self.rate_limiter = RateLimiter()
+
+    def __enter__(self) -> "TelegramClient":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[type[BaseException]],
+        exc: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Closes all pooled connections"""
+        self.session.close()
+
+    def call(
+        self,
+        api_method: str,
+        data: Optional[dict[str, Any]] = None,
+        files: Optional[dict[str, Any]] = None,
+        chat_id: Optional[str] = None,
+        read_timeout: float = TELEGRAM_READ_TIMEOUT,
+    ) -> tuple[dict[str, Any], int]:
+        """
+        Calls a Bot API method, waiting for the rate limits and retrying when Telegram responds with a 429 or a 5xx, or the connection couldn't be made. Read-only methods are also retried after read timeouts.
+
+        Parameters
+        ----------
+        api_method : str
+            The Bot API method, like "sendMessage"
+        data : Optional[dict[str, Any]]
+            Form data to send
+        files : Optional[dict[str, Any]]
+            Files to upload, in the format accepted by `requests`. File objects are rewound before every retry
+        chat_id : Optional[str]
+            The chat the request is for, used for the per-chat rate limit
+        read_timeout : float
+            Seconds to wait for a response before retrying. Defaults to SGB_TELEGRAM_READ_TIMEOUT or 60. Long polls should pass more than the time they ask Telegram to hold the request for
+
+        Returns
+        -------
+        tuple[dict[str, Any], int]
+            The decoded JSON response and the number of attempts made
+
+        Examples
+        --------
+        >>> client.call("getMe")
+        ({"ok": True, "result": {"id": 123, "username": "sgb_advisor_bot"}}, 1)
+        """
+        response: dict[str, Any] = {"ok": False, "description": "not sent"}
+        attempt = 0
+
+        while attempt < MAX_ATTEMPTS:
+            attempt += 1
+            self.rate_limiter.wait(chat_id)
+
+            if files:
+                for file in files.values():
+                    if isinstance(file, tuple) and hasattr(file[1], "seek"):
+                        file[1].seek(0)
+
+            try:
+                with span(
+                    "telegram.request", method=api_method, attempt=attempt
+                ) as request_span:
+                    http_response = self.session.post(
+                        f"{self.api_url}/{api_method}",
+                        data=data,
+                        files=files,
+                        timeout=(TELEGRAM_CONNECT_TIMEOUT, read_timeout),
+                    )
+                    # A proxy in front of Telegram may answer 5xx without JSON
+                    response = (
+                        {
+                            "ok": False,
+                            "error_code": http_response.status_code,
+                            "description": http_response.reason,
+                        }
+                        if http_response.status_code >= 500
+                        else http_response.json()
+                    )
+                    request_span.ok = bool(response.get("ok"))
+                    request_span.error = response.get("description")
+            except (RequestException, ValueError) as e:
+                response = {"ok": False, "description": str(e)}
+                logger.warning(
+                    f"{api_method} request for {chat_id} failed on attempt {attempt} - {e}"
+                )
+                # A connection that was never made can't have posted anything, but a timed out or garbled response may have
+                if not (
+                    isinstance(e, RequestsConnectionError)
+                    or api_method in READ_ONLY_METHODS
+                ):
+                    logger.error(
+                        f"not retrying {api_method} for {chat_id}, since telegram may have processed it"
+                    )
+                    break
+                self.rate_limiter.back_off(2 ** (attempt - 1), chat_id)
+                continue
+
+            error_code = int(response.get("error_code") or 0)
+            if response.get("ok") or (error_code != 429 and error_code < 500):
+                break
+
+            if error_code >= 500:
+                logger.warning(
+                    f"{api_method} request for {chat_id} failed on attempt {attempt} - {error_code} {response.get('description')}"
+                )
+                self.rate_limiter.back_off(2 ** (attempt - 1), chat_id)
+                continue
+
+            retry_after = float(
+                response.get("parameters", {}).get("retry_after", 2 ** (attempt - 1))
+            )
+            logger.warning(
+                f"rate limited by telegram on {api_method} for {chat_id}, retrying after {retry_after}s"
+            )
+            # Flood limits are often for the whole bot, not just the chat, so every chat waits
+            self.rate_limiter.back_off(retry_after)
+
+        return response, attempt
+
+    def send(
+        self,
+        api_method: str,
+        chat_id: str,
+        data: dict[str, Any],
+        files: Optional[dict[str, Any]] = None,
+    ) -> DeliveryResult:
+        """
+        Sends a request to a single chat and measures how long it took to be delivered
+
+        Parameters
+        ----------
+        api_method : str
+            The Bot API method, like "sendMessage"
+        chat_id : str
+            Unique identifier for the target chat or username of the target channel (in the format @channelusername)
+        data : dict[str, Any]
+            Form data to send. The chat ID is added to it
+        files : Optional[dict[str, Any]]
+            Files to upload, in the format accepted by `requests`
+
+        Returns
+        -------
+        DeliveryResult
+            The result of the delivery
+
+        Examples
+        --------
+        >>> client.send("sendMessage", "123456789", {"text": "test"})
+        <DeliveryResult [123456789 - ok in 0.212s after 1 attempt(s)]>
+        """
+        start = perf_counter()
+        response, attempts = self.call(
+            api_method, {**data, "chat_id": chat_id}, files, chat_id
+        )
+        result = DeliveryResult(
+            chat_id,
+            bool(response.get("ok")),
+            response,
+            perf_counter() - start,
+            attempts,
+        )
+
+        if not result.ok:
+            logger.error(
+                f"could not sent message to {chat_id}. Error - {response.get('description')}"
+            )
+        else:
+            logger.debug(
+                "succesfully sent message to {} in {:.0f} ms",
+                chat_id,
+                result.latency * 1000,
+            )
+        return result
+
+    def fan_out(
+        self,
+        api_method: str,
+        chat_ids: list[str],
+        build_request: RequestBuilder,
+    ) -> list[DeliveryResult]:
+        """
+        Sends a request to every chat concurrently, using at most `max_workers` workers.
+
+        Parameters
+        ----------
+        api_method : str
+            The Bot API method, like "sendMessage"
+        chat_ids : list[str]
+            List of unique identifiers for the target chat or username of the target channel (in the format @channelusername)
+        build_request : Callable[[str], tuple[dict[str, Any], Optional[dict[str, Any]]]]
+            Given a chat ID, returns the form data and files to send to it
+
+        Returns
+        -------
+        list[DeliveryResult]
+            The result of every delivery, in the same order as chat_ids
+
+        Examples
+        --------
+        >>> client.fan_out("sendMessage", ["123", "@sgb_advisor"], lambda _: ({"text": "test"}, None))
+        [<DeliveryResult [123 - ok in 0.212s after 1 attempt(s)]>, <DeliveryResult [@sgb_advisor - ok in 0.251s after 1 attempt(s)]>]
+        """
+
+        def deliver(chat_id: str) -> DeliveryResult:
+            data, files = build_request(chat_id)
+            return self.send(api_method, chat_id, data, files)
+
+        with ThreadPoolExecutor(
+            max_workers=min(self.max_workers, max(1, len(chat_ids))),
+            thread_name_prefix="telegram",
+        ) as executor:
+            results = list(executor.map(deliver, chat_ids))
+
+        log_delivery_latencies(api_method, results)
+        return results
+
+
+def log_delivery_latencies(api_method: str, results: list[DeliveryResult]) -> None:
+    """Logs the median and worst per-chat latency of a fan out"""
+    if not results:
+        return
+    latencies = [result.latency for result in results]
+    logger.info(
+        f"{api_method} delivered to {sum(result.ok for result in results)}/{len(results)} chat(s) - "
+        f"p50 {median(latencies) * 1000:.0f} ms, max {max(latencies) * 1000:.0f} ms"
+    )
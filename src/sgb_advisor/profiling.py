@@ -0,0 +1,179 @@
+"""
+Opt-in profiling of each stage of a run. Set SGB_PROFILE to "cpu" or "wall" to profile the stages with cProfile, timing CPU time or wall time, or to "alloc" to trace what they allocate with tracemalloc. Every stage writes its profile to the "profiles" folder of SGB_ARTIFACT_DIR, and its top hotspots to a summary of the run next to it.
+
+    with profile_stage("fetch"):
+        sgbs = get_sgbs(config)
+
+The .prof files can be opened with `python -m pstats` or tools like snakeviz. cProfile only sees the thread it was started in, so for stages that fan out to threads, like notifying, it shows the time spent waiting on them rather than what they did.
+
+With SGB_PROFILE unset, `profile_stage()` returns the same no-op context manager every time, and neither cProfile nor tracemalloc is imported.
+"""
+
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from functools import lru_cache
+from io import StringIO
+from os import getenv
+from pathlib import Path
+from time import perf_counter, process_time
+from typing import ContextManager, Iterator
+
+from .config import ARTIFACT_DIR
+from .logg import logger
+
+PROFILE_ENV: str = "SGB_PROFILE"
+CPU_PROFILE: str = "cpu"
+WALL_PROFILE: str = "wall"
+ALLOC_PROFILE: str = "alloc"
+PROFILE_MODES: tuple[str, ...] = (CPU_PROFILE, WALL_PROFILE, ALLOC_PROFILE)
+
+PROFILE_MODE: str = getenv(PROFILE_ENV, "").strip().casefold()
+"""One of PROFILE_MODES, or empty to not profile"""
+
+PROFILE_DIR: Path = ARTIFACT_DIR / "profiles"
+"""Folder the profiles and summaries are written to"""
+
+PROFILE_TOP_N: int = int(getenv("SGB_PROFILE_TOP_N", "20") or 20)
+"""Hotspots of each stage written to the summary"""
+
+_run_id: str = datetime.now().strftime("%Y-%m-%d %H-%M-%S")
+"""Prefix of every file written by this process, so the stages of one run sort together"""
+
+_no_profile: ContextManager[None] = nullcontext()
+
+
+@lru_cache(maxsize=None)
+def get_profile_mode() -> str:
+    """Returns PROFILE_MODE, or an empty string if it isn't one of PROFILE_MODES. Warns about an unknown mode only once"""
+    if PROFILE_MODE and PROFILE_MODE not in PROFILE_MODES:
+        logger.warning(
+            f'unknown {PROFILE_ENV} "{PROFILE_MODE}", not profiling. Use one of {", ".join(PROFILE_MODES)}'
+        )
+        return ""
+    return PROFILE_MODE
+
+
+def profile_stage(name: str) -> ContextManager[None]:
+    """
+    Profiles the code inside it as a stage of the run, if SGB_PROFILE is set. Profiling never fails the stage, only logs why it couldn't profile.
+
+    Parameters
+    ----------
+    name : str
+        Name of the stage, used in the names of the files written
+
+    Returns
+    -------
+    ContextManager[None]
+        The profiler, or a no-op if profiling is off
+
+    Examples
+    --------
+    >>> with profile_stage("notify"):
+    ...     notify(sgbs, config)
+    """
+    mode = get_profile_mode() if PROFILE_MODE else ""
+    if not mode:
+        return _no_profile
+    if mode == ALLOC_PROFILE:
+        return profile_allocations(name)
+    return profile_time(name, mode)
+
+
+def get_profile_path(name: str, suffix: str) -> Path:
+    """Path a stage's profile is written to, like "2024-11-20 10-00-00 fetch.prof" """
+    return PROFILE_DIR / f"{_run_id} {name}.{suffix}"
+
+
+def write_profile_summary(name: str, mode: str, seconds: float, report: str) -> None:
+    """Appends the top hotspots of a stage to the summary of the run"""
+    path = get_profile_path("summary", "txt")
+    try:
+        PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+        with path.open("a") as f:
+            f.write(f"=== {name} ({mode}) took {seconds:.3f}s ===\n{report}\n")
+    except OSError as e:
+        logger.error(f"could not write profile summary to {path} - {e}")
+        return
+    logger.info(f"profiled {name} ({mode}), hotspots written to {path}")
+
+
+@contextmanager
+def profile_time(name: str, mode: str) -> Iterator[None]:
+    """Profiles a stage with cProfile, timing CPU time for CPU_PROFILE and wall time for WALL_PROFILE"""
+    from cProfile import Profile
+    from pstats import SortKey, Stats
+
+    profiler = Profile(process_time) if mode == CPU_PROFILE else Profile()
+    try:
+        profiler.enable()
+    except ValueError as e:
+        # Another profiler, like a debugger or an outer stage, is already running
+        logger.warning(f"could not profile {name} - {e}")
+        yield
+        return
+
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        seconds = perf_counter() - start
+
+        path = get_profile_path(name, "prof")
+        report = StringIO()
+        try:
+            PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+            profiler.dump_stats(path)
+            report.write(f"Profile written to {path}\n")
+        except OSError as e:
+            logger.error(f"could not write profile to {path} - {e}")
+
+        # Own time finds what burns CPU, cumulative time finds what is waited on
+        Stats(profiler, stream=report).sort_stats(
+            SortKey.TIME if mode == CPU_PROFILE else SortKey.CUMULATIVE
+        ).print_stats(PROFILE_TOP_N)
+        write_profile_summary(name, mode, seconds, report.getvalue())
+
+
+@contextmanager
+def profile_allocations(name: str) -> Iterator[None]:
+    """Traces the memory a stage allocates with tracemalloc, and the peak it reached"""
+    import tracemalloc
+
+    started_here = not tracemalloc.is_tracing()
+    if started_here:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    before = tracemalloc.take_snapshot()
+
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        seconds = perf_counter() - start
+        after = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        if started_here:
+            tracemalloc.stop()
+
+        ignore_tracemalloc = [tracemalloc.Filter(False, tracemalloc.__file__)]
+        stats = after.filter_traces(ignore_tracemalloc).compare_to(
+            before.filter_traces(ignore_tracemalloc), "lineno"
+        )
+
+        path = get_profile_path(name, "alloc.txt")
+        header = f"Peak traced memory {peak / 1024 / 1024:.1f} MiB. Allocated since the stage started, by line -\n"
+        try:
+            PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+            path.write_text(header + "\n".join(str(stat) for stat in stats) + "\n")
+            header = f"Profile written to {path}\n{header}"
+        except OSError as e:
+            logger.error(f"could not write profile to {path} - {e}")
+
+        write_profile_summary(
+            name,
+            ALLOC_PROFILE,
+            seconds,
+            header + "\n".join(str(stat) for stat in stats[:PROFILE_TOP_N]) + "\n",
+        )
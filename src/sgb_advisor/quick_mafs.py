@@ -1,5 +1,6 @@
 from calendar import monthrange
 from datetime import date, datetime
+from typing import Optional
 
 from pyxirr import xirr
 
@@ -7,30 +8,27 @@ from .logg import logger
 from .models import SGB
 
 
-def calculate_sgb_xirr(sgb: SGB, current_gold_price: float) -> float:
+def get_interest_payment_dates(maturity: date, today: date) -> list[date]:
     """
-    Calculates the XIRR on an SGB. It assumes you are buying at the last traded price and that the RBI will redeem it only at the current price set by IBJA.
+    Returns the dates the remaining interest of an SGB is paid on, every 6 months up to and including its maturity
 
     Parameters
     ----------
-    sgb : SGB
-        The SGB object
-    current_gold_price: float
-        The price of gold
+    maturity : date
+        The date of maturity of the SGB. Interest is paid on the same day of its month, and of the month 6 months away
+    today : date
+        Only dates after this are returned
 
     Returns
     -------
-    float
-        Returns the calculated XIRR in percentage terms, rounded to 3 digits
+    list[date]
+        The payment dates, in order
 
     Examples
     --------
-    >>> calculate_sgb_xirr(SGB_object, 7490)
-    13.90
+    >>> get_interest_payment_dates(date(2025, 8, 31), date(2024, 11, 20))
+    [datetime.date(2025, 2, 28), datetime.date(2025, 8, 31)]
     """
-    maturity = sgb.maturity_date
-    today: date = datetime.now().date()
-
     payment_dates: list[date] = list()
 
     other_interest_payment_month: int = (
@@ -52,6 +50,39 @@ def calculate_sgb_xirr(sgb: SGB, current_gold_price: float) -> float:
         if today < _date_to_check <= maturity:
             payment_dates.append(_date_to_check)
 
+    return payment_dates
+
+
+def calculate_sgb_xirr(
+    sgb: SGB, current_gold_price: float, as_of: Optional[date] = None
+) -> float:
+    """
+    Calculates the XIRR on an SGB. It assumes you are buying at the last traded price and that the RBI will redeem it only at the current price set by IBJA.
+
+    Parameters
+    ----------
+    sgb : SGB
+        The SGB object
+    current_gold_price: float
+        The price of gold
+    as_of : Optional[date]
+        The day the SGB is bought on. Defaults to today
+
+    Returns
+    -------
+    float
+        Returns the calculated XIRR in percentage terms, rounded to 3 digits
+
+    Examples
+    --------
+    >>> calculate_sgb_xirr(SGB_object, 7490)
+    13.90
+    """
+    maturity = sgb.maturity_date
+    today: date = as_of or datetime.now().date()
+
+    payment_dates = get_interest_payment_dates(maturity, today)
+
     amounts = [sgb.issue_price * sgb.interest_rate / 100] * len(payment_dates)
 
     # Since you are buying the bond now at it's LTP, the cashflow is negative as it is flowing out of your pocket.
@@ -70,7 +101,10 @@ def calculate_sgb_xirr(sgb: SGB, current_gold_price: float) -> float:
     if not x:
         logger.error(f"couldn't calculate XIRR for {sgb.nse_symbol}")
         logger.debug(
-            f"Dump for {sgb.nse_symbol}:-\npayment_dates : {payment_dates}\namounts : {amounts}"
+            "Dump for {}:-\npayment_dates : {}\namounts : {}",
+            sgb.nse_symbol,
+            payment_dates,
+            amounts,
         )
         return 0
 
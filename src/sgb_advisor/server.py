@@ -0,0 +1,378 @@
+"""
+Read only HTTP API over the history store. Every response body is serialised and gzipped once when a new run is recorded, so polling clients are served from memory, and clients that already have the latest body get a 304 from its ETag or Last-Modified.
+
+Endpoints -
+    /latest          the most recent run, in the same format as the JSON file sent on Telegram
+    /history         every run, with its time and gold price
+    /sgbs            the symbols in the most recent run
+    /sgbs/<SYMBOL>   the latest quote and full history of one SGB
+"""
+
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from gzip import compress as gzip_compress
+from hashlib import sha256
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from json import dumps as json_dumps
+from os import getenv
+from threading import Thread
+from time import sleep
+from typing import Any, NamedTuple, Optional
+
+from .history import (
+    get_history_db_path,
+    get_latest_run,
+    get_latest_run_id,
+    get_quotes,
+    get_runs,
+    sgb_from_quote,
+)
+from .logg import logger
+from .metrics import export_metrics_periodically
+from .models import Results
+from .notify.common import DISCLAIMER_URL, get_json_representation
+
+SERVE_HOST_ENV: str = "SGB_SERVE_HOST"
+SERVE_HOST: str = getenv(SERVE_HOST_ENV, "127.0.0.1") or "127.0.0.1"
+"""Address the API listens on"""
+
+SERVE_PORT_ENV: str = "SGB_SERVE_PORT"
+SERVE_PORT: int = int(getenv(SERVE_PORT_ENV, "8080") or 8080)
+"""Port the API listens on"""
+
+SERVE_REFRESH_INTERVAL_ENV: str = "SGB_SERVE_REFRESH_INTERVAL"
+SERVE_REFRESH_INTERVAL: float = float(getenv(SERVE_REFRESH_INTERVAL_ENV, "30") or 30)
+"""Seconds between checks of the history store for a new run. Also used as the max-age of responses"""
+
+GZIP_MIN_SIZE: int = 512
+"""Bodies smaller than these many bytes aren't worth compressing"""
+
+
+class Body(NamedTuple):
+    """A response body, serialised and compressed ahead of time"""
+
+    raw: bytes
+    """The JSON"""
+
+    gzipped: Optional[bytes]
+    """The JSON compressed with gzip. `None` if the JSON is too small to be worth it"""
+
+    etag: str
+    """Strong ETag of the JSON, quoted. The gzipped body's ETag has "-gzip" added before the closing quote"""
+
+    status: int = 200
+    """Status code the body is sent with"""
+
+
+def make_body(obj: dict[str, Any] | str, status: int = 200) -> Body:
+    """
+    Serialises a payload and compresses it once, so that it can be sent any number of times without any more work
+
+    Parameters
+    ----------
+    obj : dict[str, Any] | str
+        The payload, or its JSON if already serialised
+    status : int
+        Status code the body is sent with. Defaults to 200
+
+    Returns
+    -------
+    Body
+        The serialised body
+
+    Examples
+    --------
+    >>> make_body({"runs": []})
+    Body(raw=b'{"runs": []}', gzipped=None, etag='"5c4fb2a4d3c8b1a0"', status=200)
+    """
+    raw = (obj if isinstance(obj, str) else json_dumps(obj, indent=None)).encode()
+    return Body(
+        raw,
+        # mtime=0 so the same JSON always compresses to the same bytes
+        gzip_compress(raw, compresslevel=9, mtime=0)
+        if len(raw) >= GZIP_MIN_SIZE
+        else None,
+        f'"{sha256(raw).hexdigest()[:16]}"',
+        status,
+    )
+
+
+NOT_FOUND_BODY: Body = make_body({"error": "not found"}, 404)
+
+
+class Snapshot(NamedTuple):
+    """Every body the API serves, built from one state of the history store. Swapped as a whole when a new run is recorded"""
+
+    run_id: Optional[int]
+    """ID of the most recent run the bodies were built from. `None` if nothing has been recorded yet"""
+
+    bodies: dict[str, Body]
+    """Maps a path to its body"""
+
+    last_modified: datetime
+    """When the bodies were built"""
+
+
+def build_snapshot() -> Snapshot:
+    """
+    Reads the history store and builds the body of every endpoint
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    Snapshot
+        The bodies of every endpoint
+
+    Examples
+    --------
+    >>> build_snapshot()
+    Snapshot(run_id=42, bodies={"/latest": Body(...), "/history": Body(...), ...}, last_modified=datetime.datetime(...))
+    """
+    latest = get_latest_run()
+    runs = get_runs()
+
+    bodies: dict[str, Body] = {
+        "/history": make_body(
+            {"disclaimer": DISCLAIMER_URL, "runs": runs},
+        )
+    }
+
+    if latest is None:
+        bodies["/latest"] = make_body({"error": "no runs recorded yet"}, 404)
+        bodies["/sgbs"] = make_body({"symbols": []})
+        return Snapshot(None, bodies, datetime.now(timezone.utc))
+
+    results = Results(
+        tuple(sgb_from_quote(quote) for quote in latest["quotes"]),
+        latest["gold_price"],
+        datetime.fromisoformat(latest["run_at"]),
+    )
+    bodies["/latest"] = make_body(get_json_representation(results))
+    bodies["/sgbs"] = make_body({"symbols": [sgb.nse_symbol for sgb in results.sgbs]})
+
+    run_times = {run["id"]: run["run_at"] for run in runs}
+    latest_sgbs = {sgb.nse_symbol: sgb.to_dict() for sgb in results.sgbs}
+    histories: dict[str, list[dict[str, Any]]] = dict()
+    for quote in get_quotes():
+        histories.setdefault(quote["symbol"], list()).append(
+            {
+                "time": run_times.get(quote["run_id"]),
+                "date": quote["date"],
+                "ltp": quote["ltp"],
+                "volume": quote["volume"],
+                "xirr": quote["xirr"],
+                "gold_price": quote["gold_price"],
+            }
+        )
+
+    for symbol, history in histories.items():
+        bodies[f"/sgbs/{symbol}"] = make_body(
+            {
+                "symbol": symbol,
+                "disclaimer": DISCLAIMER_URL,
+                "latest": latest_sgbs.get(symbol),
+                "history": history,
+            }
+        )
+
+    logger.opt(lazy=True).debug(
+        "built {} API bodies from run {}, totalling {} bytes",
+        lambda: len(bodies),
+        lambda: latest["id"],
+        lambda: sum(len(body.raw) for body in bodies.values()),
+    )
+    return Snapshot(latest["id"], bodies, datetime.now(timezone.utc))
+
+
+def accepts_gzip(accept_encoding: str) -> bool:
+    """
+    Whether the client accepts gzip, from the value of its Accept-Encoding header
+
+    Parameters
+    ----------
+    accept_encoding : str
+        Value of the header
+
+    Returns
+    -------
+    bool
+        True if gzip (or *) is listed without q=0
+
+    Examples
+    --------
+    >>> accepts_gzip("gzip, deflate, br")
+    True
+    >>> accepts_gzip("gzip;q=0, identity")
+    False
+    """
+    for coding in accept_encoding.split(","):
+        name, _, params = coding.strip().partition(";")
+        if name.strip().casefold() not in {"gzip", "*"}:
+            continue
+        q = params.strip().casefold().removeprefix("q=")
+        try:
+            return not params or float(q) > 0
+        except ValueError:
+            return True
+    return False
+
+
+class APIServer(ThreadingHTTPServer):
+    """Threaded HTTP server that holds the current snapshot. Requests only read it, and a background thread replaces it"""
+
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], refresh_interval: float) -> None:
+        super().__init__(address, APIRequestHandler)
+
+        self.refresh_interval = refresh_interval
+        """Seconds between checks for a new run"""
+
+        self.snapshot: Snapshot = build_snapshot()
+        """Bodies served to clients"""
+
+    def refresh(self) -> bool:
+        """Rebuilds the snapshot if a new run has been recorded since it was built, and returns whether it did"""
+        if get_latest_run_id() == self.snapshot.run_id:
+            return False
+        self.snapshot = build_snapshot()
+        logger.info(f"serving run {self.snapshot.run_id}")
+        return True
+
+    def refresh_forever(self) -> None:
+        while True:
+            sleep(self.refresh_interval)
+            try:
+                self.refresh()
+            except Exception as e:
+                # Keep serving the last snapshot until the store can be read again
+                logger.error(f"could not refresh the API from the history store - {e}")
+            export_metrics_periodically()
+
+
+class APIRequestHandler(BaseHTTPRequestHandler):
+    """Serves the bodies of the server's snapshot, with conditional requests and gzip"""
+
+    server: APIServer
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self) -> None:
+        self.send_body(head=False)
+
+    def do_HEAD(self) -> None:
+        self.send_body(head=True)
+
+    def send_body(self, head: bool) -> None:
+        # Read once, so a refresh in the middle of a request can't mix two snapshots
+        snapshot = self.server.snapshot
+
+        path = self.path.split("?", 1)[0].rstrip("/") or "/"
+        if path.startswith("/sgbs/"):
+            path = path.upper().replace("/SGBS/", "/sgbs/", 1)
+        body = snapshot.bodies.get(path, NOT_FOUND_BODY)
+
+        use_gzip = body.gzipped is not None and accepts_gzip(
+            self.headers.get("Accept-Encoding", "")
+        )
+        etag = body.etag[:-1] + '-gzip"' if use_gzip else body.etag
+        last_modified = format_datetime(snapshot.last_modified, usegmt=True)
+
+        if body.status == 200 and self.is_not_modified(etag, snapshot.last_modified):
+            self.send_response(304)
+            self.send_cache_headers(etag, last_modified)
+            self.end_headers()
+            return
+
+        content = body.gzipped if use_gzip and body.gzipped else body.raw
+        self.send_response(body.status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(content)))
+        if use_gzip:
+            self.send_header("Content-Encoding", "gzip")
+        if body.status == 200:
+            self.send_cache_headers(etag, last_modified)
+        self.end_headers()
+        if not head:
+            self.wfile.write(content)
+
+    def send_cache_headers(self, etag: str, last_modified: str) -> None:
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", last_modified)
+        self.send_header(
+            "Cache-Control", f"public, max-age={int(self.server.refresh_interval)}"
+        )
+        self.send_header("Vary", "Accept-Encoding")
+
+    def is_not_modified(self, etag: str, last_modified: datetime) -> bool:
+        """Whether the client's cached copy is still current. If-None-Match takes precedence over If-Modified-Since"""
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match is not None:
+            tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+            return "*" in tags or etag in tags
+
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_modified_since is None:
+            return False
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        # HTTP dates only have seconds
+        return since >= last_modified.replace(microsecond=0)
+
+    def log_message(self, format: str, *args: object) -> None:
+        logger.opt(lazy=True).debug(
+            "{} - {}", self.address_string, lambda: format % args
+        )
+
+
+def serve(
+    host: str = SERVE_HOST,
+    port: int = SERVE_PORT,
+    refresh_interval: float = SERVE_REFRESH_INTERVAL,
+) -> int:
+    """
+    Serves the API until interrupted
+
+    Parameters
+    ----------
+    host : str
+        Address to listen on. Defaults to SGB_SERVE_HOST
+    port : int
+        Port to listen on. Defaults to SGB_SERVE_PORT
+    refresh_interval : float
+        Seconds between checks for a new run. Defaults to SGB_SERVE_REFRESH_INTERVAL
+
+    Returns
+    -------
+    int
+        0 once the server has been stopped
+
+    Examples
+    --------
+    >>> serve("0.0.0.0", 8080)
+    0
+    """
+    if not get_history_db_path():
+        msg = "the API serves from the history store, which is disabled since SGB_HISTORY_DB_PATH is set to an empty string"
+        logger.error(msg)
+        raise RuntimeError(msg)
+
+    server = APIServer((host, port), refresh_interval)
+    Thread(target=server.refresh_forever, name="api-refresh", daemon=True).start()
+
+    logger.info(
+        f"serving run {server.snapshot.run_id} on http://{host}:{server.server_port}"
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("stopping the API")
+    finally:
+        server.server_close()
+    return 0
@@ -0,0 +1,188 @@
+"""
+Reads and writes snapshots, the inputs of a run saved as JSON, so that the maths, rendering and notifying can be run again without scraping. Nothing here imports Playwright.
+
+A snapshot is any of
+    - a raw scrape saved with `sgb-advisor run --save-snapshot FILE`, whose SGBs have no XIRR yet
+    - the output of `sgb-advisor compute`, in the format of `Results.to_dict()`
+    - the JSON file sent on Telegram, or `assets/sample_data.json`
+"""
+
+from datetime import date, datetime
+from json import JSONDecodeError
+from json import dumps as json_dumps
+from json import loads as json_loads
+from pathlib import Path
+from time import perf_counter
+from typing import Any, Optional
+
+from .logg import logger
+from .metrics import span
+from .models import SGB, Results
+from .quick_mafs import calculate_sgb_xirr
+
+
+SNAPSHOT_ERRORS: tuple[type[Exception], ...] = (
+    JSONDecodeError,
+    KeyError,
+    TypeError,
+    ValueError,
+)
+"""Errors `parse_snapshot()` raises for a file that isn't a snapshot"""
+
+
+def parse_snapshot(content: str | bytes) -> tuple[Results, bool]:
+    """
+    Parses the JSON of a snapshot
+
+    Parameters
+    ----------
+    content : str | bytes
+        The JSON
+
+    Returns
+    -------
+    tuple[Results, bool]
+        The results in the snapshot, and whether every SGB in it already has its XIRR
+
+    Raises
+    ------
+    JSONDecodeError, KeyError, TypeError or ValueError
+        If the JSON isn't a snapshot. Look at SNAPSHOT_ERRORS
+
+    Examples
+    --------
+    >>> parse_snapshot('{"sgbs": [], "date": "2024-09-22", "gold_price": 1000}')
+    (Results(sgbs=(), gold_price=1000.0, generated_at=datetime.datetime(2024, 9, 22, 0, 0)), True)
+    """
+    d: dict[str, Any] = json_loads(content)
+    sgbs: list[dict[str, Any]] = d["sgbs"]
+    # Results.to_dict() has "generated_at", the Telegram JSON has "time", and the sample data only has "date"
+    generated_at = datetime.fromisoformat(
+        str(d.get("generated_at") or d.get("time") or d["date"])
+    )
+    results = Results(
+        tuple(SGB.from_dict(sgb) for sgb in sgbs), float(d["gold_price"]), generated_at
+    )
+    return results, all("xirr" in sgb for sgb in sgbs)
+
+
+def read_snapshot(path: Path) -> tuple[Results, bool]:
+    """
+    Reads a snapshot from a file. Look at `parse_snapshot()`
+
+    Parameters
+    ----------
+    path : Path
+        Path of the JSON file
+
+    Returns
+    -------
+    tuple[Results, bool]
+        The results in the snapshot, and whether every SGB in it already has its XIRR
+
+    Examples
+    --------
+    >>> read_snapshot(Path("src/sgb_advisor/assets/sample_data.json"))
+    (Results(sgbs=(), gold_price=1000.0, generated_at=datetime.datetime(2024, 9, 22, 0, 0)), True)
+    """
+    try:
+        results, has_xirrs = parse_snapshot(path.read_bytes())
+    except (OSError, *SNAPSHOT_ERRORS) as e:
+        msg = f"could not read snapshot {path} - {e!r}"
+        logger.error(msg)
+        raise RuntimeError(msg)
+
+    logger.debug("read {} SGBs from snapshot {}", len(results.sgbs), path)
+    return results, has_xirrs
+
+
+def write_snapshot(path: Path, results: Results) -> Path:
+    """
+    Writes results to a file, in the format of `Results.to_dict()`
+
+    Parameters
+    ----------
+    path : Path
+        Path of the JSON file. Its folder is created if it doesn't exist
+    results : Results
+        The results to save
+
+    Returns
+    -------
+    Path
+        The path the snapshot was written to
+
+    Examples
+    --------
+    >>> write_snapshot(Path("snapshot.json"), results)
+    Path("snapshot.json")
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json_dumps(results.to_dict(), indent=4))
+    logger.info(f"saved snapshot of {len(results.sgbs)} SGBs to {path}")
+    return path
+
+
+def compute_results(results: Results, as_of: Optional[date] = None) -> Results:
+    """
+    Calculates the XIRR of every SGB again from the price of gold in the results, and sorts them in descending order of XIRR
+
+    Parameters
+    ----------
+    results : Results
+        The results, with or without XIRRs
+    as_of : Optional[date]
+        The day the SGBs are bought on. Defaults to today
+
+    Returns
+    -------
+    Results
+        New results. The SGBs passed in aren't changed
+
+    Examples
+    --------
+    >>> compute_results(results)
+    Results(sgbs=(SGB1, SGB2), gold_price=7956.0, generated_at=datetime.datetime(...))
+    """
+    start = perf_counter()
+
+    with span("compute", sgbs=len(results.sgbs)):
+        sgbs = [SGB.from_dict(sgb.to_dict()) for sgb in results.sgbs]
+        for sgb in sgbs:
+            sgb.xirr = calculate_sgb_xirr(sgb, results.gold_price, as_of)
+        sgbs.sort(key=lambda x: x.xirr, reverse=True)
+
+    logger.debug(
+        "computed XIRRs of {} SGBs in {:.1f} ms",
+        len(sgbs),
+        (perf_counter() - start) * 1000,
+    )
+    return results._replace(sgbs=tuple(sgbs))
+
+
+def load_snapshot(path: Path, recompute: bool = False) -> Results:
+    """
+    Reads a snapshot with `read_snapshot()`, and computes the XIRRs as of the day it was taken with `compute_results()` if asked to or if the snapshot doesn't have them
+
+    Parameters
+    ----------
+    path : Path
+        Path of the JSON file
+    recompute : bool
+        Calculate the XIRRs again even if the snapshot has them. Defaults to False
+
+    Returns
+    -------
+    Results
+        The results, sorted in descending order of XIRR
+
+    Examples
+    --------
+    >>> load_snapshot(Path("snapshot.json"))
+    Results(sgbs=(SGB1, SGB2), gold_price=7956.0, generated_at=datetime.datetime(...))
+    """
+    results, has_xirrs = read_snapshot(path)
+    if recompute or not has_xirrs:
+        # As of the day of the snapshot, like `process_snapshot()` in batch, so replaying it gives the same XIRRs on any day
+        return compute_results(results, results.generated_at.date())
+    return results